@@ -1,22 +1,135 @@
 import asyncio
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from llama_index.agent.openai import OpenAIAgent
-from llama_index.core import PromptTemplate
+from llama_index.core import PromptTemplate, QueryBundle
+from llama_index.core.base.response.schema import RESPONSE_TYPE
 from llama_index.core.postprocessor import LLMRerank
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.retrievers import BaseRetriever
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from slugify import slugify
 
 from indexing import IndexBuilder
-from node_prcessors import PageGroupPostprocessor
+from node_prcessors import (PageGroupPostprocessor,
+                            TokenBudgetPageGroupPostprocessor)
 from prompts import (ESG_AGENT_PROMPT_EN, INDUSTRY_AGENT_PROMPT,
                      INDUSTRY_AGENT_PROMPT_EN, NOTES_AGENT_PROMPT,
                      NOTES_AGENT_PROMPT_EN, TEXT_QA_TEMPLATE)
+from retrievers import (ConsolidatedRetriever, HybridRetriever,
+                        aretrieve_batch, union_nodes)
+from vector_store import ConsolidatedVectorStore
+
+# 向量與關鍵字檢索各自取回的候選節點數
+CANDIDATE_TOP_K = 20
+# 送入整頁展開與合成的節點數
+RERANK_TOP_N = 10
+
+
+class CompanyQueryEngine:
+    """
+    直接以公司的 query engine 回答子問題，不經過 OpenAIAgent 的工具呼叫，
+    省下 agent 決定呼叫工具與改寫工具結果的兩次 LLM 往返。
+
+    介面與 agent 的 aquery 相同，另外可以一次回答同一家公司的多個子問題。
+    """
+
+    def __init__(
+        self,
+        esg_title: str,
+        query_engine: RetrieverQueryEngine,
+        node_postprocessors: Optional[list[BaseNodePostprocessor]] = None,
+    ) -> None:
+        """
+        Args:
+            esg_title (str): 公司名稱
+            query_engine (RetrieverQueryEngine): 公司的 query engine
+            node_postprocessors (Optional[list[BaseNodePostprocessor]]): 與
+                query engine 相同的 postprocessor，合併多個子問題的檢索結果後套用
+        """
+        self.esg_title = esg_title
+        self.query_engine = query_engine
+        self.node_postprocessors = node_postprocessors or []
+
+    async def aquery(self, query: str) -> RESPONSE_TYPE:
+        return await self.query_engine.aquery(query)
+
+    async def aquery_many(
+        self,
+        queries: list[str],
+        embeddings: Optional[list[list[float]]] = None,
+    ) -> RESPONSE_TYPE:
+        """
+        以一次批次檢索與一次合成回答多個子問題：所有子問題以一次 embedding 請求
+        向量化並一起評分，檢索結果去除重複後才經過 postprocessor(LLMRerank、整頁展開)。
+
+        Args:
+            queries (list[str]): 同一家公司的子問題
+            embeddings (Optional[list[list[float]]]): 已經算好的子問題向量
+        """
+        query_bundles = [
+            QueryBundle(query, embedding=embeddings[i] if embeddings else None)
+            for i, query in enumerate(queries)
+        ]
+        if len(query_bundles) == 1:
+            return await self.query_engine.aquery(query_bundles[0])
+        batches = await aretrieve_batch(self.query_engine.retriever, query_bundles)
+        query_bundle = QueryBundle(
+            "\n".join(f"{i}. {query}" for i, query in enumerate(queries, start=1))
+        )
+        nodes = union_nodes(batches)
+        for node_postprocessor in self.node_postprocessors:
+            nodes = await node_postprocessor.apostprocess_nodes(
+                nodes, query_bundle=query_bundle
+            )
+        return await self.query_engine.asynthesize(query_bundle, nodes)
 
 
 class AgentBuilder:
-    def __init__(self, esg_dir_path: str) -> None:
+    def __init__(
+        self,
+        esg_dir_path: str,
+        consolidated_store: Optional[ConsolidatedVectorStore] = None,
+        page_token_budget: int = 0,
+        hybrid: bool = True,
+        llm_rerank: bool = False,
+        direct: bool = False,
+        vector_dtype: str = "float32",
+        vector_dims: int = 0,
+        rescore: int = 0,
+    ) -> None:
+        """
+        Args:
+            esg_dir_path (str): 存放各公司報告書索引的目錄
+            consolidated_store (Optional[ConsolidatedVectorStore]): 合併的向量矩陣，
+                有提供時公司的向量檢索改由它執行
+            page_token_budget (int): 整頁展開後送入合成的 token 上限，0 表示不限制
+            hybrid (bool): 是否以 RRF 合併向量與 BM25 關鍵字檢索的結果
+            llm_rerank (bool): 是否再以 LLMRerank 重新排序，每次檢索會多呼叫 LLM
+            direct (bool): 是否以 CompanyQueryEngine 直接查詢，取代 OpenAIAgent
+            vector_dtype (str): JSON 格式的向量載入後壓縮的精度
+            vector_dims (int): JSON 格式的向量載入後截斷的維度，0 表示不截斷
+            rescore (int): 以全精度向量重新計算 top_k * rescore 個候選的分數
+        """
         self.esg_dir_path = esg_dir_path
+        self.consolidated_store = consolidated_store
+        self.page_token_budget = page_token_budget
+        self.hybrid = hybrid
+        self.llm_rerank = llm_rerank
+        self.direct = direct
+        self.vector_dtype = vector_dtype
+        self.vector_dims = vector_dims
+        self.rescore = rescore
+        # 每家公司最近一次建立 agent 所花的秒數
+        self.load_times: dict[str, float] = {}
 
     # Build industry and note agent
     async def build_industry_note_agent(self, doc) -> tuple[OpenAIAgent, OpenAIAgent]:
@@ -53,23 +166,96 @@ class AgentBuilder:
 
         return industry_agent, notes_agent
 
-    def build_esg_agent(self, esg_title: str):
+    def build_query_engine(self, esg_title: str) -> RetrieverQueryEngine:
+        return self._query_engine(*self.build_retrieval(esg_title))
+
+    def _query_engine(
+        self,
+        retriever: BaseRetriever,
+        node_postprocessors: list[BaseNodePostprocessor],
+    ) -> RetrieverQueryEngine:
+        return RetrieverQueryEngine.from_args(
+            retriever,
+            use_async=True,
+            text_qa_template=PromptTemplate(TEXT_QA_TEMPLATE),
+            node_postprocessors=node_postprocessors,
+        )
+
+    def build_retrieval(
+        self, esg_title: str
+    ) -> tuple[BaseRetriever, list[BaseNodePostprocessor]]:
+        """建立公司的 retriever 與檢索後依序套用的 postprocessor。"""
         esg_path = os.path.join(self.esg_dir_path, esg_title)
-        vector_index = IndexBuilder().build_vector_index(
+        index_builder = IndexBuilder()
+        vector_index = index_builder.build_vector_index(
             persist_path=f"{esg_path}/vector",
         )
         nodes = list(vector_index.docstore.docs.values())
-        text_qa_template = PromptTemplate(TEXT_QA_TEMPLATE)
-        vector_query_engine = vector_index.as_query_engine(
-            similarity_top_k=20,
-            use_async=True,
-            text_qa_template=text_qa_template,
-            node_postprocessors=[
-                LLMRerank(top_n=10),
-                PageGroupPostprocessor(all_nodes_from_doc=nodes),
-            ],
+        consolidated_store = self.consolidated_store
+        if consolidated_store is not None and not consolidated_store.covers(
+            esg_title, f"{esg_path}/vector"
+        ):
+            if esg_title in consolidated_store.ranges:
+                logging.warning(
+                    f"Consolidated vectors for {esg_title} are older than its index, "
+                    "using the company's own vectors; rerun `vector_store.py "
+                    "consolidate` to refresh them"
+                )
+            consolidated_store = None
+        if consolidated_store is None:
+            # 沒有合併矩陣時以公司自己的向量建立，同樣可以批次評分
+            consolidated_store = ConsolidatedVectorStore.from_company_store(
+                esg_title,
+                vector_index.vector_store,
+                self.vector_dtype,
+                self.vector_dims,
+                self.rescore,
+            )
+        # 沒有 LLMRerank 篩選時，直接以檢索排名取前 RERANK_TOP_N 個節點展開整頁
+        top_k = CANDIDATE_TOP_K if self.llm_rerank else RERANK_TOP_N
+        retriever = ConsolidatedRetriever(
+            consolidated_store,
+            {esg_title: vector_index.docstore},
+            companies=[esg_title],
+            similarity_top_k=CANDIDATE_TOP_K if self.hybrid else top_k,
         )
+        if self.hybrid:
+            retriever = HybridRetriever(
+                retriever,
+                index_builder.load_lexical_index(f"{esg_path}/vector", vector_index),
+                vector_index.docstore,
+                similarity_top_k=top_k,
+                lexical_top_k=CANDIDATE_TOP_K,
+            )
+        if self.page_token_budget:
+            page_group = TokenBudgetPageGroupPostprocessor(
+                all_nodes_from_doc=nodes, max_tokens=self.page_token_budget
+            )
+        else:
+            page_group = PageGroupPostprocessor(all_nodes_from_doc=nodes)
+        node_postprocessors = [page_group]
+        if self.llm_rerank:
+            node_postprocessors.insert(0, LLMRerank(top_n=RERANK_TOP_N))
+        return retriever, node_postprocessors
 
+    def build_esg_agent(self, esg_title: str) -> OpenAIAgent | CompanyQueryEngine:
+        """建立公司的 agent，direct 模式下回傳 CompanyQueryEngine。"""
+        start = time.perf_counter()
+        retriever, node_postprocessors = self.build_retrieval(esg_title)
+        vector_query_engine = self._query_engine(retriever, node_postprocessors)
+        if self.direct:
+            agent = CompanyQueryEngine(
+                esg_title, vector_query_engine, node_postprocessors
+            )
+        else:
+            agent = self._wrap_agent(esg_title, vector_query_engine)
+        self.load_times[esg_title] = time.perf_counter() - start
+        logging.info(f"Loaded {esg_title} in {self.load_times[esg_title]:.2f}s")
+        return agent
+
+    def _wrap_agent(
+        self, esg_title: str, vector_query_engine: RetrieverQueryEngine
+    ) -> OpenAIAgent:
         query_engine_tools = [
             QueryEngineTool(
                 query_engine=vector_query_engine,
@@ -79,16 +265,172 @@ class AgentBuilder:
                 ),
             ),
         ]
-        agent = OpenAIAgent.from_tools(
+        return OpenAIAgent.from_tools(
             query_engine_tools,
             verbose=True,
             system_prompt=ESG_AGENT_PROMPT_EN,
         )
-        return agent
 
     def build_esg_agents(
         self,
         esg_titles: list[str],
+        max_workers: Optional[int] = None,
     ) -> dict[str, OpenAIAgent]:
-        agents = [self.build_esg_agent(esg_title) for esg_title in esg_titles]
+        """
+        並行建立多家公司的 agent，索引的讀取與反序列化在執行緒池中同時進行。
+
+        Args:
+            esg_titles (list[str]): 公司列表
+            max_workers (Optional[int]): 執行緒數量，1 表示依序建立，None 使用預設值
+        """
+        start = time.perf_counter()
+        if max_workers == 1:
+            agents = [self.build_esg_agent(esg_title) for esg_title in esg_titles]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                agents = list(executor.map(self.build_esg_agent, esg_titles))
+        logging.info(
+            f"Loaded {len(esg_titles)} agents in {time.perf_counter() - start:.2f}s"
+        )
         return dict(zip(esg_titles, agents))
+
+
+class CompanyAgentRegistry(Mapping):
+    """
+    公司 agent 註冊表，第一次查詢到某公司時才建立該公司的 agent，
+    並以 LRU 方式保留常用公司，超過數量或記憶體預算時淘汰最久未使用者。
+
+    記憶體用量以公司 `vector/` 目錄在磁碟上的大小估算。
+    """
+
+    def __init__(
+        self,
+        agent_builder: AgentBuilder,
+        companies: list[str],
+        max_agents: int = 0,
+        max_memory_mb: float = 0,
+    ) -> None:
+        """
+        Args:
+            agent_builder (AgentBuilder): 用來建立公司 agent 的建構器
+            companies (list[str]): 可供查詢的公司列表
+            max_agents (int): 最多同時保留的 agent 數量，0 表示不限制
+            max_memory_mb (float): 已載入索引的估計大小上限(MB)，0 表示不限制
+        """
+        self.agent_builder = agent_builder
+        self.companies = list(companies)
+        self.max_agents = max_agents
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self._agents: OrderedDict[str, OpenAIAgent] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._build_locks: dict[str, threading.Lock] = {}
+
+    def __getitem__(self, esg_title: str) -> OpenAIAgent:
+        if esg_title not in self.companies:
+            raise KeyError(esg_title)
+        with self._lock:
+            if esg_title in self._agents:
+                self._agents.move_to_end(esg_title)
+                return self._agents[esg_title]
+        return self._load(esg_title)
+
+    def _load(self, esg_title: str) -> OpenAIAgent:
+        """建立公司的 agent。同一家公司只建立一次，不同公司可以同時建立。"""
+        with self._lock:
+            build_lock = self._build_locks.setdefault(esg_title, threading.Lock())
+        with build_lock:
+            with self._lock:
+                if esg_title in self._agents:
+                    self._agents.move_to_end(esg_title)
+                    return self._agents[esg_title]
+            agent = self.agent_builder.build_esg_agent(esg_title)
+            # 讀取目錄大小不佔用全域鎖
+            size = self._index_size(esg_title)
+            with self._lock:
+                self._agents[esg_title] = agent
+                self._sizes[esg_title] = size
+                self._evict()
+        return agent
+
+    def __contains__(self, esg_title: object) -> bool:
+        return esg_title in self.companies
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.companies)
+
+    def __len__(self) -> int:
+        return len(self.companies)
+
+    def warm_up(self, max_workers: Optional[int] = None) -> dict[str, float]:
+        """
+        預先並行載入公司 agent，數量受 `max_agents` 限制。
+
+        Returns:
+            dict[str, float]: 每家公司的載入秒數
+        """
+        esg_titles = [
+            esg_title for esg_title in self.companies if esg_title not in self.loaded
+        ]
+        if self.max_agents:
+            esg_titles = esg_titles[: max(self.max_agents - len(self.loaded), 0)]
+        # 與查詢共用各公司的建立鎖，載入期間查詢到的公司不會重複建立
+        start = time.perf_counter()
+        if max_workers == 1:
+            for esg_title in esg_titles:
+                self._load(esg_title)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(self._load, esg_titles))
+        logging.info(
+            f"Loaded {len(esg_titles)} agents in {time.perf_counter() - start:.2f}s"
+        )
+        return {
+            esg_title: self.agent_builder.load_times[esg_title]
+            for esg_title in esg_titles
+        }
+
+    @property
+    def loaded(self) -> list[str]:
+        """目前常駐記憶體的公司，由最久未使用到最近使用排序。"""
+        with self._lock:
+            return list(self._agents)
+
+    def refresh(self, companies: list[str]) -> None:
+        """更新可供查詢的公司列表，並移除已不存在公司的 agent。"""
+        with self._lock:
+            self.companies = list(companies)
+            for esg_title in list(self._agents):
+                if esg_title not in self.companies:
+                    self._drop(esg_title)
+
+    def invalidate(self, esg_title: str) -> None:
+        """移除某公司的 agent，例如索引重建後，下次查詢時會重新載入。"""
+        with self._lock:
+            if esg_title in self._agents:
+                self._drop(esg_title)
+
+    def _evict(self) -> None:
+        # 至少保留最近使用的一個 agent
+        while len(self._agents) > 1 and (
+            (self.max_agents and len(self._agents) > self.max_agents)
+            or (
+                self.max_memory_bytes
+                and sum(self._sizes.values()) > self.max_memory_bytes
+            )
+        ):
+            esg_title = next(iter(self._agents))
+            logging.info(f"Evict agent: {esg_title}")
+            self._drop(esg_title)
+
+    def _drop(self, esg_title: str) -> None:
+        del self._agents[esg_title]
+        self._sizes.pop(esg_title, None)
+
+    def _index_size(self, esg_title: str) -> int:
+        vector_path = os.path.join(self.agent_builder.esg_dir_path, esg_title, "vector")
+        if not os.path.isdir(vector_path):
+            return 0
+        return sum(
+            entry.stat().st_size for entry in os.scandir(vector_path) if entry.is_file()
+        )
@@ -0,0 +1,111 @@
+import re
+import threading
+from collections.abc import Iterable
+from typing import Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.settings import Settings
+
+from vector_store import normalize
+
+_PUNCTUATION = re.compile(r"[\s\.,!?;:，。！？；：、「」『』（）()]+")
+
+
+class SemanticAnswerCache:
+    """
+    整個問答流程的語意快取。
+
+    問題正規化後轉成向量，與先前問題的相似度超過門檻，且提及的公司相同時，
+    直接回傳先前的答案。公司索引重建時，用到該公司的答案會被移除。
+    """
+
+    def __init__(
+        self,
+        embed_model: Optional[BaseEmbedding] = None,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+    ) -> None:
+        """
+        Args:
+            embed_model (Optional[BaseEmbedding]): 問題的向量模型，預設為 Settings.embed_model
+            threshold (float): cosine 相似度門檻
+            max_entries (int): 最多保留的答案數，超過時移除最舊的答案
+        """
+        self.embed_model = embed_model or Settings.embed_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._embeddings = np.empty((0, 0), dtype=np.float32)
+        self._answers: list[str] = []
+        # 問題中提及的公司，比對時必須相同
+        self._keys: list[frozenset[str]] = []
+        # 產生答案時用到的公司，索引重建時據此失效
+        self._sources: list[frozenset[str]] = []
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        return _PUNCTUATION.sub(" ", question).strip().lower()
+
+    async def aembed(self, question: str) -> list[float]:
+        return await self.embed_model.aget_query_embedding(
+            self.normalize_question(question)
+        )
+
+    def lookup(
+        self, embedding: list[float], companies: Iterable[str]
+    ) -> Optional[str]:
+        """回傳相似度最高且超過門檻的答案，沒有則回傳 None。"""
+        key = frozenset(companies)
+        with self._lock:
+            if not self._answers:
+                return None
+            scores = self._embeddings @ normalize(embedding)
+            for i in np.argsort(-scores):
+                if scores[i] < self.threshold:
+                    break
+                if self._keys[i] == key:
+                    return self._answers[i]
+        return None
+
+    def add(
+        self,
+        embedding: list[float],
+        answer: str,
+        companies: Iterable[str],
+        sources: Iterable[str] = (),
+    ) -> None:
+        """
+        Args:
+            embedding (list[float]): 問題的向量
+            answer (str): 答案
+            companies (Iterable[str]): 問題中提及的公司
+            sources (Iterable[str]): 產生答案時檢索過的公司
+        """
+        key = frozenset(companies)
+        row = normalize([embedding])
+        with self._lock:
+            if self._answers:
+                self._embeddings = np.vstack([self._embeddings, row])
+            else:
+                self._embeddings = row
+            self._answers.append(answer)
+            self._keys.append(key)
+            self._sources.append(key | frozenset(sources))
+            if len(self._answers) > self.max_entries:
+                self._keep([False] + [True] * (len(self._answers) - 1))
+
+    def invalidate(self, companies: Iterable[str]) -> None:
+        """移除所有用到這些公司的答案。"""
+        companies = set(companies)
+        with self._lock:
+            self._keep([not (source & companies) for source in self._sources])
+
+    def _keep(self, mask: list[bool]) -> None:
+        self._embeddings = self._embeddings[np.asarray(mask, dtype=bool)]
+        self._answers = [a for a, k in zip(self._answers, mask) if k]
+        self._keys = [a for a, k in zip(self._keys, mask) if k]
+        self._sources = [a for a, k in zip(self._sources, mask) if k]
+
+    def __len__(self) -> int:
+        return len(self._answers)
@@ -0,0 +1,192 @@
+"""
+批次回答 JSONL 檔中的問題，答案逐筆寫入輸出的 JSONL 檔。
+
+    python batch.py questions.jsonl answers.jsonl --concurrency 8
+
+輸入每行一個 JSON 物件，至少包含問題欄位(預設為 "question")，可選的 "id" 欄位
+作為識別，沒有時以行號代替。中斷後以相同指令重新執行，已有答案的問題會被略過，
+失敗的問題會重新執行，同一個 ID 以最後一筆紀錄為準。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+
+# workflow.Config 在 import 時讀取環境變數
+load_dotenv(override=True)
+
+from answer_cache import SemanticAnswerCache
+from routing import IndustryIndex
+from workflow import (Config, ESGReportWorkflow, SettingsManager,
+                      create_agent_registry, load_industry_map)
+
+
+def read_questions(
+    path: str, question_field: str = "question", id_field: str = "id"
+) -> list[dict]:
+    """讀取問題，回傳 [{"id": ..., "question": ...}]，略過空行與沒有問題的行。"""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            question = record.get(question_field)
+            if not question:
+                logging.warning(f"Line {line_number} has no '{question_field}'")
+                continue
+            items.append(
+                {"id": str(record.get(id_field, line_number)), "question": question}
+            )
+    return items
+
+
+def read_completed(path: str) -> set[str]:
+    """已有答案的問題 ID。最後一行可能因中斷而不完整，解析失敗時略過。"""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "answer" in record:
+                completed.add(record["id"])
+    return completed
+
+
+class BatchRunner:
+    """
+    以固定數量的 worker 同時執行 ESGReportWorkflow，所有 worker 共用公司 agent 與快取。
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        concurrency: int = 4,
+        timeout: float = 300,
+    ) -> None:
+        """
+        Args:
+            output_path (str): 輸出的 JSONL 檔，以附加方式寫入
+            concurrency (int): 同時執行的問題數
+            timeout (float): 每個問題的逾時秒數
+        """
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.registry = create_agent_registry()
+        self.industry_map = load_industry_map()
+        self.industry_index = IndustryIndex(self.registry.keys(), self.industry_map)
+        self.answer_cache = None
+        if Config.ANSWER_CACHE:
+            self.answer_cache = SemanticAnswerCache(
+                threshold=Config.ANSWER_CACHE_THRESHOLD,
+                max_entries=Config.ANSWER_CACHE_MAX_ENTRIES,
+            )
+        self.succeeded = 0
+        self.failed = 0
+
+    async def run(self, items: list[dict]) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in items:
+            queue.put_nowait(item)
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+        start = time.perf_counter()
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            # 上次中斷時最後一行可能沒寫完，先換行避免與新紀錄黏在一起
+            if output.tell() and not self._ends_with_newline():
+                output.write("\n")
+            workers = [
+                asyncio.create_task(self._worker(queue, output, len(items)))
+                for _ in range(min(self.concurrency, len(items)))
+            ]
+            await asyncio.gather(*workers)
+        logging.info(
+            f"Batch finished in {time.perf_counter() - start:.1f}s: "
+            f"{self.succeeded} succeeded, {self.failed} failed"
+        )
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    async def _worker(self, queue: asyncio.Queue, output, total: int) -> None:
+        while not queue.empty():
+            item = queue.get_nowait()
+            start = time.perf_counter()
+            record = {"id": item["id"], "question": item["question"]}
+            try:
+                workflow = ESGReportWorkflow(
+                    timeout=self.timeout,
+                    verbose=False,
+                    esg_agents_map=self.registry,
+                    industry_map=self.industry_map,
+                    industry_index=self.industry_index,
+                    answer_cache=self.answer_cache,
+                )
+                record["answer"] = str(await workflow.run(question=item["question"]))
+                self.succeeded += 1
+            except Exception as e:
+                logging.exception(f"Question {item['id']} failed")
+                record["error"] = f"{type(e).__name__}: {e}"
+                self.failed += 1
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            record["finished_at"] = datetime.now(timezone.utc).isoformat()
+            # 每筆寫入後立即落盤，中斷時最多只會遺失執行中的問題
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            os.fsync(output.fileno())
+            logging.info(
+                f"[{self.succeeded + self.failed}/{total}] {item['id']} "
+                f"{'ok' if 'answer' in record else 'failed'} "
+                f"({record['seconds']:.1f}s)"
+            )
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="問題的 JSONL 檔")
+    parser.add_argument("output", help="答案的 JSONL 檔，已存在時接續執行")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--question-field", default="question")
+    parser.add_argument("--id-field", default="id")
+    return parser.parse_args(argv)
+
+
+async def run_batch(args: argparse.Namespace) -> None:
+    items = read_questions(args.input, args.question_field, args.id_field)
+    completed = read_completed(args.output)
+    pending = [item for item in items if item["id"] not in completed]
+    logging.info(
+        f"{len(items)} questions, {len(items) - len(pending)} already answered, "
+        f"{len(pending)} to run"
+    )
+    if not pending:
+        return
+    SettingsManager.initialize(shared_http_clients=True)
+    try:
+        runner = BatchRunner(args.output, args.concurrency, args.timeout)
+        await runner.run(pending)
+    finally:
+        await SettingsManager.close_http_clients()
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_batch(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+離線效能測試，以 mock_models 的替身取代 OpenAI、OpenAIEmbedding 與 LlamaParse，
+不會花費任何 API 額度。
+
+    python benchmark.py --companies 100 --pages 30 --output bench.json
+    python benchmark.py --companies 100 --baseline bench.json
+
+測量項目：索引建立、索引載入、單次檢索延遲、PageGroupPostprocessor 成本、
+壓縮向量(float16/int8、截斷維度、全精度重新評分)的 recall 與延遲，
+以及 ESGReportWorkflow.run 的端到端吞吐量，結果寫成 JSON 報告。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+import numpy as np
+
+from mock_models import (PAGE_SEPARATOR, HashEmbedding, MockDocumentLoader,
+                         MockOpenAI, synthetic_report)
+
+INDUSTRIES = ["金融業", "食品業", "半導體業", "航運業", "電信業"]
+TOPICS = ["溫室氣體排放", "用電量", "員工薪資", "女性主管", "董事會"]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """延遲分布的摘要(秒)。"""
+    if not values:
+        return {"count": 0}
+    array = np.asarray(values, dtype=np.float64)
+    return {
+        "count": len(values),
+        "mean": float(array.mean()),
+        "p50": float(np.percentile(array, 50)),
+        "p95": float(np.percentile(array, 95)),
+        "max": float(array.max()),
+    }
+
+
+def company_name(i: int) -> str:
+    return f"測試公司{i:04d}"
+
+
+def generate_corpus(esg_dir: str, num_companies: int, pages: int) -> list[str]:
+    """產生合成報告書與產業對照表，回傳報告書路徑。"""
+    file_paths = []
+    industry_map = []
+    for i in range(num_companies):
+        company = company_name(i)
+        company_dir = os.path.join(esg_dir, company)
+        os.makedirs(company_dir, exist_ok=True)
+        file_path = os.path.join(company_dir, f"{company}.pdf")
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(PAGE_SEPARATOR.join(synthetic_report(company, pages)))
+        file_paths.append(file_path)
+        industry_map.append(
+            {
+                "company": company,
+                "industry": [INDUSTRIES[i % len(INDUSTRIES)]],
+                "alias": [company, f"測{i:04d}"],
+            }
+        )
+    os.makedirs(os.path.join(esg_dir, "industry_map"), exist_ok=True)
+    with open(
+        os.path.join(esg_dir, "industry_map", "industry.json"), "w", encoding="utf-8"
+    ) as f:
+        json.dump(industry_map, f, ensure_ascii=False)
+    return file_paths
+
+
+async def bench_ingest(args: argparse.Namespace, file_paths: list[str]) -> dict:
+    from indexing import IndexBuilder
+    from ingestion import StreamingIngestionPipeline
+
+    pipeline = StreamingIngestionPipeline(
+        MockDocumentLoader(latency=args.parse_latency),
+        IndexBuilder(args.vector_store_format, args.vector_dtype),
+        args.esg_dir,
+        incremental=False,
+    )
+    start = time.perf_counter()
+    completed = await pipeline.run(file_paths)
+    elapsed = time.perf_counter() - start
+    return {
+        "companies": len(completed),
+        "seconds": elapsed,
+        "seconds_per_company": elapsed / max(len(completed), 1),
+    }
+
+
+def bench_load(args: argparse.Namespace, companies: list[str]) -> dict:
+    from agents import AgentBuilder
+
+    agent_builder = AgentBuilder(args.esg_dir, hybrid=args.retrieval_mode == "hybrid")
+    start = time.perf_counter()
+    agent_builder.build_esg_agents(companies, max_workers=args.load_workers)
+    elapsed = time.perf_counter() - start
+    return {
+        "companies": len(companies),
+        "seconds": elapsed,
+        "per_company": summarize(list(agent_builder.load_times.values())),
+    }
+
+
+async def bench_retrieval(args: argparse.Namespace, companies: list[str]) -> dict:
+    from indexing import IndexBuilder
+    from node_prcessors import PageGroupPostprocessor
+    from retrievers import HybridRetriever
+
+    index_builder = IndexBuilder()
+    latencies = {"vector": [], "hybrid": []}
+    page_group_latencies = []
+    result_nodes = []
+    for company in companies:
+        persist_path = os.path.join(args.esg_dir, company, "vector")
+        index = index_builder.build_vector_index(persist_path)
+        vector_retriever = index.as_retriever(similarity_top_k=20)
+        retrievers = {
+            "vector": vector_retriever,
+            "hybrid": HybridRetriever(
+                vector_retriever,
+                index_builder.load_lexical_index(persist_path, index),
+                index.docstore,
+                similarity_top_k=20,
+            ),
+        }
+        page_group = PageGroupPostprocessor(
+            all_nodes_from_doc=list(index.docstore.docs.values())
+        )
+        for topic in TOPICS:
+            query = f"{company}的{topic}是多少？"
+            for mode, retriever in retrievers.items():
+                start = time.perf_counter()
+                nodes = await retriever.aretrieve(query)
+                latencies[mode].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            expanded = page_group.postprocess_nodes(nodes, query_str=query)
+            page_group_latencies.append(time.perf_counter() - start)
+            result_nodes.append(len(expanded))
+    return {
+        "vector": summarize(latencies["vector"]),
+        "hybrid": summarize(latencies["hybrid"]),
+        "page_group": summarize(page_group_latencies),
+        "page_group_nodes": summarize(result_nodes),
+    }
+
+
+async def bench_quantization(
+    args: argparse.Namespace, companies: list[str], sample: list[str]
+) -> dict:
+    """
+    以 float32 的精確 top-k 為基準，比較各種壓縮格式在樣本公司的 recall@k、
+    單一公司與全部公司的檢索延遲，以及常駐記憶體大小。
+    """
+    from llama_index.core import Settings
+
+    from vector_store import ConsolidatedVectorStore
+
+    k = args.quantization_top_k
+    truncate_dims = args.truncate_dims or args.embed_dim // 2
+    queries = [
+        (company, f"{company}的{topic}是多少？")
+        for company in sample
+        for topic in TOPICS
+    ]
+    embeddings = await Settings.embed_model.aget_text_embedding_batch(
+        [query for _, query in queries]
+    )
+
+    def search(store: ConsolidatedVectorStore) -> tuple[list[set[str]], dict]:
+        found, latencies = [], {"company": [], "all": []}
+        for (company, _), embedding in zip(queries, embeddings):
+            start = time.perf_counter()
+            result = store.batch_query([embedding], k, companies=[company])[0]
+            latencies["company"].append(time.perf_counter() - start)
+            found.append({node_id for node_id, _ in result[company]})
+            start = time.perf_counter()
+            store.batch_query([embedding], k)
+            latencies["all"].append(time.perf_counter() - start)
+        return found, {name: summarize(values) for name, values in latencies.items()}
+
+    exact_store = ConsolidatedVectorStore.build(args.esg_dir, companies)
+    exact, latency = search(exact_store)
+    results = {
+        "float32": {
+            "recall": 1.0,
+            "bytes": exact_store.vectors.nbytes,
+            "latency": latency,
+        }
+    }
+    for dtype in ("float16", "int8"):
+        for dims in (0, truncate_dims):
+            store = ConsolidatedVectorStore.build(
+                args.esg_dir, companies, dtype, dims
+            )
+            for rescore in (0, args.rescore):
+                store.rescore = rescore
+                found, latency = search(store)
+                recall = [
+                    len(expected & actual) / len(expected)
+                    for expected, actual in zip(exact, found)
+                    if expected
+                ]
+                name = f"{dtype}_d{dims or args.embed_dim}_r{rescore}"
+                results[name] = {
+                    "recall": float(np.mean(recall)) if recall else 1.0,
+                    "bytes": store.vectors.nbytes,
+                    "latency": latency,
+                }
+    return results
+
+
+async def bench_workflow(
+    args: argparse.Namespace, companies: list[str], llm: MockOpenAI
+) -> dict:
+    from agents import AgentBuilder, CompanyAgentRegistry
+    from routing import IndustryIndex
+    from workflow import Config, ESGReportWorkflow, IndustryMap
+
+    with open(Config.INDUSTRY_FILE_PATH, "r", encoding="utf-8") as f:
+        industry_map = [IndustryMap(**item) for item in json.load(f)]
+    registry = CompanyAgentRegistry(
+        AgentBuilder(
+            args.esg_dir,
+            hybrid=args.retrieval_mode == "hybrid",
+            direct=args.company_query_mode == "direct",
+        ),
+        Config.list_companies(),
+        max_agents=Config.MAX_LOADED_AGENTS,
+    )
+    industry_index = IndustryIndex(registry.keys(), industry_map)
+
+    rng = random.Random(0)
+    questions = []
+    for i in range(args.queries):
+        topic = TOPICS[i % len(TOPICS)]
+        if i % 4 == 3 and len(companies) > 1:
+            first, second = rng.sample(companies, 2)
+            questions.append(f"請比較{first}和{second}的{topic}")
+        else:
+            questions.append(f"{rng.choice(companies)}的{topic}是多少？")
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def run(question: str) -> None:
+        async with semaphore:
+            workflow = ESGReportWorkflow(
+                timeout=300,
+                verbose=False,
+                esg_agents_map=registry,
+                industry_map=industry_map,
+                industry_index=industry_index,
+            )
+            workflow.ai_model = workflow.planner_llm = llm
+            start = time.perf_counter()
+            await workflow.run(question=question)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(question) for question in questions))
+    elapsed = time.perf_counter() - start
+    return {
+        "queries": len(questions),
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "queries_per_second": len(questions) / elapsed if elapsed else 0.0,
+        "latency": summarize(latencies),
+    }
+
+
+def flatten(data: Any, prefix: str = "") -> dict[str, float]:
+    if isinstance(data, dict):
+        result = {}
+        for key, value in data.items():
+            result.update(flatten(value, f"{prefix}{key}."))
+        return result
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        return {prefix[:-1]: data}
+    return {}
+
+
+def compare(baseline: dict, report: dict) -> None:
+    """列出與基準報告相比的數值變化。"""
+    before = flatten(baseline.get("results", {}))
+    after = flatten(report["results"])
+    print(f"{'metric':<48}{'baseline':>14}{'current':>14}{'ratio':>8}")
+    for key in sorted(before.keys() & after.keys()):
+        ratio = after[key] / before[key] if before[key] else float("nan")
+        print(f"{key:<48}{before[key]:>14.4f}{after[key]:>14.4f}{ratio:>8.2f}")
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """workflow.Config 在 import 時讀取環境變數，必須在 import workflow 之前設定。"""
+    os.environ["ESG_DIR_PATH"] = args.esg_dir
+    os.environ["INDUSTRY_FILE_PATH"] = os.path.join("industry_map", "industry.json")
+    os.environ["CACHE_DIR"] = os.path.join(args.esg_dir, ".cache")
+    os.environ["VECTOR_STORE_FORMAT"] = args.vector_store_format
+    os.environ["VECTOR_DTYPE"] = args.vector_dtype
+    os.environ["RETRIEVAL_MODE"] = args.retrieval_mode
+    os.environ["COMPANY_QUERY_MODE"] = args.company_query_mode
+    # 快取會讓重複執行的數字失真，預設關閉
+    for name in ("EMBEDDING_CACHE", "LLM_CACHE", "ANSWER_CACHE"):
+        os.environ[name] = str(args.with_caches)
+    os.environ["METRICS_LOG_PATH"] = ""
+    # 替身不會送出請求，但 OpenAI 類別建立時需要 API key
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--companies", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sample", type=int, default=10, help="檢索與載入測試的公司數")
+    parser.add_argument("--load-workers", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--parse-latency", type=float, default=0.5)
+    parser.add_argument("--embed-dim", type=int, default=256)
+    parser.add_argument(
+        "--vector-store-format", default="json", choices=["json", "mmap"]
+    )
+    parser.add_argument(
+        "--vector-dtype", default="float32", choices=["float32", "float16", "int8"]
+    )
+    parser.add_argument(
+        "--truncate-dims", type=int, default=0, help="壓縮測試截斷的維度，預設為一半"
+    )
+    parser.add_argument("--rescore", type=int, default=4, help="重新評分的候選倍數")
+    parser.add_argument("--quantization-top-k", type=int, default=20)
+    parser.add_argument(
+        "--retrieval-mode", default="hybrid", choices=["hybrid", "vector"]
+    )
+    parser.add_argument(
+        "--company-query-mode", default="direct", choices=["direct", "agent"]
+    )
+    parser.add_argument("--with-caches", action="store_true")
+    parser.add_argument("--skip-workflow", action="store_true")
+    parser.add_argument("--esg-dir", help="合成資料目錄，預設為暫存目錄並在結束後刪除")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="與之比較的先前報告")
+    return parser.parse_args(argv)
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    from llama_index.core import Settings
+    from llama_index.core.callbacks import CallbackManager
+
+    from instrumentation import MetricsCallbackHandler, metrics
+
+    Settings.callback_manager = CallbackManager([MetricsCallbackHandler(metrics)])
+    companies = [company_name(i) for i in range(args.companies)]
+    llm = MockOpenAI(latency=args.llm_latency, companies=companies)
+    Settings.llm = llm
+    Settings.embed_model = HashEmbedding(
+        dimensions=args.embed_dim, latency=args.embed_latency
+    )
+    metrics.reset()
+
+    results = {}
+    file_paths = generate_corpus(args.esg_dir, args.companies, args.pages)
+    logging.info("Benchmark: ingest")
+    results["ingest"] = await bench_ingest(args, file_paths)
+    sample = companies[: args.sample]
+    logging.info("Benchmark: load")
+    results["load"] = bench_load(args, sample)
+    logging.info("Benchmark: retrieval")
+    results["retrieval"] = await bench_retrieval(args, sample)
+    logging.info("Benchmark: quantization")
+    results["quantization"] = await bench_quantization(args, companies, sample)
+    if not args.skip_workflow:
+        logging.info("Benchmark: workflow")
+        results["workflow"] = await bench_workflow(args, sample, llm)
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("esg_dir", "output", "baseline")
+        },
+        "results": results,
+        "metrics": metrics.snapshot(),
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    temp_dir = None
+    if args.esg_dir is None:
+        temp_dir = tempfile.mkdtemp(prefix="esg_benchmark_")
+        args.esg_dir = temp_dir
+    args.esg_dir = os.path.abspath(args.esg_dir)
+    configure_environment(args)
+    try:
+        report = asyncio.run(run_benchmark(args))
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report["results"], ensure_ascii=False, indent=2))
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
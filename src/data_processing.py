@@ -1,4 +1,8 @@
 import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Optional
 
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.schema import Document
@@ -8,13 +12,17 @@ from llama_parse import LlamaParse
 class DocumentLoader:
     """文檔加載器類，提供多種方法來加載和處理文檔。"""
 
-    def __init__(self, llamaparse_api_key: str) -> None:
+    def __init__(
+        self, llamaparse_api_key: str, cache_dir: Optional[str] = None
+    ) -> None:
         """
         初始化DocumentLoader。
 
         Args:
             llamaparse_api_key (str): LlamaParse API密鑰
+            cache_dir (Optional[str]): 解析結果的快取目錄，None 表示不快取
         """
+        self.cache_dir = cache_dir
         self.json_parser = LlamaParse(
             api_key=llamaparse_api_key,
             result_type="json",
@@ -30,6 +38,36 @@ class DocumentLoader:
             language="ch_tra",
         )
 
+    def _cache_path(self, file_path: str, parser: LlamaParse) -> Optional[str]:
+        """
+        以 PDF 內容的 SHA-256 與解析設定組成快取檔路徑，內容相同的檔案共用快取。
+        """
+        if self.cache_dir is None:
+            return None
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(chunk)
+        result_type = getattr(parser.result_type, "value", parser.result_type)
+        language = getattr(parser.language, "value", parser.language)
+        return os.path.join(
+            self.cache_dir, f"{sha256.hexdigest()}_{result_type}_{language}.json"
+        )
+
+    def _load_cache(self, cache_path: Optional[str]) -> Optional[Any]:
+        if cache_path is None or not os.path.exists(cache_path):
+            return None
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_cache(self, cache_path: Optional[str], data: Any) -> None:
+        if cache_path is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(cache_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(cache_path + ".tmp", cache_path)
+
     def get_doc(self, file_path: str) -> list[Document]:
         """
         同步加載單個PDF文件。
@@ -61,7 +99,15 @@ class DocumentLoader:
         Returns:
             list[Document]: 包含文檔內容的Document對象列表
         """
-        document = await self.md_parser.aload_data(file_path)
+        cache_path = await asyncio.to_thread(
+            self._cache_path, file_path, self.md_parser
+        )
+        texts = self._load_cache(cache_path)
+        if texts is None:
+            document = await self.md_parser.aload_data(file_path)
+            self._save_cache(cache_path, [doc.text for doc in document])
+        else:
+            document = [Document(text=text) for text in texts]
         for i, doc in enumerate(document):
             doc.metadata = {"pages": i + 1, "file_name": file_path.split("/")[-1]}
             doc.text_template = str(
@@ -79,13 +125,26 @@ class DocumentLoader:
         Returns:
             list[Document]: 包含文檔內容的Document對象列表
         """
-        try:
-            json_objs = await self.json_parser.aget_json(file_path)
-            json_list = json_objs[0]["pages"]
-        except Exception as e:
-            print(json_objs)
-            print(e.with_traceback)
-            raise e
+        cache_path = await asyncio.to_thread(
+            self._cache_path, file_path, self.json_parser
+        )
+        json_list = self._load_cache(cache_path)
+        if json_list is None:
+            json_objs = None
+            try:
+                json_objs = await self.json_parser.aget_json(file_path)
+                json_list = json_objs[0]["pages"]
+            except Exception as e:
+                print(json_objs)
+                print(e.with_traceback)
+                raise e
+            self._save_cache(
+                cache_path,
+                [
+                    {"page": page.get("page"), "text": page.get("text")}
+                    for page in json_list
+                ],
+            )
         documents = []
         for page in json_list:
             documents.append(
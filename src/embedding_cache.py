@@ -0,0 +1,158 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Any, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+
+class EmbeddingCache:
+    """
+    以 SQLite 儲存的向量快取，key 為模型名稱加上文字內容的 SHA-256，
+    相同的文字在重建索引或不同公司之間都能重複使用。
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """
+        Args:
+            db_path (str): SQLite 檔案路徑
+        """
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name: str, texts: list[str]) -> list[Optional[Embedding]]:
+        keys = [self.make_key(model_name, text) for text in texts]
+        found = {}
+        with self._lock:
+            # SQLite 對單一查詢的參數數量有上限，分批查詢
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+        return [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+
+    def put_many(
+        self, model_name: str, texts: list[str], embeddings: list[Embedding]
+    ) -> None:
+        rows = [
+            (
+                self.make_key(model_name, text),
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+            )
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+            )
+            self._conn.commit()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    包裝另一個 embedding 模型，先查詢 EmbeddingCache，只有未命中的文字才送去計算。
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(
+        self, embed_model: BaseEmbedding, cache: EmbeddingCache, **kwargs: Any
+    ) -> None:
+        """
+        Args:
+            embed_model (BaseEmbedding): 實際計算向量的模型
+            cache (EmbeddingCache): 向量快取
+        """
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            callback_manager=embed_model.callback_manager,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache_key_prefix(self) -> str:
+        # 不同輸出維度的向量不能混用
+        dimensions = getattr(self._embed_model, "dimensions", None)
+        return f"{self.model_name}:{dimensions}" if dimensions else self.model_name
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        # 有些模型的查詢向量與文件向量不同，分開存放
+        key_prefix = f"query:{self.cache_key_prefix}"
+        embedding = self._cache.get_many(key_prefix, [query])[0]
+        if embedding is None:
+            embedding = self._embed_model._get_query_embedding(query)
+            self._cache.put_many(key_prefix, [query], [embedding])
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        key_prefix = f"query:{self.cache_key_prefix}"
+        embedding = self._cache.get_many(key_prefix, [query])[0]
+        if embedding is None:
+            embedding = await self._embed_model._aget_query_embedding(query)
+            self._cache.put_many(key_prefix, [query], [embedding])
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        embeddings = self._cache.get_many(self.cache_key_prefix, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            new_texts = list(dict.fromkeys(texts[i] for i in missing))
+            new_embeddings = self._embed_model._get_text_embeddings(new_texts)
+            self._fill(embeddings, texts, missing, new_texts, new_embeddings)
+        return embeddings
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        embeddings = self._cache.get_many(self.cache_key_prefix, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            new_texts = list(dict.fromkeys(texts[i] for i in missing))
+            new_embeddings = await self._embed_model._aget_text_embeddings(new_texts)
+            self._fill(embeddings, texts, missing, new_texts, new_embeddings)
+        return embeddings
+
+    def _fill(
+        self,
+        embeddings: list[Optional[Embedding]],
+        texts: list[str],
+        missing: list[int],
+        new_texts: list[str],
+        new_embeddings: list[Embedding],
+    ) -> None:
+        self._cache.put_many(self.cache_key_prefix, new_texts, new_embeddings)
+        computed = dict(zip(new_texts, new_embeddings))
+        for i in missing:
+            embeddings[i] = computed[texts[i]]
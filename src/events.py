@@ -17,29 +17,38 @@ class SubqueriesGeneratedEvent(Event):
     subqueries: list[Subquery]
 
 
-class QuerySplitErrorEvent(Event):
-    error: str
-    invalid_output: str
-    main_query: str
+class QueryPlan(BaseModel):
+    """規劃步驟的輸出：問題提及的公司是否存在，以及每家公司的子問題。"""
 
-
-class QuerySplitOutputEvent(Event):
-    output: str
-    original_query: str
+    exists: bool
+    subqueries: list[Subquery]
 
 
 class ChooseAgentEvent(Event):
     query: str
+    company: str = ""
+    # 同一家公司合併查詢的子問題，空的表示只有 query
+    queries: list[str] = []
+    # 與 queries 對應、已經算好的子問題向量
+    embeddings: list[list[float]] = []
+    # 子問題必須完成的時間(time.monotonic())，0 表示不限制
+    deadline: float = 0
 
 
 class RetrieverEvent(Event):
     agent: Any
     agent_name: str
     query: str
+    queries: list[str] = []
+    embeddings: list[list[float]] = []
+    deadline: float = 0
 
 
 class RetrieverResponseEvent(Event):
     response: str
+    agent_name: str = ""
+    # 超過子問題期限而沒有取得回應
+    timed_out: bool = False
 
 
 class RetrieverStartEvent(Event):
@@ -50,8 +59,16 @@ class MockEvent(Event):
     pass
 
 
-class ProcessedQueryEvent(Event):
-    query: str
+class ProgressEvent(Event):
+    """串流給使用者的步驟進度。"""
+
+    message: str
+
+
+class TokenEvent(Event):
+    """串流給使用者的答案片段。"""
+
+    delta: str
 
 
 class IndustryMap(BaseModel):
@@ -1,19 +1,61 @@
+import hashlib
+import logging
 import os
+from collections import Counter, defaultdict
 from typing import Optional, Union
 
 from llama_index.core import VectorStoreIndex, load_index_from_storage
 from llama_index.core.indices.base import BaseIndex
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.schema import BaseNode, Document
+from llama_index.core.schema import BaseNode, Document, MetadataMode
 from llama_index.core.storage import StorageContext
+from llama_index.core.storage.docstore import SimpleDocumentStore
 from llama_index.embeddings.openai import OpenAIEmbedding
 
+from lexical import BM25Index
+from vector_store import MmapVectorStore
+
 
 class IndexBuilder:
     """
     索引構建器
     """
 
+    def __init__(
+        self,
+        vector_store_format: str = "json",
+        vector_dtype: str = "float32",
+        vector_dims: int = 0,
+    ) -> None:
+        """
+        Args:
+            vector_store_format (str): 新建索引時向量的儲存格式，"json" 或 "mmap"
+            vector_dtype (str): "mmap" 格式的儲存精度，float32、float16 或 int8
+            vector_dims (int): "mmap" 格式截斷後的維度，0 表示不截斷
+        """
+        self.vector_store_format = vector_store_format
+        self.vector_dtype = vector_dtype
+        self.vector_dims = vector_dims
+
+    def build_storage_context(self, persist_path: Optional[str] = None):
+        """
+        建立 StorageContext。載入既有索引時，若目錄中有二進位向量檔則以 memory map 讀取。
+        """
+        if persist_path is None:
+            if self.vector_store_format == "mmap":
+                return StorageContext.from_defaults(
+                    vector_store=MmapVectorStore(
+                        dtype=self.vector_dtype, dims=self.vector_dims
+                    )
+                )
+            return StorageContext.from_defaults()
+        if MmapVectorStore.exists(persist_path):
+            return StorageContext.from_defaults(
+                persist_dir=persist_path,
+                vector_store=MmapVectorStore.from_persist_dir(persist_path),
+            )
+        return StorageContext.from_defaults(persist_dir=persist_path)
+
     def build_index(
         self,
         index_class: BaseIndex,
@@ -24,12 +66,15 @@ class IndexBuilder:
         構建索引並且儲存，如果索引已經存在，則直接加載索引。
         """
         if not os.path.exists(persist_path) or data is not None:
-            index = index_class(data, use_async=True)
+            index = index_class(
+                data, use_async=True, storage_context=self.build_storage_context()
+            )
             index.storage_context.persist(persist_dir=persist_path)
+            if not isinstance(index.storage_context.vector_store, MmapVectorStore):
+                # 先前轉換或以 "mmap" 格式建立的向量檔已經過時
+                MmapVectorStore.remove(persist_path)
         else:
-            index = load_index_from_storage(
-                StorageContext.from_defaults(persist_dir=persist_path)
-            )
+            index = load_index_from_storage(self.build_storage_context(persist_path))
         return index
 
     async def build_json_index(
@@ -40,13 +85,121 @@ class IndexBuilder:
         #     nodes = JSONNodeParser().get_nodes_from_documents([doc])
         return self.build_index(VectorStoreIndex, persist_path, data)
 
+    @staticmethod
+    def node_hash(node: BaseNode) -> str:
+        """以節點內容與 metadata 計算雜湊，內容相同的 chunk 得到相同的值。"""
+        content = node.get_content(metadata_mode=MetadataMode.ALL)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def changed_nodes(self, persist_path: str, nodes: list[BaseNode]) -> list[BaseNode]:
+        """
+        回傳既有索引中沒有相同雜湊的 chunk，也就是 `upsert_index` 會插入、需要向量化的
+        chunk。索引不存在時回傳全部。
+        """
+        if not os.path.exists(persist_path):
+            return nodes
+        docstore = SimpleDocumentStore.from_persist_dir(persist_path)
+        existing = Counter(self.node_hash(node) for node in docstore.docs.values())
+        changed = []
+        for node in nodes:
+            node_hash = self.node_hash(node)
+            if existing[node_hash]:
+                existing[node_hash] -= 1
+            else:
+                changed.append(node)
+        return changed
+
+    def upsert_index(
+        self, persist_path: str, nodes: list[BaseNode]
+    ) -> VectorStoreIndex:
+        """
+        與既有索引比對 chunk 雜湊，只向量化並插入新的 chunk、刪除已不存在的 chunk，
+        內容沒有變動時不重新寫入索引檔。
+
+        報告書是逐頁切成 chunk，沒有修改的頁面會得到相同的 chunk 與雜湊。
+        """
+        index = load_index_from_storage(self.build_storage_context(persist_path))
+        existing = defaultdict(list)
+        for node_id, node in index.docstore.docs.items():
+            existing[self.node_hash(node)].append(node_id)
+
+        new_nodes = []
+        for node in nodes:
+            node_ids = existing.get(self.node_hash(node))
+            if node_ids:
+                node_ids.pop()
+            else:
+                new_nodes.append(node)
+        removed_ids = [
+            node_id for node_ids in existing.values() for node_id in node_ids
+        ]
+
+        logging.info(
+            f"Upsert {persist_path}: {len(new_nodes)} new, {len(removed_ids)} removed, "
+            f"{len(nodes) - len(new_nodes)} unchanged"
+        )
+        if not new_nodes and not removed_ids:
+            return index
+        if removed_ids:
+            index.delete_nodes(removed_ids, delete_from_docstore=True)
+        if new_nodes:
+            index.insert_nodes(new_nodes)
+        index.storage_context.persist(persist_dir=persist_path)
+        return index
+
+    def split_documents(self, documents: list[Document]) -> list[BaseNode]:
+        splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=256)
+        return splitter.get_nodes_from_documents(documents)
+
     def build_vector_index(
         self,
         persist_path: str,
         data: Optional[list[Document]] = None,
+        incremental: bool = False,
     ) -> VectorStoreIndex:
-        if data:
-            splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=256)
-            data = splitter.get_nodes_from_documents(data)
+        """
+        Args:
+            persist_path (str): 索引目錄
+            data (Optional[list[Document]]): 要建立索引的文件，None 表示載入既有索引
+            incremental (bool): 索引已存在時只更新有變動的 chunk，而不是整個重建
+        """
+        nodes = self.split_documents(data) if data else None
+        return self.build_node_index(persist_path, nodes, incremental)
 
-        return self.build_index(VectorStoreIndex, persist_path, data)
+    def build_node_index(
+        self,
+        persist_path: str,
+        nodes: Optional[list[BaseNode]] = None,
+        incremental: bool = False,
+    ) -> VectorStoreIndex:
+        """
+        以已切好的 chunk 建立索引，已經帶有 embedding 的 chunk 不會再次向量化。
+        """
+        if nodes and incremental and os.path.exists(persist_path):
+            index = self.upsert_index(persist_path, nodes)
+        else:
+            index = self.build_index(VectorStoreIndex, persist_path, nodes)
+        if nodes:
+            self.build_lexical_index(persist_path, index)
+        return index
+
+    @staticmethod
+    def lexical_path(persist_path: str) -> str:
+        """`<公司>/vector` -> `<公司>/lexical`"""
+        return os.path.join(os.path.dirname(os.path.normpath(persist_path)), "lexical")
+
+    def build_lexical_index(self, persist_path: str, index: BaseIndex) -> BM25Index:
+        """
+        以索引 docstore 中的所有 chunk 重建 BM25 索引，存在向量索引旁的 `lexical/` 目錄。
+        不需要向量化，每次寫入向量索引後整個重建即可。
+        """
+        lexical_index = BM25Index.from_nodes(list(index.docstore.docs.values()))
+        lexical_index.persist(self.lexical_path(persist_path))
+        return lexical_index
+
+    def load_lexical_index(self, persist_path: str, index: BaseIndex) -> BM25Index:
+        """載入 BM25 索引，舊的索引沒有 `lexical/` 目錄時才建立。"""
+        lexical_path = self.lexical_path(persist_path)
+        if BM25Index.exists(lexical_path):
+            return BM25Index.from_persist_dir(lexical_path)
+        return self.build_lexical_index(persist_path, index)
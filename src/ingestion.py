@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, Document, MetadataMode
+from llama_index.core.settings import Settings
+
+from data_processing import DocumentLoader
+from indexing import IndexBuilder
+
+
+class IngestionError(RuntimeError):
+    """部分檔案處理失敗。其餘檔案照常完成，`completed` 為成功建立索引的公司。"""
+
+    def __init__(self, completed: list[str], failures: dict[str, Exception]) -> None:
+        super().__init__(f"Failed to process documents: {failures}")
+        self.completed = completed
+        self.failures = failures
+
+
+class StreamingIngestionPipeline:
+    """
+    分階段的文件處理流程：解析 → 切分 → 向量化 → 寫入索引。
+
+    每個檔案完成一個階段就立刻進入下一個階段，各階段有自己的並行數量，
+    階段之間以有上限的佇列連接，下游處理不及時上游會暫停(backpressure)。
+    """
+
+    def __init__(
+        self,
+        document_loader: DocumentLoader,
+        index_builder: IndexBuilder,
+        esg_dir_path: str,
+        parse_workers: int = 4,
+        split_workers: int = 2,
+        embed_workers: int = 2,
+        persist_workers: int = 2,
+        queue_size: int = 2,
+        incremental: bool = False,
+        embed_model: Optional[BaseEmbedding] = None,
+    ) -> None:
+        """
+        Args:
+            document_loader (DocumentLoader): PDF 解析器
+            index_builder (IndexBuilder): 索引構建器
+            esg_dir_path (str): 存放各公司索引的目錄
+            parse_workers (int): 同時解析的檔案數
+            split_workers (int): 同時切分的檔案數
+            embed_workers (int): 同時向量化的檔案數
+            persist_workers (int): 同時寫入索引的檔案數
+            queue_size (int): 每個階段之間最多暫存的檔案數
+            incremental (bool): 索引已存在時只更新有變動的 chunk
+            embed_model (Optional[BaseEmbedding]): 向量模型，預設為 Settings.embed_model
+        """
+        self.document_loader = document_loader
+        self.index_builder = index_builder
+        self.esg_dir_path = esg_dir_path
+        self.workers = [parse_workers, split_workers, embed_workers, persist_workers]
+        self.queue_size = queue_size
+        self.incremental = incremental
+        self.embed_model = embed_model or Settings.embed_model
+        self.failures: dict[str, Exception] = {}
+        self.completed: list[str] = []
+
+    async def run(self, file_paths: list[str]) -> list[str]:
+        """
+        處理所有檔案。
+
+        Args:
+            file_paths (list[str]): PDF 路徑，檔名(不含副檔名)即為公司名稱
+
+        Returns:
+            list[str]: 成功建立索引的公司
+
+        Raises:
+            IngestionError: 有檔案處理失敗，成功的公司記錄在例外的 `completed`
+        """
+        stages = [self._parse, self._split, self._embed, self._persist]
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in stages]
+        self.failures = {}
+        self.completed = []
+
+        async def feed() -> None:
+            for file_path in file_paths:
+                company = os.path.splitext(os.path.basename(file_path))[0]
+                await queues[0].put((company, file_path))
+            for _ in range(self.workers[0]):
+                await queues[0].put(None)
+
+        await asyncio.gather(
+            feed(),
+            *(
+                self._run_stage(
+                    stage,
+                    queues[i],
+                    queues[i + 1] if i + 1 < len(stages) else None,
+                    self.workers[i],
+                    self.workers[i + 1] if i + 1 < len(stages) else 0,
+                )
+                for i, stage in enumerate(stages)
+            ),
+        )
+        if self.failures:
+            raise IngestionError(self.completed, self.failures)
+        return self.completed
+
+    async def _run_stage(
+        self,
+        fn: Callable[[str, Any], Awaitable[Any]],
+        inbox: asyncio.Queue,
+        outbox: Optional[asyncio.Queue],
+        workers: int,
+        next_workers: int,
+    ) -> None:
+        async def worker() -> None:
+            while (item := await inbox.get()) is not None:
+                company, payload = item
+                start = time.perf_counter()
+                try:
+                    result = await fn(company, payload)
+                except Exception as e:
+                    logging.exception(f"{fn.__name__} failed for {company}")
+                    self.failures[company] = e
+                    continue
+                logging.info(
+                    f"{fn.__name__.strip('_')} {company}: "
+                    f"{time.perf_counter() - start:.2f}s"
+                )
+                if outbox is not None:
+                    await outbox.put((company, result))
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        # 通知下一個階段的所有 worker 結束
+        if outbox is not None:
+            for _ in range(next_workers):
+                await outbox.put(None)
+
+    async def _parse(self, company: str, file_path: str) -> list[Document]:
+        return await self.document_loader.get_json_doc(file_path)
+
+    async def _split(self, company: str, documents: list[Document]) -> list[BaseNode]:
+        return await asyncio.to_thread(self.index_builder.split_documents, documents)
+
+    async def _embed(self, company: str, nodes: list[BaseNode]) -> list[BaseNode]:
+        pending = nodes
+        if self.incremental:
+            # 內容沒有變動的 chunk 在寫入索引時會被略過，不需要重新向量化
+            pending = await asyncio.to_thread(
+                self.index_builder.changed_nodes,
+                os.path.join(self.esg_dir_path, company, "vector"),
+                nodes,
+            )
+        if not pending:
+            return nodes
+        embeddings = await self.embed_model.aget_text_embedding_batch(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in pending]
+        )
+        for node, embedding in zip(pending, embeddings):
+            node.embedding = embedding
+        return nodes
+
+    async def _persist(self, company: str, nodes: list[BaseNode]) -> None:
+        await asyncio.to_thread(
+            self.index_builder.build_node_index,
+            os.path.join(self.esg_dir_path, company, "vector"),
+            nodes,
+            self.incremental,
+        )
+        self.completed.append(company)
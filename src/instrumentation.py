@@ -0,0 +1,239 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+
+
+class MetricsRecorder:
+    """
+    彙總各步驟與 LLM、embedding、檢索呼叫的耗時與數量。
+
+    每筆紀錄會寫成一行 JSON，並累計成 Prometheus 文字格式的指標。
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None) -> None:
+        """
+        Args:
+            jsonl_path (Optional[str]): JSON lines 輸出檔，None 表示只在記憶體中彙總
+        """
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        # (種類, 名稱) -> [次數, 總秒數, 最大秒數]
+        self._durations: dict[tuple[str, str], list[float]] = defaultdict(
+            lambda: [0, 0.0, 0.0]
+        )
+        # (種類, 名稱, 項目) -> 累計數量
+        self._counters: dict[tuple[str, str, str], float] = defaultdict(float)
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def configure(self, jsonl_path: Optional[str]) -> None:
+        if jsonl_path:
+            os.makedirs(os.path.dirname(jsonl_path) or ".", exist_ok=True)
+        self.jsonl_path = jsonl_path
+
+    def record(self, kind: str, name: str, duration: float, **counts: float) -> None:
+        """
+        Args:
+            kind (str): 種類，例如 step、llm、embedding、retrieve
+            name (str): 步驟名稱或模型名稱
+            duration (float): 耗時秒數
+            counts (float): 這次呼叫的數量，例如 prompt_tokens、nodes，會累加到計數器
+        """
+        with self._lock:
+            stats = self._durations[(kind, name)]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            for key, value in counts.items():
+                self._counters[(kind, name, key)] += value
+            if self.jsonl_path:
+                line = {"ts": time.time(), "kind": kind, "name": name}
+                line.update(duration=round(duration, 6), **counts)
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def increment(self, kind: str, name: str, key: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[(kind, name, key)] += value
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "durations": {
+                    f"{kind}:{name}": {"count": s[0], "sum": s[1], "max": s[2]}
+                    for (kind, name), s in self._durations.items()
+                },
+                "counters": {
+                    f"{kind}:{name}:{key}": value
+                    for (kind, name, key), value in self._counters.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._durations.clear()
+            self._counters.clear()
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            durations = sorted(self._durations.items())
+            counters = sorted(self._counters.items())
+        lines = ["# TYPE esg_duration_seconds summary"]
+        for suffix, i in (("_count", 0), ("_sum", 1)):
+            for (kind, name), stats in durations:
+                labels = f'kind="{kind}",name="{_escape(name)}"'
+                lines.append(f"esg_duration_seconds{suffix}{{{labels}}} {stats[i]}")
+        lines.append("# TYPE esg_duration_seconds_max gauge")
+        for (kind, name), stats in durations:
+            labels = f'kind="{kind}",name="{_escape(name)}"'
+            lines.append(f"esg_duration_seconds_max{{{labels}}} {stats[2]}")
+        lines.append("# TYPE esg_total counter")
+        for (kind, name, key), value in counters:
+            labels = f'kind="{kind}",name="{_escape(name)}",key="{key}"'
+            lines.append(f"esg_total{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """
+        在背景執行緒提供 `GET /metrics`(Prometheus 文字格式)。已經啟動時直接回傳
+        原本的 server，重複初始化不會再綁定一次埠。
+        """
+        recorder = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = recorder.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        with self._lock:
+            if self._server is None:
+                self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+                threading.Thread(
+                    target=self._server.serve_forever, daemon=True
+                ).start()
+                logging.info(
+                    f"Metrics endpoint: http://{host}:{self._server.server_port}/metrics"
+                )
+            return self._server
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# 程序內共用的紀錄器，由 SettingsManager 設定輸出檔
+metrics = MetricsRecorder()
+
+
+def timed_step(func: Callable) -> Callable:
+    """記錄 workflow 步驟的耗時，放在 `@step` 之下。"""
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            metrics.record("step", func.__name__, time.perf_counter() - start)
+
+    return wrapper
+
+
+def _usage(response: Any) -> dict[str, int]:
+    raw = getattr(response, "raw", None)
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None:
+        return {}
+    counts = {}
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        value = usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+        if value is not None:
+            counts[key] = value
+    return counts
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    以 llama-index callback 記錄 LLM 與 embedding 呼叫的耗時與 token 數，
+    以及檢索的耗時與節點數。快取命中的 LLM 呼叫沒有 token 用量。
+    """
+
+    _EVENT_KINDS = {
+        CBEventType.LLM: "llm",
+        CBEventType.EMBEDDING: "embedding",
+        CBEventType.RETRIEVE: "retrieve",
+    }
+
+    def __init__(self, recorder: Optional[MetricsRecorder] = None) -> None:
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.recorder = recorder or metrics
+        self._starts: dict[str, tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        if event_type in self._EVENT_KINDS:
+            serialized = (payload or {}).get(EventPayload.SERIALIZED) or {}
+            name = serialized.get("model") or serialized.get("model_name") or ""
+            with self._lock:
+                self._starts[event_id] = (time.perf_counter(), name)
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        with self._lock:
+            start = self._starts.pop(event_id, None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start[0]
+        payload = payload or {}
+        kind = self._EVENT_KINDS[event_type]
+        if event_type == CBEventType.LLM:
+            response = payload.get(EventPayload.RESPONSE) or payload.get(
+                EventPayload.COMPLETION
+            )
+            counts = _usage(response)
+        elif event_type == CBEventType.EMBEDDING:
+            counts = {"texts": len(payload.get(EventPayload.CHUNKS) or [])}
+        else:
+            counts = {"nodes": len(payload.get(EventPayload.NODES) or [])}
+        self.recorder.record(kind, start[1] or kind, duration, **counts)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[dict[str, list[str]]] = None,
+    ) -> None:
+        pass
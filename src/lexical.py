@@ -0,0 +1,147 @@
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+from vector_store import top_k_indices
+
+LEXICAL_FNAME = "bm25.json"
+
+# 英數字詞(含小數)或連續的中日韓漢字
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?|[\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    適用於繁體中文報告書的斷詞：英數字以整個字詞為單位，漢字切成相鄰兩字的 bigram。
+
+    先做 NFKC 正規化，全形英數字(例如「２０２３」)與半形視為相同。
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text).lower()):
+        if match.isascii() or len(match) == 1:
+            tokens.append(match)
+        else:
+            tokens.extend(match[i : i + 2] for i in range(len(match) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    一家公司所有 chunk 的 BM25 倒排索引。
+
+    每個詞對應 (chunk 位置陣列, 詞頻陣列)，查詢時只需走訪問題中出現的詞，
+    分數以 NumPy 向量累加。
+    """
+
+    def __init__(
+        self,
+        node_ids: list[str],
+        doc_lens: np.ndarray,
+        postings: dict[str, tuple[np.ndarray, np.ndarray]],
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> None:
+        """
+        Args:
+            node_ids (list[str]): 每個位置對應的節點 ID
+            doc_lens (np.ndarray): 每個 chunk 的詞數
+            postings (dict[str, tuple[np.ndarray, np.ndarray]]): 詞 -> (chunk 位置, 詞頻)
+            k1 (float): BM25 詞頻飽和參數
+            b (float): BM25 長度正規化參數
+        """
+        self.node_ids = node_ids
+        self.doc_lens = np.asarray(doc_lens, dtype=np.float32)
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        # 所有 chunk 都沒有詞時平均長度為 0，以 1 代替避免分數變成 NaN
+        self.avg_doc_len = (
+            max(float(self.doc_lens.mean()), 1.0) if len(node_ids) else 1.0
+        )
+
+    @classmethod
+    def from_nodes(
+        cls, nodes: list[BaseNode], k1: float = 1.2, b: float = 0.75
+    ) -> "BM25Index":
+        doc_lens = []
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        for i, node in enumerate(nodes):
+            counts = Counter(tokenize(node.get_content()))
+            doc_lens.append(sum(counts.values()))
+            for term, count in counts.items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(i)
+                tfs.append(count)
+        return cls(
+            [node.node_id for node in nodes],
+            np.asarray(doc_lens, dtype=np.float32),
+            {
+                term: (np.asarray(docs, dtype=np.int32), np.asarray(tfs, np.float32))
+                for term, (docs, tfs) in postings.items()
+            },
+            k1=k1,
+            b=b,
+        )
+
+    def query(self, text: str, top_k: int) -> list[tuple[str, float]]:
+        """回傳 BM25 分數最高的 (節點 ID, 分數)，不含分數為 0 的 chunk。"""
+        num_docs = len(self.node_ids)
+        if not num_docs:
+            return []
+        scores = np.zeros(num_docs, dtype=np.float32)
+        for term in set(tokenize(text)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs, tfs = posting
+            idf = math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = 1 - self.b + self.b * self.doc_lens[docs] / self.avg_doc_len
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self.k1 * norm)
+        return [
+            (self.node_ids[i], float(scores[i]))
+            for i in top_k_indices(scores, top_k)
+            if scores[i] > 0
+        ]
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, LEXICAL_FNAME))
+
+    def persist(self, persist_dir: str) -> None:
+        os.makedirs(persist_dir, exist_ok=True)
+        path = os.path.join(persist_dir, LEXICAL_FNAME)
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "node_ids": self.node_ids,
+            "doc_lens": self.doc_lens.astype(int).tolist(),
+            "postings": {
+                term: [docs.tolist(), tfs.astype(int).tolist()]
+                for term, (docs, tfs) in self.postings.items()
+            },
+        }
+        # 先寫入暫存檔再取代，避免查詢中讀到寫到一半的檔案
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "BM25Index":
+        with open(os.path.join(persist_dir, LEXICAL_FNAME), encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            data["node_ids"],
+            np.asarray(data["doc_lens"], dtype=np.float32),
+            {
+                term: (np.asarray(docs, dtype=np.int32), np.asarray(tfs, np.float32))
+                for term, (docs, tfs) in data["postings"].items()
+            },
+            k1=data["k1"],
+            b=data["b"],
+        )
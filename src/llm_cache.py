@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional, Sequence
+
+from llama_index.core.base.llms.types import (ChatMessage, ChatResponse,
+                                              ChatResponseAsyncGen,
+                                              MessageRole)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.llms.openai import OpenAI
+
+
+class CompletionCache:
+    """
+    以 SQLite 儲存的 LLM 回應快取，key 為模型、溫度與 prompt 的雜湊。
+
+    超過 `ttl` 秒的項目視為過期；項目數超過 `max_entries` 時淘汰最久未使用者。
+    """
+
+    def __init__(
+        self, db_path: str, ttl: float = 86400, max_entries: int = 10000
+    ) -> None:
+        """
+        Args:
+            db_path (str): SQLite 檔案路徑
+            ttl (float): 快取有效秒數，0 表示不過期
+            max_entries (int): 最多保留的項目數，0 表示不限制
+        """
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT, created_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_accessed_at "
+            "ON completions (accessed_at)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, temperature: float, prompt: Any) -> str:
+        payload = json.dumps(
+            [model, temperature, prompt], ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM completions WHERE key IN ("
+                    "SELECT key FROM completions ORDER BY accessed_at DESC "
+                    "LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()
+            return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+class CachedOpenAI(OpenAI):
+    """
+    帶有 CompletionCache 的 OpenAI LLM。
+
+    complete/acomplete/chat/achat(包含 LLMRerank 與 agent 的呼叫)以及非同步串流都經過這裡，
+    需要呼叫工具(tool calls)的回應不會被快取。
+    """
+
+    _cache: Optional[CompletionCache] = PrivateAttr(default=None)
+
+    def __init__(self, cache: Optional[CompletionCache] = None, **kwargs: Any) -> None:
+        """
+        Args:
+            cache (Optional[CompletionCache]): 回應快取，None 表示不快取
+        """
+        super().__init__(**kwargs)
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "cached_openai_llm"
+
+    def _cache_key(self, messages: Sequence[ChatMessage], kwargs: dict) -> str:
+        prompt = [
+            [message.role.value, message.content, message.additional_kwargs]
+            for message in messages
+        ]
+        return self._cache.make_key(
+            self.model, self.temperature, [prompt, kwargs, self.additional_kwargs]
+        )
+
+    def _load(self, key: str) -> Optional[ChatResponse]:
+        value = self._cache.get(key)
+        if value is None:
+            return None
+        return ChatResponse(
+            message=ChatMessage(role=MessageRole.ASSISTANT, content=value)
+        )
+
+    def _store(self, key: str, response: ChatResponse) -> None:
+        if response.message.additional_kwargs.get("tool_calls"):
+            return
+        self._cache.put(key, response.message.content or "")
+
+    def _chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        if self._cache is None:
+            return super()._chat(messages, **kwargs)
+        key = self._cache_key(messages, kwargs)
+        response = self._load(key)
+        if response is None:
+            response = super()._chat(messages, **kwargs)
+            self._store(key, response)
+        return response
+
+    async def _achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        if self._cache is None:
+            return await super()._achat(messages, **kwargs)
+        key = self._cache_key(messages, kwargs)
+        response = self._load(key)
+        if response is None:
+            response = await super()._achat(messages, **kwargs)
+            self._store(key, response)
+        return response
+
+    async def _astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        if self._cache is None:
+            return await super()._astream_chat(messages, **kwargs)
+        key = self._cache_key(messages, kwargs)
+        cached = self._load(key)
+        if cached is not None:
+            # 命中時一次回傳完整內容
+            cached.delta = cached.message.content
+
+            async def replay() -> ChatResponseAsyncGen:
+                yield cached
+
+            return replay()
+
+        stream = await super()._astream_chat(messages, **kwargs)
+
+        async def record() -> ChatResponseAsyncGen:
+            last = None
+            async for response in stream:
+                last = response
+                yield response
+            # 最後一個片段的 message 帶有完整內容
+            if last is not None:
+                self._store(key, last)
+
+        return record()
@@ -0,0 +1,267 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Any, Optional, Sequence
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.base.llms.types import (ChatMessage, ChatResponse,
+                                              ChatResponseAsyncGen,
+                                              MessageRole)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import Document
+from llama_index.llms.openai import OpenAI
+from openai.types.chat.chat_completion_message_tool_call import (
+    ChatCompletionMessageToolCall, Function)
+
+from data_processing import DocumentLoader
+from lexical import tokenize
+
+# 合成報告書以換頁字元分隔每一頁
+PAGE_SEPARATOR = "\f"
+
+_PLAN_QUERY = re.compile(r"主問題：(.*)")
+_CANDIDATES = re.compile(r"following list: (\[.*?\])")
+
+
+class MockOpenAI(OpenAI):
+    """
+    不呼叫 API 的 OpenAI 替身，依 prompt 的種類回傳固定的結果，並模擬網路延遲。
+
+    繼承 OpenAI 以便 OpenAIAgent 使用；agent 帶有工具時先回傳呼叫第一個工具的
+    tool call，收到工具結果後直接以結果作答。
+    """
+
+    _latency: float = PrivateAttr(default=0.0)
+    _companies: list[str] = PrivateAttr(default_factory=list)
+
+    def __init__(
+        self, latency: float = 0.0, companies: Sequence[str] = (), **kwargs: Any
+    ) -> None:
+        """
+        Args:
+            latency (float): 每次呼叫的延遲秒數
+            companies (Sequence[str]): 拆解子問題時用來比對公司名稱
+        """
+        kwargs.setdefault("model", "gpt-4o-mini")
+        kwargs.setdefault("api_key", "mock")
+        super().__init__(**kwargs)
+        self._latency = latency
+        # 長的名稱先比對，避免「公司10」被當成「公司1」
+        self._companies = sorted(companies, key=len, reverse=True)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "mock_openai_llm"
+
+    def _respond(self, messages: Sequence[ChatMessage], kwargs: dict) -> ChatResponse:
+        last = messages[-1]
+        prompt = last.content or ""
+        if kwargs.get("tools") and last.role != MessageRole.TOOL:
+            tool = kwargs["tools"][0]["function"]["name"]
+            tool_call = ChatCompletionMessageToolCall(
+                id=f"call_{hashlib.md5(prompt.encode()).hexdigest()[:8]}",
+                type="function",
+                function=Function(name=tool, arguments=json.dumps({"input": prompt})),
+            )
+            message = ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content=None,
+                additional_kwargs={"tool_calls": [tool_call]},
+            )
+        else:
+            message = ChatMessage(
+                role=MessageRole.ASSISTANT, content=self._answer(prompt, last.role)
+            )
+        # 以字元數粗估 token 用量，讓 instrumentation 有數字可以彙總
+        prompt_tokens = sum(len(m.content or "") for m in messages) // 2
+        completion_tokens = len(message.content or "") // 2
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return ChatResponse(message=message, raw={"usage": usage})
+
+    def _answer(self, prompt: str, role: MessageRole) -> str:
+        if role == MessageRole.TOOL:
+            return prompt
+        if "JSON" in prompt and (match := _PLAN_QUERY.search(prompt)):
+            query = match.group(1).strip()
+            companies = self._find_companies(query)
+            subqueries = [{"company": company, "query": query} for company in companies]
+            return json.dumps(
+                {"exists": bool(companies), "subqueries": subqueries},
+                ensure_ascii=False,
+            )
+        if match := _CANDIDATES.search(prompt):
+            candidates = json.loads(match.group(1).replace("'", '"'))
+            matched = [c for c in self._find_companies(prompt) if c in candidates]
+            return (matched or candidates or [""])[0]
+        # 一般的問答與彙整：回傳 prompt 中間的一段文字
+        middle = len(prompt) // 2
+        return f"根據資料：{prompt[max(middle - 100, 0) : middle + 100]}"
+
+    def _find_companies(self, text: str) -> list[str]:
+        found = []
+        for company in self._companies:
+            if company in text and not any(company in f for f in found):
+                found.append(company)
+        return found
+
+    def _chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        time.sleep(self._latency)
+        return self._respond(messages, kwargs)
+
+    async def _achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        await asyncio.sleep(self._latency)
+        return self._respond(messages, kwargs)
+
+    async def _astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        response = await self._achat(messages, **kwargs)
+        content = response.message.content or ""
+
+        async def gen() -> ChatResponseAsyncGen:
+            text = ""
+            for i in range(0, len(content), 8):
+                text += content[i : i + 8]
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=text),
+                    delta=content[i : i + 8],
+                )
+
+        return gen()
+
+
+class HashEmbedding(BaseEmbedding):
+    """
+    以 BM25 斷詞結果做 feature hashing 的固定向量，不需要呼叫 API，
+    內容相近的文字仍會得到相近的向量。
+    """
+
+    dimensions: int = 256
+    latency: float = 0.0
+    # 查詢與文件以相同方式計算向量，查詢可以批次計算
+    symmetric_query: bool = True
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashEmbedding"
+
+    def _embed(self, text: str) -> Embedding:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in tokenize(text):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        time.sleep(self.latency)
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        await asyncio.sleep(self.latency)
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        # 延遲以批次計算，與實際 API 一次請求送出整批文字相同
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+
+class MockLlamaParse:
+    """
+    LlamaParse 的替身，讀取以 PAGE_SEPARATOR 分頁的合成報告書。
+    """
+
+    def __init__(
+        self, result_type: str = "json", language: str = "ch_tra", latency: float = 0.0
+    ) -> None:
+        self.result_type = result_type
+        self.language = language
+        self.latency = latency
+
+    def _read_pages(self, file_path: str) -> list[str]:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return f.read().split(PAGE_SEPARATOR)
+
+    async def aget_json(self, file_path: str) -> list[dict]:
+        await asyncio.sleep(self.latency)
+        pages = await asyncio.to_thread(self._read_pages, file_path)
+        return [
+            {
+                "file_path": file_path,
+                "pages": [
+                    {"page": i + 1, "text": text} for i, text in enumerate(pages)
+                ],
+            }
+        ]
+
+    async def aload_data(self, file_path: str) -> list[Document]:
+        await asyncio.sleep(self.latency)
+        pages = await asyncio.to_thread(self._read_pages, file_path)
+        return [Document(text=text) for text in pages]
+
+
+class MockDocumentLoader(DocumentLoader):
+    """以 MockLlamaParse 解析文件的 DocumentLoader。"""
+
+    def __init__(self, cache_dir: Optional[str] = None, latency: float = 0.0) -> None:
+        self.cache_dir = cache_dir
+        self.json_parser = MockLlamaParse("json", latency=latency)
+        self.md_parser = MockLlamaParse("markdown", latency=latency)
+
+
+_TOPICS = [
+    ("溫室氣體排放", "範疇一排放量為{a}公噸二氧化碳當量，範疇二排放量為{b}公噸"),
+    ("用電量", "全年用電量為{a}萬度，其中再生能源占比{c}%"),
+    ("用水量", "總取水量為{a}百萬公升，回收水使用率為{c}%"),
+    ("員工薪資", "非擔任主管職務之全時員工薪資平均數為{a}千元，中位數為{b}千元"),
+    ("女性主管", "女性主管比例為{c}%，女性員工占全體員工{d}%"),
+    ("職業安全", "失能傷害頻率為{e}，全年無重大職業災害"),
+    ("董事會", "董事會共有{f}席董事，其中獨立董事{g}席"),
+    ("供應商管理", "共完成{a}家供應商永續評鑑，在地採購比例為{c}%"),
+    ("社會參與", "全年公益投入{b}萬元，志工服務時數{a}小時"),
+    ("資訊安全", "全年資安教育訓練完成率{c}%，無重大資安事件"),
+]
+
+
+def synthetic_report(company: str, pages: int, year: int = 2023) -> list[str]:
+    """產生一家公司的合成永續報告書，每頁為一個主題，數字依公司名稱固定。"""
+    rng = random.Random(company)
+    report = []
+    for page in range(pages):
+        topic, template = _TOPICS[page % len(_TOPICS)]
+        values = {
+            "a": rng.randint(100, 99999),
+            "b": rng.randint(100, 99999),
+            "c": rng.randint(1, 99),
+            "d": rng.randint(1, 99),
+            "e": round(rng.uniform(0, 3), 2),
+            "f": rng.randint(7, 15),
+            "g": rng.randint(3, 6),
+        }
+        body = (
+            f"{company}於{year}年{template.format(**values)}。"
+            f"本公司持續推動{topic}相關管理措施，並依據GRI準則揭露相關資訊。"
+        )
+        report.append(
+            f"# {company} {year}年永續報告書 - {topic}\n\n" + body * rng.randint(2, 6)
+        )
+    return report
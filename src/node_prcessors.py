@@ -1,30 +1,96 @@
 import logging
-from typing import Optional
+from collections import defaultdict
+from typing import Any, Callable, Optional
 
 from llama_index.core import QueryBundle
 from llama_index.core.postprocessor.types import BaseNodePostprocessor
-from llama_index.core.schema import BaseNode, NodeWithScore
-from pydantic import Field
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore
+from llama_index.core.utils import get_tokenizer
+from pydantic import Field, PrivateAttr
 
 
 class PageGroupPostprocessor(BaseNodePostprocessor):
     all_nodes_from_doc: list[BaseNode] = Field(default_factory=list)
 
+    _page_index: dict[Any, list[BaseNode]] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        # 建立時先把節點依頁碼分組，查詢時只需查找檢索到的頁碼
+        page_index = defaultdict(list)
+        for node in self.all_nodes_from_doc:
+            page_index[node.metadata.get("pages")].append(node)
+        self._page_index = dict(page_index)
+
+    def _page_scores(self, nodes: list[NodeWithScore]) -> dict[Any, float]:
+        # 創建頁碼到分數的映射
+        return {node.node.metadata.get("pages"): node.score for node in nodes}
+
     def _postprocess_nodes(
         self, nodes: list[NodeWithScore], query_bundle: Optional[QueryBundle]
     ) -> list[NodeWithScore]:
-        # 創建頁碼到分數的映射
-        page_score_map = {node.node.metadata.get("pages"): node.score for node in nodes}
-
-        # 從all_nodes中篩選出相關頁碼的節點並創建NodeWithScore對象
+        page_score_map = self._page_scores(nodes)
         result_nodes = [
-            NodeWithScore(
-                node=node, score=page_score_map.get(node.metadata.get("pages"), 0)
-            )
-            for node in self.all_nodes_from_doc
-            if node.metadata.get("pages") in page_score_map
+            NodeWithScore(node=node, score=score)
+            for page, score in page_score_map.items()
+            for node in self._page_index.get(page, [])
         ]
+        return self._sort_and_log(result_nodes)
+
+    def _sort_and_log(self, result_nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+        result_nodes = sorted(result_nodes, key=lambda x: x.node.metadata.get("pages"))
         logging.info(
-            f"Result nodes: {[node.node.get_content for node in result_nodes]}"
+            "Result nodes: %d nodes from pages %s",
+            len(result_nodes),
+            [node.node.metadata.get("pages") for node in result_nodes],
         )
-        return sorted(result_nodes, key=lambda x: x.node.metadata.get("pages"))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(
+                "Result nodes content: %s",
+                [node.node.get_content() for node in result_nodes],
+            )
+        return result_nodes
+
+
+class TokenBudgetPageGroupPostprocessor(PageGroupPostprocessor):
+    """
+    與 PageGroupPostprocessor 相同，但依分數由高到低加入整頁節點，
+    累計 token 數超過 `max_tokens` 時停止，避免整頁展開讓合成的 prompt 過長。
+    """
+
+    max_tokens: int = 8000
+
+    _tokenizer: Callable[[str], list] = PrivateAttr()
+    _page_tokens: dict[Any, int] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._tokenizer = get_tokenizer()
+        self._page_tokens = {}
+
+    def _count_page_tokens(self, page: Any) -> int:
+        if page not in self._page_tokens:
+            self._page_tokens[page] = sum(
+                len(self._tokenizer(node.get_content(metadata_mode=MetadataMode.LLM)))
+                for node in self._page_index.get(page, [])
+            )
+        return self._page_tokens[page]
+
+    def _postprocess_nodes(
+        self, nodes: list[NodeWithScore], query_bundle: Optional[QueryBundle]
+    ) -> list[NodeWithScore]:
+        page_score_map = self._page_scores(nodes)
+        result_nodes = []
+        used_tokens = 0
+        for page, score in sorted(
+            page_score_map.items(), key=lambda x: x[1] or 0, reverse=True
+        ):
+            page_tokens = self._count_page_tokens(page)
+            if result_nodes and used_tokens + page_tokens > self.max_tokens:
+                continue
+            used_tokens += page_tokens
+            result_nodes.extend(
+                NodeWithScore(node=node, score=score)
+                for node in self._page_index.get(page, [])
+            )
+        return self._sort_and_log(result_nodes)
@@ -240,53 +240,33 @@ Answer:
 """
 
 
-GENERATION_PROMPT = """
-請分析以下問題，並根據涉及的公司數量進行分解：
+PLANNER_PROMPT = """
+請規劃如何回答以下問題，並以 JSON 回傳：
 主問題：{main_question}
-如果問題只涉及一家公司，請直接返回主問題。
-如果問題涉及多家公司，請為每家公司提供具體子問題。
-注意：
-1. 子問題不要過度詳細，只需要針對問題中提到的公司生成相關子問題
-2. 如果只涉及一家公司，只需提供該公司的子問題
-3. 根據上下文信息而非先驗知識。
-4. 確保回應僅包含有效的代碼。不要在對象前後添加任何句子。
-5. 不要重複schema。
-6. 將結果用[]包裹起來。
-該對象必須遵循以下模式：
 
-{schema}
+以下是產業的查詢表：
 
-例如：
-例子一. A公司的董事長和CEO是誰?
-[
-    {{
-        "company": "A",
-        "query": "A公司的董事長和CEO是誰?"
-    }}
-]
-
-例子二. A,B,C公司的董事長和CEO是誰?
-[
-    {{
-        "company": "A",
-        "query": "A公司的董事長和CEO是誰?"
-    }},
-    {{
-        "company": "B",
-        "query": "B公司的董事長和CEO是誰?"
-    }},
-    {{
-        "company": "C",
-        "query": "C公司的董事長和CEO是誰?"
-    }}
-]
+{table}
 
-"""
+規劃方式：
+1. 找出主問題提及的產業或公司。有部分公司可能有別名(alias)，例如合庫金也叫合庫金控，請仔細確認。
+2. 提及產業時，將產業換成查詢表中該產業的所有公司。
+3. 為每家公司產生一個子問題，子問題要寫出公司名稱，其餘內容與主問題相同，不要過度詳細。
+4. 如果提及的產業或公司不存在於產業查詢表中，exists 為 false，subqueries 為空陣列。
+5. 如果主問題沒有提及任何產業或公司，exists 為 true，subqueries 只有一個 company 為空字串、query 為主問題的子問題。
+6. 根據上下文信息而非先驗知識。
+
+回傳的 JSON 物件必須遵循以下模式：
 
-REFLECTION_PROMPT = """
-您之前創建的輸出導致了以下錯誤：{error}
-請重試，確保回應僅包含有效的JSON代碼。不要在JSON對象前後添加任何句子。
-不要重複schema。
+{schema}
+
+例如
+主問題：請分析食品業的薪水？
+食品業的公司包括愛之味和台榮公司：
+{{"exists": true, "subqueries": [{{"company": "愛之味", "query": "請分析愛之味的薪水？"}}, {{"company": "台榮", "query": "請分析台榮的薪水？"}}]}}
+"""
 
-原始查詢：{main_query}
+PLANNER_RETRY_PROMPT = """
+您之前的輸出導致了以下錯誤：{error}
+請重試，確保回應僅包含符合模式的 JSON 物件。
 """
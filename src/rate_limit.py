@@ -0,0 +1,332 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+import httpx
+
+from instrumentation import MetricsRecorder, metrics
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority: ContextVar[int] = ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+# 等待期間重新檢查的最長間隔，讓退避結束或優先權改變時能及時放行
+_MAX_SLEEP = 1.0
+# 背景請求讓出給等待中互動請求的輪詢間隔
+_YIELD_INTERVAL = 0.05
+# 收到 429 後速率最低降到設定值的比例
+_MIN_SCALE = 0.1
+# 每次成功回應後恢復的速率比例
+_RECOVERY_STEP = 0.05
+# 沒有 max_tokens 時預估的回應 token 數
+_DEFAULT_COMPLETION_TOKENS = 256
+
+
+@contextmanager
+def background_priority() -> Iterator[None]:
+    """區塊內的模型呼叫(包含建立的 task 與 to_thread)以背景優先權排程，讓給互動查詢。"""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(body: bytes) -> int:
+    """
+    由 OpenAI 請求內容粗估 token 數：UTF-8 每 3 bytes 約一個 token(中文一字約一個
+    token，英文會略為高估)，聊天請求再加上回應的 max_tokens，與供應商計算 TPM 的方式相同。
+    """
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return len(body) // 3
+    if not isinstance(payload, dict):
+        return len(body) // 3
+    if "input" in payload:
+        inputs = payload["input"]
+        texts = inputs if isinstance(inputs, list) else [inputs]
+        return sum(len(str(text).encode("utf-8")) // 3 + 1 for text in texts)
+    prompt = 0
+    for message in payload.get("messages", []):
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content)
+        prompt += len(content.encode("utf-8")) // 3 + 4
+    prompt += len(json.dumps(payload.get("tools", []))) // 3
+    completion = (
+        payload.get("max_completion_tokens")
+        or payload.get("max_tokens")
+        or _DEFAULT_COMPLETION_TOKENS
+    )
+    return prompt + completion
+
+
+class TokenBucket:
+    """每分鐘補充固定數量的 token bucket，容量為 burst_seconds 秒的配額。"""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10) -> None:
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, scale: float) -> None:
+        self.level = min(
+            self.capacity, self.level + (now - self.updated) * self.rate * scale
+        )
+        self.updated = now
+
+    def wait_time(self, amount: float, scale: float, reserve: float = 0.0) -> float:
+        """
+        Args:
+            amount (float): 需要的數量，超過容量的請求在桶滿時放行
+            scale (float): 目前的速率比例
+            reserve (float): 必須保留的容量比例，背景請求不能用掉這部分
+        """
+        needed = min(min(amount, self.capacity) + reserve * self.capacity, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / (self.rate * scale)
+
+
+class RateLimiter:
+    """
+    以每分鐘請求數(RPM)與 token 數(TPM)限制模型呼叫，同步與非同步呼叫共用同一份額度。
+
+    互動查詢優先：有互動請求在等待時背景請求先讓出，且背景請求不能用掉保留的容量。
+    收到 429 時依 Retry-After 暫停所有請求並將速率減半，之後每次成功回應逐步恢復。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        burst_seconds: float = 10,
+        background_reserve: float = 0.2,
+        max_backoff: float = 60,
+        recorder: Optional[MetricsRecorder] = None,
+    ) -> None:
+        """
+        Args:
+            name (str): 指標中的名稱，例如 llm、embedding
+            requests_per_minute (float): 每分鐘請求數上限，0 表示不限制
+            tokens_per_minute (float): 每分鐘 token 數上限，0 表示不限制
+            burst_seconds (float): 可以一次用掉幾秒份的配額
+            background_reserve (float): 保留給互動請求的容量比例
+            max_backoff (float): 沒有 Retry-After 時指數退避的秒數上限
+            recorder (Optional[MetricsRecorder]): 記錄等待時間與 429 次數
+        """
+        self.name = name
+        self.requests = (
+            TokenBucket(requests_per_minute, burst_seconds)
+            if requests_per_minute
+            else None
+        )
+        self.tokens = (
+            TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        )
+        self.background_reserve = background_reserve
+        self.max_backoff = max_backoff
+        self.recorder = recorder or metrics
+        self._lock = threading.Lock()
+        self._scale = 1.0
+        self._paused_until = 0.0
+        self._failures = 0
+        self._waiting_interactive = 0
+
+    def _reserve(self, tokens: int, priority: int) -> float:
+        """額度足夠時扣除並回傳 0，否則回傳建議等待的秒數。"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if priority == BACKGROUND and self._waiting_interactive:
+                return _YIELD_INTERVAL
+            reserve = self.background_reserve if priority == BACKGROUND else 0.0
+            wait = 0.0
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.refill(now, self._scale)
+                    wait = max(wait, bucket.wait_time(amount, self._scale, reserve))
+            if wait > 0:
+                return wait
+            if self.requests is not None:
+                self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.level -= tokens
+            return 0.0
+
+    def _set_waiting(self, priority: int, delta: int) -> None:
+        if priority == INTERACTIVE:
+            with self._lock:
+                self._waiting_interactive += delta
+
+    def _record_wait(self, priority: int, waited: float) -> None:
+        if waited > 0:
+            name = f"{self.name}:{'background' if priority == BACKGROUND else 'interactive'}"
+            self.recorder.record("rate_limit", name, waited)
+
+    async def acquire(self, tokens: int = 0) -> None:
+        priority = _priority.get()
+        start = time.perf_counter()
+        delay = self._reserve(tokens, priority)
+        if delay <= 0:
+            return
+        self._set_waiting(priority, 1)
+        try:
+            while delay > 0:
+                await asyncio.sleep(min(delay, _MAX_SLEEP))
+                delay = self._reserve(tokens, priority)
+        finally:
+            self._set_waiting(priority, -1)
+        self._record_wait(priority, time.perf_counter() - start)
+
+    def acquire_sync(self, tokens: int = 0) -> None:
+        priority = _priority.get()
+        start = time.perf_counter()
+        delay = self._reserve(tokens, priority)
+        if delay <= 0:
+            return
+        self._set_waiting(priority, 1)
+        try:
+            while delay > 0:
+                time.sleep(min(delay, _MAX_SLEEP))
+                delay = self._reserve(tokens, priority)
+        finally:
+            self._set_waiting(priority, -1)
+        self._record_wait(priority, time.perf_counter() - start)
+
+    def update(self, response: httpx.Response) -> None:
+        """依回應調整速率：429 時暫停並減速，成功時逐步恢復並對齊供應商回報的剩餘額度。"""
+        if response.status_code == 429:
+            with self._lock:
+                self._failures += 1
+                delay = _retry_after(response.headers)
+                if delay is None:
+                    delay = min(2 ** (self._failures - 1), self.max_backoff)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self._scale = max(self._scale / 2, _MIN_SCALE)
+                for bucket in (self.requests, self.tokens):
+                    if bucket is not None:
+                        bucket.level = min(bucket.level, 0.0)
+                scale = self._scale
+            self.recorder.increment("rate_limit", self.name, "throttled")
+            logging.warning(
+                f"{self.name} rate limited, pausing {delay:.1f}s "
+                f"(rate scaled to {scale:.0%})"
+            )
+            return
+        if not response.is_success:
+            return
+        with self._lock:
+            self._failures = 0
+            self._scale = min(self._scale + _RECOVERY_STEP, 1.0)
+            # 其他程序也在使用同一組額度時，以供應商回報的剩餘量為準
+            for bucket, header in (
+                (self.requests, "x-ratelimit-remaining-requests"),
+                (self.tokens, "x-ratelimit-remaining-tokens"),
+            ):
+                remaining = _float_header(response.headers, header)
+                if bucket is not None and remaining is not None:
+                    bucket.level = min(bucket.level, remaining)
+
+
+def _float_header(headers: httpx.Headers, name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def _retry_after(headers: httpx.Headers) -> Optional[float]:
+    if (milliseconds := _float_header(headers, "retry-after-ms")) is not None:
+        return milliseconds / 1000
+    return _float_header(headers, "retry-after")
+
+
+class _RateLimitRouting:
+    """依請求路徑選擇 embedding 或 LLM 的 RateLimiter。"""
+
+    def __init__(self, llm_limiter: RateLimiter, embedding_limiter: RateLimiter) -> None:
+        self.llm_limiter = llm_limiter
+        self.embedding_limiter = embedding_limiter
+
+    def _route(self, request: httpx.Request) -> tuple[RateLimiter, int]:
+        if request.url.path.endswith("/embeddings"):
+            limiter = self.embedding_limiter
+        else:
+            limiter = self.llm_limiter
+        try:
+            tokens = estimate_tokens(request.content)
+        except httpx.RequestNotRead:
+            tokens = 0
+        return limiter, tokens
+
+
+class RateLimitedTransport(_RateLimitRouting, httpx.BaseTransport):
+    """在送出請求前取得額度的同步 transport。"""
+
+    def __init__(
+        self,
+        transport: httpx.BaseTransport,
+        llm_limiter: RateLimiter,
+        embedding_limiter: RateLimiter,
+    ) -> None:
+        super().__init__(llm_limiter, embedding_limiter)
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        limiter, tokens = self._route(request)
+        limiter.acquire_sync(tokens)
+        response = self.transport.handle_request(request)
+        limiter.update(response)
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRateLimitedTransport(_RateLimitRouting, httpx.AsyncBaseTransport):
+    """
+    在送出請求前取得額度的非同步 transport。連線綁定 event loop，
+    每個 loop 各自建立底層 transport，額度則由所有 loop 共用。
+    """
+
+    def __init__(
+        self,
+        transport_factory: Callable[[], httpx.AsyncBaseTransport],
+        llm_limiter: RateLimiter,
+        embedding_limiter: RateLimiter,
+    ) -> None:
+        super().__init__(llm_limiter, embedding_limiter)
+        self.transport_factory = transport_factory
+        self._transports: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def _transport(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        transport = self._transports.get(loop)
+        if transport is None:
+            transport = self._transports[loop] = self.transport_factory()
+        return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        limiter, tokens = self._route(request)
+        await limiter.acquire(tokens)
+        response = await self._transport().handle_async_request(request)
+        limiter.update(response)
+        return response
+
+    async def aclose(self) -> None:
+        transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
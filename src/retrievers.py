@@ -0,0 +1,235 @@
+import asyncio
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Optional
+
+from llama_index.core import QueryBundle
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.settings import Settings
+from llama_index.core.storage.docstore.types import BaseDocumentStore
+
+from lexical import BM25Index
+from vector_store import ConsolidatedVectorStore
+
+
+# 查詢與文件使用同一個模型計算向量的 OpenAI 模型(兩種 mode 皆然)
+SYMMETRIC_EMBEDDING_MODELS = (
+    "text-embedding-3-small",
+    "text-embedding-3-large",
+    "text-embedding-ada-002",
+)
+
+
+async def aget_query_embedding_batch(
+    embed_model: BaseEmbedding, queries: list[str]
+) -> list[Embedding]:
+    """
+    以查詢模式計算一批向量。查詢向量與文件向量相同的模型以一次批次請求計算，
+    其他模型(例如舊的 text-search-*-query)同時送出各個 aget_query_embedding。
+    """
+    if not queries:
+        return []
+    if (
+        getattr(embed_model, "symmetric_query", False)
+        or embed_model.model_name in SYMMETRIC_EMBEDDING_MODELS
+    ):
+        return await embed_model.aget_text_embedding_batch(queries)
+    return list(
+        await asyncio.gather(*(embed_model.aget_query_embedding(q) for q in queries))
+    )
+
+
+async def aembed_query_bundles(
+    embed_model: BaseEmbedding, query_bundles: list[QueryBundle]
+) -> None:
+    """替還沒有向量的查詢以一次批次請求計算向量。"""
+    missing = [bundle for bundle in query_bundles if bundle.embedding is None]
+    if not missing:
+        return
+    embeddings = await aget_query_embedding_batch(
+        embed_model, [bundle.query_str for bundle in missing]
+    )
+    for bundle, embedding in zip(missing, embeddings):
+        bundle.embedding = embedding
+
+
+async def aretrieve_batch(
+    retriever: BaseRetriever, query_bundles: list[QueryBundle]
+) -> list[list[NodeWithScore]]:
+    """批次檢索，retriever 不支援批次時同時送出各個查詢。"""
+    if hasattr(retriever, "aretrieve_batch"):
+        return await retriever.aretrieve_batch(query_bundles)
+    return list(
+        await asyncio.gather(*(retriever.aretrieve(bundle) for bundle in query_bundles))
+    )
+
+
+def union_nodes(batches: list[list[NodeWithScore]]) -> list[NodeWithScore]:
+    """
+    合併多個查詢的檢索結果並去除重複的節點，依節點在各查詢中最好的名次排序，
+    每個查詢的前幾名都會排在前面。
+    """
+    # 節點 ID -> [最好的名次, 最高分, 節點]
+    best: dict[str, list] = {}
+    for nodes in batches:
+        for rank, node in enumerate(nodes):
+            node_id = node.node.node_id
+            if node_id not in best:
+                best[node_id] = [rank, node.score or 0.0, node]
+            else:
+                best[node_id][0] = min(best[node_id][0], rank)
+                best[node_id][1] = max(best[node_id][1], node.score or 0.0)
+    ranked = sorted(best.values(), key=lambda x: (x[0], -x[1]))
+    return [NodeWithScore(node=node.node, score=score) for _, score, node in ranked]
+
+
+class ConsolidatedRetriever(BaseRetriever):
+    """
+    以 ConsolidatedVectorStore 檢索一家或多家公司的節點，
+    可直接作為 RetrieverQueryEngine 的 retriever 使用。
+    """
+
+    def __init__(
+        self,
+        vector_store: ConsolidatedVectorStore,
+        docstores: Mapping[str, BaseDocumentStore],
+        companies: Optional[list[str]] = None,
+        similarity_top_k: int = 20,
+        embed_model: Optional[BaseEmbedding] = None,
+        **kwargs,
+    ) -> None:
+        """
+        Args:
+            vector_store (ConsolidatedVectorStore): 合併後的向量矩陣
+            docstores (Mapping[str, BaseDocumentStore]): 公司 -> 存放節點的 docstore
+            companies (Optional[list[str]]): 檢索範圍，None 表示 `docstores` 中所有公司
+            similarity_top_k (int): 每家公司回傳的節點數
+            embed_model (Optional[BaseEmbedding]): 查詢向量模型，預設為 Settings.embed_model
+        """
+        super().__init__(**kwargs)
+        self.vector_store = vector_store
+        self.docstores = docstores
+        self.companies = companies if companies is not None else list(docstores)
+        self.similarity_top_k = similarity_top_k
+        self.embed_model = embed_model or Settings.embed_model
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self.embed_model.get_query_embedding(
+                query_bundle.query_str
+            )
+        return self._to_nodes([query_bundle.embedding])[0]
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = await self.embed_model.aget_query_embedding(
+                query_bundle.query_str
+            )
+        return self._to_nodes([query_bundle.embedding])[0]
+
+    async def aretrieve_batch(
+        self, query_bundles: list[QueryBundle]
+    ) -> list[list[NodeWithScore]]:
+        """一批查詢只送出一次 embedding 請求，並以一次矩陣乘法評分。"""
+        await aembed_query_bundles(self.embed_model, query_bundles)
+        return self._to_nodes([bundle.embedding for bundle in query_bundles])
+
+    def _to_nodes(
+        self, query_embeddings: list[list[float]]
+    ) -> list[list[NodeWithScore]]:
+        results = self.vector_store.batch_query(
+            query_embeddings, self.similarity_top_k, self.companies
+        )
+        batch_nodes = []
+        for per_company in results:
+            nodes = []
+            for company, hits in per_company.items():
+                docstore = self.docstores[company]
+                for node_id, score in hits:
+                    # 索引重建後合併矩陣可能含有已刪除的節點
+                    node = docstore.get_node(node_id, raise_error=False)
+                    if node is not None:
+                        nodes.append(NodeWithScore(node=node, score=score))
+            batch_nodes.append(sorted(nodes, key=lambda x: x.score, reverse=True))
+        return batch_nodes
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    結合向量檢索與 BM25 關鍵字檢索，以 reciprocal rank fusion 合併兩者的排名，
+    不需要再呼叫 LLM 重新排序。
+    """
+
+    def __init__(
+        self,
+        vector_retriever: BaseRetriever,
+        lexical_index: BM25Index,
+        docstore: BaseDocumentStore,
+        similarity_top_k: int = 20,
+        lexical_top_k: int = 20,
+        rrf_k: int = 60,
+        **kwargs,
+    ) -> None:
+        """
+        Args:
+            vector_retriever (BaseRetriever): 向量檢索器
+            lexical_index (BM25Index): 同一家公司的 BM25 索引
+            docstore (BaseDocumentStore): 存放節點的 docstore，用來取得只被關鍵字檢索到的節點
+            similarity_top_k (int): 合併後回傳的節點數
+            lexical_top_k (int): BM25 檢索的節點數
+            rrf_k (int): RRF 的平滑常數，分數為 1 / (rrf_k + 名次)
+        """
+        super().__init__(**kwargs)
+        self.vector_retriever = vector_retriever
+        self.lexical_index = lexical_index
+        self.docstore = docstore
+        self.similarity_top_k = similarity_top_k
+        self.lexical_top_k = lexical_top_k
+        self.rrf_k = rrf_k
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        return self._fuse(
+            self.vector_retriever.retrieve(query_bundle),
+            self.lexical_index.query(query_bundle.query_str, self.lexical_top_k),
+        )
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        return self._fuse(
+            await self.vector_retriever.aretrieve(query_bundle),
+            self.lexical_index.query(query_bundle.query_str, self.lexical_top_k),
+        )
+
+    async def aretrieve_batch(
+        self, query_bundles: list[QueryBundle]
+    ) -> list[list[NodeWithScore]]:
+        vector_batches = await aretrieve_batch(self.vector_retriever, query_bundles)
+        return [
+            self._fuse(
+                vector_nodes,
+                self.lexical_index.query(bundle.query_str, self.lexical_top_k),
+            )
+            for vector_nodes, bundle in zip(vector_batches, query_bundles)
+        ]
+
+    def _fuse(
+        self, vector_nodes: list[NodeWithScore], lexical_hits: list[tuple[str, float]]
+    ) -> list[NodeWithScore]:
+        scores = defaultdict(float)
+        nodes = {}
+        for rank, node in enumerate(vector_nodes, start=1):
+            scores[node.node.node_id] += 1 / (self.rrf_k + rank)
+            nodes[node.node.node_id] = node.node
+        for rank, (node_id, _) in enumerate(lexical_hits, start=1):
+            if node_id not in nodes:
+                node = self.docstore.get_node(node_id, raise_error=False)
+                if node is None:
+                    continue
+                nodes[node_id] = node
+            scores[node_id] += 1 / (self.rrf_k + rank)
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        return [
+            NodeWithScore(node=nodes[node_id], score=score)
+            for node_id, score in ranked[: self.similarity_top_k]
+        ]
@@ -0,0 +1,219 @@
+import re
+from collections import deque
+from collections.abc import Iterable
+from typing import Generic, Optional, TypeVar
+
+from pydantic import BaseModel
+
+from events import IndustryMap
+
+T = TypeVar("T")
+
+
+class AhoCorasick(Generic[T]):
+    """
+    Aho-Corasick 多模式字串比對，建立後一次掃描即可找出文字中所有出現的關鍵字。
+    """
+
+    def __init__(self, patterns: dict[str, T]) -> None:
+        """
+        Args:
+            patterns (dict[str, T]): 關鍵字 -> 比對到時回傳的值
+        """
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # 每個狀態結束的關鍵字 (長度, 值)
+        self._output: list[list[tuple[int, T]]] = [[]]
+        for pattern, value in patterns.items():
+            if pattern:
+                self._add(pattern.lower(), value)
+        self._build_fail_links()
+
+    def _add(self, pattern: str, value: T) -> None:
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state].append((len(pattern), value))
+
+    def _build_fail_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def find_all(self, text: str) -> list[tuple[int, int, T]]:
+        """回傳所有比對結果 (起點, 終點, 值)，可能互相重疊。"""
+        matches = []
+        state = 0
+        for i, char in enumerate(text.lower()):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, value in self._output[state]:
+                matches.append((i + 1 - length, i + 1, value))
+        return matches
+
+    def find_longest(self, text: str) -> list[tuple[int, int, T]]:
+        """回傳由左至右、不重疊且優先取最長的比對結果，例如「國泰金控」不會再比對到「國泰」。"""
+        matches = sorted(self.find_all(text), key=lambda m: (m[0], m[0] - m[1]))
+        result, end = [], 0
+        for match in matches:
+            if match[0] >= end:
+                result.append(match)
+                end = match[1]
+        return result
+
+
+class CompanyRouter:
+    """
+    以公司名稱與別名比對問題中提到的公司，不需要呼叫 LLM。
+    """
+
+    def __init__(
+        self, companies: Iterable[str], industry_map: list[IndustryMap]
+    ) -> None:
+        """
+        Args:
+            companies (Iterable[str]): 可供查詢的公司，即 esg_agents_map 的 key
+            industry_map (list[IndustryMap]): 產業對照表，提供公司別名
+        """
+        self.companies = list(companies)
+        known = set(self.companies)
+        patterns: dict[str, set[str]] = {}
+        for company in self.companies:
+            patterns.setdefault(company, set()).add(company)
+        for item in industry_map:
+            if item.company not in known:
+                continue
+            for alias in item.alias:
+                # 同一個別名可能對應到多家公司
+                patterns.setdefault(alias, set()).add(item.company)
+        self._matcher = AhoCorasick(
+            {pattern: frozenset(companies) for pattern, companies in patterns.items()}
+        )
+
+    def route(self, text: str) -> list[str]:
+        """
+        回傳文字中提到的公司，依出現順序排列。別名對應到多家公司時會全部列出。
+        """
+        companies = []
+        for _, _, matched in self._matcher.find_longest(text):
+            for company in sorted(matched):
+                if company not in companies:
+                    companies.append(company)
+        return companies
+
+
+# 比對不到的文字中疑似提及其他公司的片段：以常見的公司名稱結尾的詞。
+# 不比對「和」「與」等連接詞，「董事長和總經理」這類問題也會用到
+_UNRESOLVED_MENTION = re.compile(
+    r"[\u3400-\u9fffA-Za-z0-9]+(?:股份有限公司|公司|金控|集團|銀行|控股|人壽|證券)"
+)
+
+
+class QueryResolution(BaseModel):
+    query: str
+    companies: list[str]
+    # 對應到多家公司、需要 LLM 判斷的別名 -> 候選公司
+    ambiguous: dict[str, list[str]]
+    # 可能提及了查詢表以外的公司，需要 LLM 判斷的片段
+    unresolved: list[str] = []
+
+
+class IndustryIndex(CompanyRouter):
+    """
+    產業對照表的索引，在載入產業 JSON 時建立一次。
+
+    除了公司別名外，也建立產業 -> 公司的對照，可以在本地把問題中的產業
+    換成所屬公司，只有無法確定的問題才需要交給 LLM。
+    """
+
+    def __init__(
+        self, companies: Iterable[str], industry_map: list[IndustryMap]
+    ) -> None:
+        super().__init__(companies, industry_map)
+        known = set(self.companies)
+        self.industry_map = [item for item in industry_map if item.company in known]
+        self.industry_to_companies: dict[str, list[str]] = {}
+        # 改寫問題時使用的公司名稱，取最長(最明確)的別名
+        self.display_names: dict[str, str] = {}
+        for item in self.industry_map:
+            self.display_names[item.company] = max(
+                item.alias, key=len, default=item.company
+            )
+            for industry in item.industry:
+                self.industry_to_companies.setdefault(industry, []).append(item.company)
+
+        # 公司與產業放在同一個比對器，「國泰金控」不會被當成產業「金控」
+        patterns: dict[str, tuple[str, tuple[str, ...]]] = {
+            industry: ("industry", tuple(companies))
+            for industry, companies in self.industry_to_companies.items()
+        }
+        for company in self.companies:
+            patterns[company] = ("company", (company,))
+        for item in self.industry_map:
+            for alias in item.alias:
+                kind, matched = patterns.get(alias, ("company", ()))
+                if kind == "industry":
+                    matched = ()
+                companies = tuple(sorted({*matched, item.company}))
+                patterns[alias] = ("company", companies)
+        self._mention_matcher = AhoCorasick(patterns)
+
+    def table_prompt(self, companies: Optional[Iterable[str]] = None) -> str:
+        """產業查詢表的文字，可以只列出指定的公司。"""
+        selected = set(companies) if companies is not None else None
+        return "。 \n\n".join(
+            f"{'、'.join(item.alias)}公司是{'、'.join(item.industry)}的公司，"
+            f"這是他們的資料{item.company}"
+            for item in self.industry_map
+            if selected is None or item.company in selected
+        )
+
+    def resolve(self, query: str) -> QueryResolution:
+        """
+        找出問題中提到的產業與公司，並把產業換成所屬公司的名稱。
+        """
+        parts, companies, ambiguous, unmatched = [], [], {}, []
+        end = 0
+        mentions = self._mention_matcher.find_longest(query)
+        for start, stop, (kind, matched) in mentions:
+            parts.append(query[end:start])
+            unmatched.append(query[end:start])
+            mention = query[start:stop]
+            if kind == "industry":
+                parts.append(
+                    "、".join(self.display_names[company] for company in matched)
+                )
+            else:
+                parts.append(mention)
+                if len(matched) > 1:
+                    ambiguous[mention] = list(matched)
+            for company in matched:
+                if company not in companies:
+                    companies.append(company)
+            end = stop
+        parts.append(query[end:])
+        unmatched.append(query[end:])
+        unresolved = [
+            match.group()
+            for text in unmatched
+            for match in _UNRESOLVED_MENTION.finditer(text)
+        ]
+        return QueryResolution(
+            query="".join(parts),
+            companies=companies,
+            ambiguous=ambiguous,
+            unresolved=unresolved,
+        )
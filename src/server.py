@@ -0,0 +1,280 @@
+"""
+非同步查詢服務(ASGI)。所有請求共用同一份公司 agent 註冊表與模型連線池，
+在同一個 event loop 上同時執行多個 ESGReportWorkflow。
+
+    python server.py
+    uvicorn server:app --host 0.0.0.0 --port 8000
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+# workflow.Config 在 import 時讀取環境變數
+load_dotenv(override=True)
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import (JSONResponse, PlainTextResponse, Response,
+                                 StreamingResponse)
+from starlette.routing import Route
+from starlette.types import Receive, Scope, Send
+
+from answer_cache import SemanticAnswerCache
+from instrumentation import metrics
+from routing import IndustryIndex
+from workflow import (Config, ESGReportWorkflow, IngestionError,
+                      ProgressEvent, SettingsManager, create_agent_registry,
+                      ingest_documents, load_industry_map, save_document)
+
+
+class QueryService:
+    """
+    服務層級的共用狀態：公司 agent、產業索引、答案快取與並行數量限制。
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queued: int = 32) -> None:
+        """
+        Args:
+            max_concurrent (int): 同時執行的問題數
+            max_queued (int): 額外可以排隊等待的問題數，超過時回應 503
+        """
+        self.registry = create_agent_registry()
+        self.industry_map = load_industry_map()
+        self.industry_index = IndustryIndex(self.registry.keys(), self.industry_map)
+        self.answer_cache = None
+        if Config.ANSWER_CACHE:
+            self.answer_cache = SemanticAnswerCache(
+                threshold=Config.ANSWER_CACHE_THRESHOLD,
+                max_entries=Config.ANSWER_CACHE_MAX_ENTRIES,
+            )
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        # 執行中與等待中的問題數
+        self.pending = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._ingest_lock = asyncio.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self.pending >= self.max_concurrent + self.max_queued
+
+    def reserve(self) -> bool:
+        """佔用一個執行或排隊的位置，已滿時回傳 False。檢查與佔用之間沒有 await。"""
+        if self.busy:
+            return False
+        self.pending += 1
+        return True
+
+    def release(self) -> None:
+        """釋放 `reserve` 佔用的位置。"""
+        self.pending -= 1
+
+    @asynccontextmanager
+    async def limit(self, release: bool = True) -> AsyncIterator[None]:
+        """
+        以 `reserve` 佔用的位置等待執行。`release` 為 True 時離開時釋放位置，
+        否則由呼叫端(例如 ReservedStreamingResponse)負責釋放。
+        """
+        try:
+            async with self._semaphore:
+                yield
+        finally:
+            if release:
+                self.release()
+
+    def create_workflow(self) -> ESGReportWorkflow:
+        return ESGReportWorkflow(
+            timeout=300,
+            verbose=False,
+            esg_agents_map=self.registry,
+            industry_map=self.industry_map,
+            industry_index=self.industry_index,
+            answer_cache=self.answer_cache,
+        )
+
+    async def ingest(self, files: list[tuple[str, bytes]]) -> list[str]:
+        """建立上傳報告書的索引，並讓新的索引在之後的查詢中生效。"""
+        async with self._ingest_lock:
+            file_paths = [
+                await asyncio.to_thread(save_document, name, data)
+                for name, data in files
+            ]
+            try:
+                companies = await ingest_documents(file_paths)
+            except IngestionError as e:
+                # 成功建立索引的公司仍然要讓舊的 agent 與快取答案失效
+                self._refresh(e.completed)
+                raise
+            self._refresh(companies)
+        return companies
+
+    def _refresh(self, companies: list[str]) -> None:
+        self.registry.refresh(Config.list_companies())
+        for company in companies:
+            self.registry.invalidate(company)
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(companies)
+        self.industry_index = IndustryIndex(self.registry.keys(), self.industry_map)
+
+
+class ReservedStreamingResponse(StreamingResponse):
+    """
+    持有 `QueryService.reserve` 佔用的位置的串流回應。
+
+    用戶端在產生器開始執行前就斷線時，產生器內的 `limit` 不會執行，
+    因此由回應本身在結束時(包括斷線與傳送失敗)關閉產生器並釋放位置。
+    """
+
+    def __init__(
+        self, service: QueryService, content: AsyncIterator[str], **kwargs: Any
+    ) -> None:
+        super().__init__(content, **kwargs)
+        self.service = service
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                self.service.release()
+
+
+def _busy_response() -> JSONResponse:
+    return JSONResponse({"error": "查詢服務忙碌中，請稍後再試"}, status_code=503)
+
+
+async def _read_question(request: Request) -> Optional[str]:
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return None
+    question = body.get("question") if isinstance(body, dict) else None
+    return question if isinstance(question, str) and question.strip() else None
+
+
+async def health(request: Request) -> Response:
+    service: QueryService = request.app.state.service
+    return JSONResponse(
+        {
+            "status": "ok",
+            "companies": len(service.registry),
+            "loaded_agents": len(service.registry.loaded),
+            "pending_queries": service.pending,
+        }
+    )
+
+
+async def companies(request: Request) -> Response:
+    service: QueryService = request.app.state.service
+    return JSONResponse({"companies": list(service.registry.keys())})
+
+
+async def query(request: Request) -> Response:
+    service: QueryService = request.app.state.service
+    question = await _read_question(request)
+    if question is None:
+        return JSONResponse({"error": "Please provide a question"}, status_code=400)
+    if not service.reserve():
+        return _busy_response()
+    async with service.limit():
+        result = await service.create_workflow().run(question=question)
+    return JSONResponse({"answer": str(result)})
+
+
+async def query_stream(request: Request) -> Response:
+    """以 NDJSON 逐行回傳步驟進度與答案片段。"""
+    service: QueryService = request.app.state.service
+    question = await _read_question(request)
+    if question is None:
+        return JSONResponse({"error": "Please provide a question"}, status_code=400)
+    # 回傳 StreamingResponse 之前就佔用位置，否則同時送達的請求都會通過檢查
+    if not service.reserve():
+        return _busy_response()
+
+    async def lines() -> AsyncIterator[str]:
+        async with service.limit(release=False):
+            try:
+                async for event in service.create_workflow().astream(question):
+                    if isinstance(event, ProgressEvent):
+                        data = {"type": "progress", "message": event.message}
+                    else:
+                        data = {"type": "token", "delta": event.delta}
+                    yield json.dumps(data, ensure_ascii=False) + "\n"
+            except Exception as e:
+                logging.exception(e)
+                yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+                return
+        yield json.dumps({"type": "done"}) + "\n"
+
+    return ReservedStreamingResponse(
+        service, lines(), media_type="application/x-ndjson"
+    )
+
+
+async def documents(request: Request) -> Response:
+    service: QueryService = request.app.state.service
+    async with request.form() as form:
+        files = [
+            (os.path.basename(upload.filename), await upload.read())
+            for upload in form.getlist("files")
+            if getattr(upload, "filename", None)
+        ]
+    if not files:
+        return JSONResponse({"error": "No files uploaded"}, status_code=400)
+    try:
+        companies = await service.ingest(files)
+    except IngestionError as e:
+        return JSONResponse(
+            {"error": str(e), "companies": e.completed}, status_code=500
+        )
+    return JSONResponse({"companies": companies})
+
+
+async def prometheus_metrics(request: Request) -> Response:
+    return PlainTextResponse(
+        metrics.prometheus_text(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    SettingsManager.initialize(shared_http_clients=True)
+    app.state.service = QueryService(
+        Config.MAX_CONCURRENT_QUERIES, Config.MAX_QUEUED_QUERIES
+    )
+    try:
+        yield
+    finally:
+        await SettingsManager.close_http_clients()
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/companies", companies, methods=["GET"]),
+        Route("/query", query, methods=["POST"]),
+        Route("/query/stream", query_stream, methods=["POST"]),
+        Route("/documents", documents, methods=["POST"]),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(
+        app,
+        host=os.getenv("SERVICE_HOST", "0.0.0.0"),
+        port=int(os.getenv("SERVICE_PORT", "8000")),
+    )
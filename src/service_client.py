@@ -0,0 +1,61 @@
+import json
+from collections.abc import AsyncIterator
+
+import httpx
+
+from events import ProgressEvent, TokenEvent
+
+
+class QueryServiceClient:
+    """
+    查詢服務(server.py)的客戶端，介面與 ESGReportWorkflow.astream 相同，
+    Streamlit 可以直接替換使用。
+    """
+
+    def __init__(self, base_url: str, timeout: float = 300) -> None:
+        """
+        Args:
+            base_url (str): 服務網址，例如 http://localhost:8000
+            timeout (float): 請求逾時秒數
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def companies(self) -> list[str]:
+        response = httpx.get(f"{self.base_url}/companies", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["companies"]
+
+    def upload(self, pdf_docs) -> list[str]:
+        """上傳報告書並等待服務建立索引，回傳完成的公司。"""
+        files = [
+            ("files", (pdf_doc.name, pdf_doc.getvalue(), "application/pdf"))
+            for pdf_doc in pdf_docs
+        ]
+        # 解析與建立索引可能需要數分鐘，不設逾時
+        response = httpx.post(f"{self.base_url}/documents", files=files, timeout=None)
+        if response.status_code != 200:
+            raise RuntimeError(response.json().get("error", response.text))
+        return response.json()["companies"]
+
+    async def astream(
+        self, question: str
+    ) -> AsyncIterator[ProgressEvent | TokenEvent]:
+        # Streamlit 每個問題以 asyncio.run 執行，AsyncClient 不能跨 event loop 共用
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            async with client.stream(
+                "POST", f"{self.base_url}/query/stream", json={"question": question}
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise RuntimeError(response.json().get("error", response.text))
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data["type"] == "progress":
+                        yield ProgressEvent(message=data["message"])
+                    elif data["type"] == "token":
+                        yield TokenEvent(delta=data["delta"])
+                    elif data["type"] == "error":
+                        raise RuntimeError(data["message"])
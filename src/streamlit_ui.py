@@ -1,28 +1,61 @@
 import asyncio
-import json
 import logging
 import os
 import time
 
+import httpx
 import streamlit as st
 
-from agents import AgentBuilder
+from answer_cache import SemanticAnswerCache
 from html_template import bot_template, css, user_template
-from workflow import (Config, ESGReportWorkflow, IndustryMap, SettingsManager,
-                      process_documents)
+from routing import IndustryIndex
+from service_client import QueryServiceClient
+from workflow import (Config, ESGReportWorkflow, IngestionError, ProgressEvent,
+                      SettingsManager, create_agent_registry,
+                      load_industry_map, process_documents)
 
 
 @st.cache_resource()
 def initialize_agents():
     SettingsManager.initialize()
-    agent_builder = AgentBuilder(Config.ESG_DIR_PATH)
-    return agent_builder.build_esg_agents(Config.list_companies())
+    return create_agent_registry()
+
+
+@st.cache_resource()
+def initialize_answer_cache():
+    if not Config.ANSWER_CACHE:
+        return None
+    return SemanticAnswerCache(
+        threshold=Config.ANSWER_CACHE_THRESHOLD,
+        max_entries=Config.ANSWER_CACHE_MAX_ENTRIES,
+    )
+
+
+@st.cache_resource()
+def initialize_industry_map():
+    return load_industry_map()
+
+
+@st.cache_resource()
+def initialize_industry_index():
+    # 與共用的 agent 註冊表一起跨 session 共用，報告書更新後由 refresh_local_agents 清除
+    return IndustryIndex(initialize_agents().keys(), initialize_industry_map())
+
+
+def list_companies() -> list[str]:
+    if Config.QUERY_SERVICE_URL:
+        return st.session_state.query_client.companies()
+    return Config.list_companies()
 
 
 def update_sidebar_companies() -> None:
     st.sidebar.subheader("公司列表")
     if "companies" not in st.session_state:
-        st.session_state.companies = Config.list_companies()
+        try:
+            st.session_state.companies = list_companies()
+        except httpx.HTTPError as e:
+            st.sidebar.error(f"無法取得公司列表：{e}")
+            return
     company_count = len(st.session_state.companies)
     st.sidebar.write(f"目前共有 {company_count} 家企業永續報告書")
     with st.sidebar.expander("點擊展開", expanded=False):
@@ -40,26 +73,83 @@ def update_sidebar_companies() -> None:
             if st.button("處理"):
                 with st.spinner("處理中"):
                     if pdf_docs:
-                        asyncio.run(process_documents(pdf_docs))
+                        if Config.QUERY_SERVICE_URL:
+                            try:
+                                st.session_state.query_client.upload(pdf_docs)
+                            except (RuntimeError, httpx.HTTPError) as e:
+                                st.error(f"處理失敗：{e}")
+                                return
+                        else:
+                            try:
+                                companies = asyncio.run(process_documents(pdf_docs))
+                            except IngestionError as e:
+                                # 成功的公司仍然要重新載入，失敗的列出給使用者
+                                refresh_local_agents(e.completed)
+                                st.session_state.companies = list_companies()
+                                st.error(f"處理失敗：{'、'.join(e.failures)}")
+                                return
+                            refresh_local_agents(companies)
+                        st.session_state.companies = list_companies()
                         st.success("文件處理完成！")
                     else:
                         st.write("沒有文件被上傳。")
 
 
+def refresh_local_agents(companies: list[str]) -> None:
+    registry = st.session_state.esg_agents_map
+    registry.refresh(Config.list_companies())
+    for company in companies:
+        registry.invalidate(company)
+    if st.session_state.answer_cache is not None:
+        st.session_state.answer_cache.invalidate(companies)
+    # 其他 session 下一個問題也會用到新的公司列表
+    initialize_industry_index.clear()
+
+
+async def stream_response(
+    workflow: ESGReportWorkflow | QueryServiceClient, user_question: str
+) -> str:
+    """邊執行邊顯示步驟進度與答案片段，回傳完整答案。"""
+    status = st.status("處理中...")
+    placeholder = st.empty()
+    response = ""
+    async for event in workflow.astream(user_question):
+        if isinstance(event, ProgressEvent):
+            status.write(event.message)
+        else:
+            response += event.delta
+            placeholder.write(
+                bot_template.replace("{{MSG}}", response), unsafe_allow_html=True
+            )
+    status.update(label="完成", state="complete", expanded=False)
+    placeholder.empty()
+    return response
+
+
 def handle_userinput(user_question: str) -> None:
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = []
 
-    workflow = ESGReportWorkflow(
-        timeout=300,
-        verbose=True,
-        esg_agents_map=st.session_state.esg_agents_map,
-        industry_map=st.session_state.industry_map,
-    )
-    response = asyncio.run(workflow.run(question=user_question))
-    st.session_state.chat_history.append(
-        {"role": "assistant", "content": str(response)}
-    )
+    if Config.QUERY_SERVICE_URL:
+        workflow = st.session_state.query_client
+    else:
+        workflow = ESGReportWorkflow(
+            timeout=300,
+            verbose=True,
+            esg_agents_map=st.session_state.esg_agents_map,
+            industry_map=initialize_industry_map(),
+            industry_index=initialize_industry_index(),
+            answer_cache=st.session_state.answer_cache,
+        )
+    try:
+        response = asyncio.run(stream_response(workflow, user_question))
+    except (RuntimeError, httpx.HTTPError) as e:
+        # 查詢服務忙碌或連線失敗
+        if not Config.QUERY_SERVICE_URL:
+            raise
+        st.error(f"查詢失敗：{e}")
+        return
+    st.session_state.chat_history.append({"role": "assistant", "content": response})
     st.session_state.chat_history.append({"role": "user", "content": user_question})
     for message in st.session_state.chat_history[::-1]:
         template = user_template if message["role"] == "user" else bot_template
@@ -73,19 +163,16 @@ def main():
     st.write(css, unsafe_allow_html=True)
     st.header("向多個PDF問問題 :books:")
 
-    if "esg_agents_map" not in st.session_state:
-        st.session_state.esg_agents_map = initialize_agents()
-    if "industry_map" not in st.session_state:
-        with open(Config.INDUSTRY_FILE_PATH, "r") as f:
-            industry_data = json.load(f)
-            st.session_state.industry_map = [
-                IndustryMap(
-                    company=item["company"],
-                    industry=item["industry"],
-                    alias=item["alias"],
-                )
-                for item in industry_data
-            ]
+    if Config.QUERY_SERVICE_URL:
+        # 由查詢服務載入 agent 並執行查詢，這裡只負責顯示
+        if "query_client" not in st.session_state:
+            st.session_state.query_client = QueryServiceClient(
+                Config.QUERY_SERVICE_URL
+            )
+    else:
+        if "esg_agents_map" not in st.session_state:
+            st.session_state.esg_agents_map = initialize_agents()
+            st.session_state.answer_cache = initialize_answer_cache()
     user_question = st.text_input(
         "問一個關於你文件的問題：（模型：GPT-4o-mini · 生成的內容可能不准確或錯誤）"
     )
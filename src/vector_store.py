@@ -0,0 +1,896 @@
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Optional, Sequence
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import (DEFAULT_VECTOR_STORE,
+                                                   NAMESPACE_SEP,
+                                                   SimpleVectorStore)
+from llama_index.core.vector_stores.types import (DEFAULT_PERSIST_FNAME,
+                                                  BasePydanticVectorStore,
+                                                  VectorStoreQuery,
+                                                  VectorStoreQueryMode,
+                                                  VectorStoreQueryResult)
+
+MATRIX_SUFFIX = ".npy"
+IDS_SUFFIX = "_ids.json"
+SCALES_SUFFIX = "_scales.npy"
+FULL_SUFFIX = "_full.npy"
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+# 評分與寫檔時每次轉換為 float32 的區塊大小(bytes)，壓縮矩陣不會整個展開
+SCORE_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def _chunk_rows(width: int) -> int:
+    """每個區塊的列數，`width` 維的 float32 列不超過 SCORE_CHUNK_BYTES。"""
+    return max(1, SCORE_CHUNK_BYTES // (max(width, 1) * 4))
+
+
+def list_companies(esg_dir_path: str) -> list[str]:
+    """`esg_dir_path` 中已建立索引(有 `vector/` 目錄)的公司。"""
+    return [
+        dirname
+        for dirname in os.listdir(esg_dir_path)
+        if os.path.isdir(os.path.join(esg_dir_path, dirname))
+        and os.path.exists(os.path.join(esg_dir_path, dirname, "vector"))
+        and dirname != "industry_map"
+    ]
+
+
+def _base_path(persist_path: str) -> str:
+    """`.../default__vector_store.json` -> `.../default__vector_store`"""
+    return os.path.splitext(persist_path)[0]
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """將每一列向量正規化為單位長度，內積即為 cosine 相似度。"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """以 argpartition 取出分數最高的 k 個位置，並依分數由高到低排序。"""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[-1])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class StackedRows:
+    """把多個矩陣視為依序相接的一個矩陣，只支援以列索引讀取，不需要複製資料。"""
+
+    def __init__(self, parts: list[np.ndarray]) -> None:
+        self.parts = parts
+        self.offsets = np.cumsum([0] + [len(part) for part in parts])
+        self.shape = (int(self.offsets[-1]), parts[0].shape[1] if parts else 0)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.empty((len(rows), self.shape[1]), dtype=np.float32)
+        part_ids = np.searchsorted(self.offsets, rows, side="right") - 1
+        for part_id in np.unique(part_ids):
+            mask = part_ids == part_id
+            result[mask] = self.parts[part_id][rows[mask] - self.offsets[part_id]]
+        return result
+
+
+class QuantizedMatrix:
+    """
+    壓縮儲存的已正規化向量矩陣。向量可以截斷為前 dims 維(Matryoshka)後重新正規化，
+    並以 float16 或 int8(每列一個 scale)儲存，評分時分塊轉回 float32 計算。
+
+    壓縮或截斷時另外保留全精度向量(載入時以 memory map 開啟，平常不佔記憶體)，
+    用來重新計算候選節點的分數。
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        scales: Optional[np.ndarray] = None,
+        dims: int = 0,
+        full: Optional[np.ndarray | StackedRows] = None,
+    ) -> None:
+        """
+        Args:
+            data (np.ndarray): 壓縮後的矩陣 (n, dims)
+            scales (Optional[np.ndarray]): int8 每一列的 scale (n,)
+            dims (int): 截斷後的維度，0 表示不截斷
+            full (Optional[np.ndarray | StackedRows]): 全精度的已正規化向量 (n, dim)
+        """
+        self.data = data
+        self.scales = scales
+        self.dims = dims
+        self.full = full
+
+    @classmethod
+    def from_vectors(
+        cls,
+        vectors: Any,
+        dtype: str = "float32",
+        dims: int = 0,
+        keep_full: bool = True,
+    ) -> "QuantizedMatrix":
+        """
+        Args:
+            vectors (Any): 向量矩陣 (n, dim)，不需要事先正規化
+            dtype (str): 儲存精度，float32、float16 或 int8
+            dims (int): 截斷後的維度，0 或不小於原始維度表示不截斷
+            keep_full (bool): 壓縮或截斷時是否保留全精度向量。全精度向量在寫入檔案
+                並以 memory map 載入前都在記憶體中，只做查詢時不保留
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        full = normalize(vectors)
+        if full.ndim != 2 or not len(full):
+            scales = np.empty(0, dtype=np.float32) if dtype == "int8" else None
+            return cls(np.empty((0, 0), dtype=dtype), scales, dims)
+        if dims >= full.shape[1]:
+            dims = 0
+        compact = normalize(full[:, :dims]) if dims else full
+        scales = None
+        if dtype == "int8":
+            scales = np.abs(compact).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            data = np.round(compact / scales[:, None]).astype(np.int8)
+            scales = scales.astype(np.float32)
+        else:
+            data = compact.astype(dtype)
+        keep_full = keep_full and (dtype != "float32" or bool(dims))
+        return cls(data, scales, dims, full if keep_full else None)
+
+    @classmethod
+    def concatenate(
+        cls, parts: list["QuantizedMatrix"], dtype: str = "float32", dims: int = 0
+    ) -> "QuantizedMatrix":
+        """
+        依序相接多個矩陣。格式與指定的相同時直接相接，全精度向量不會複製到記憶體；
+        否則以各部分的全精度向量重新壓縮。
+        """
+        if not parts:
+            return cls.from_vectors(np.empty((0, 0)), dtype, dims)
+        if all(
+            part.dtype == dtype
+            and part.dims == dims
+            and (part.full is not None) == (dtype != "float32" or bool(dims))
+            for part in parts
+        ):
+            scales = None
+            if dtype == "int8":
+                scales = np.concatenate([part.scales for part in parts])
+            full = None
+            if parts[0].full is not None:
+                full = StackedRows([part.full for part in parts])
+            return cls(
+                np.concatenate([np.asarray(part.data) for part in parts]),
+                scales,
+                dims,
+                full,
+            )
+        return cls.from_vectors(
+            np.vstack([part.dequantize() for part in parts]), dtype, dims
+        )
+
+    @property
+    def dtype(self) -> str:
+        return str(self.data.dtype)
+
+    @property
+    def nbytes(self) -> int:
+        """常駐記憶體的大小，不包含以 memory map 開啟的全精度向量。"""
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def dequantize(self) -> np.ndarray:
+        """全精度向量；沒有保留時由壓縮的矩陣還原(截斷的維度無法還原)。"""
+        if self.full is not None:
+            return self.full[np.arange(len(self))]
+        data = np.asarray(self.data, dtype=np.float32)
+        if self.scales is not None:
+            data = data * self.scales[:, None]
+        return data
+
+    def take(self, keep: np.ndarray) -> "QuantizedMatrix":
+        """只保留 `keep` 為 True 的列。"""
+        return QuantizedMatrix(
+            np.asarray(self.data)[keep],
+            self.scales[keep] if self.scales is not None else None,
+            self.dims,
+            self.full[np.flatnonzero(keep)] if self.full is not None else None,
+        )
+
+    def prepare_queries(self, queries: Any) -> np.ndarray:
+        """將全精度的查詢向量截斷並正規化成與壓縮矩陣相同的維度。"""
+        queries = normalize(np.atleast_2d(queries))
+        return normalize(queries[:, : self.dims]) if self.dims else queries
+
+    def score(self, queries: Any, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        以壓縮的矩陣計算 cosine 相似度。
+
+        Args:
+            queries (Any): 全精度的查詢向量 (batch, dim)
+            rows (Optional[np.ndarray]): 只計算這些列，None 表示全部
+
+        Returns:
+            np.ndarray: 分數 (batch, n)
+        """
+        queries = self.prepare_queries(queries)
+        n = len(self.data) if rows is None else len(rows)
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        step = _chunk_rows(self.data.shape[1])
+        for start in range(0, n, step):
+            end = min(start + step, n)
+            # 指定列時也逐塊取出，不先複製所有候選列
+            block = self.data[start:end] if rows is None else self.data[rows[start:end]]
+            scores[:, start:end] = queries @ np.asarray(block, np.float32).T
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+    def top_k(
+        self,
+        query: Any,
+        scores: np.ndarray,
+        k: int,
+        rescore: int = 0,
+        row_ids: Optional[np.ndarray] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        從壓縮矩陣的分數中取出前 k 名。有全精度向量且 rescore > 1 時，先取
+        k * rescore 個候選，再以全精度向量重新計算分數後取前 k 名。
+
+        Args:
+            query (Any): 全精度的查詢向量 (dim,)
+            scores (np.ndarray): `score` 算出的一個查詢的分數 (m,)
+            k (int): 回傳的數量
+            rescore (int): 候選數是 k 的幾倍，0 或 1 表示不重新計算
+            row_ids (Optional[np.ndarray]): `scores` 每個位置對應的矩陣列，None 表示相同
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (`scores` 中的位置, 分數)，由高到低排序
+        """
+        if self.full is None or rescore <= 1:
+            top = top_k_indices(scores, k)
+            return top, scores[top]
+        candidates = top_k_indices(scores, k * rescore)
+        rows = candidates if row_ids is None else row_ids[candidates]
+        # 依列的順序讀取，memory map 的全精度向量只讀入需要的分頁
+        order = np.argsort(rows)
+        exact = np.empty(len(rows), dtype=np.float32)
+        full_rows = np.asarray(self.full[rows[order]], dtype=np.float32)
+        exact[order] = full_rows @ normalize(query).reshape(-1)
+        top = top_k_indices(exact, k)
+        return candidates[top], exact[top]
+
+    def save(self, base_path: str) -> list[str]:
+        """
+        寫到 `base_path` 的暫存檔並回傳暫存檔路徑，由呼叫端一起替換。
+        全精度向量分塊寫入，不需要整個讀入記憶體。
+        """
+        paths = [base_path + MATRIX_SUFFIX + ".tmp"]
+        with open(paths[0], "wb") as f:
+            np.save(f, np.ascontiguousarray(self.data))
+        if self.scales is not None:
+            paths.append(base_path + SCALES_SUFFIX + ".tmp")
+            with open(paths[-1], "wb") as f:
+                np.save(f, self.scales)
+        if self.full is not None:
+            paths.append(base_path + FULL_SUFFIX + ".tmp")
+            full = np.lib.format.open_memmap(
+                paths[-1], mode="w+", dtype=np.float32, shape=self.full.shape
+            )
+            step = _chunk_rows(self.full.shape[1])
+            for start in range(0, len(self.full), step):
+                rows = np.arange(start, min(start + step, len(self.full)))
+                full[rows] = self.full[rows]
+            full.flush()
+            del full
+        return paths
+
+    @classmethod
+    def load(
+        cls, base_path: str, dims: int = 0, mmap: bool = True
+    ) -> "QuantizedMatrix":
+        mmap_mode = "r" if mmap else None
+        data = np.load(base_path + MATRIX_SUFFIX, mmap_mode=mmap_mode)
+        scales = None
+        if os.path.exists(base_path + SCALES_SUFFIX):
+            scales = np.load(base_path + SCALES_SUFFIX)
+        full = None
+        if os.path.exists(base_path + FULL_SUFFIX):
+            # 全精度向量只在重新計算分數時讀取少數幾列，一律以 memory map 開啟
+            full = np.load(base_path + FULL_SUFFIX, mmap_mode="r")
+        return cls(data, scales, dims, full)
+
+
+def _replace_tmp(paths: list[str]) -> None:
+    for path in paths:
+        os.replace(path, path[: -len(".tmp")])
+
+
+def _remove_stale(base_path: str, matrix: QuantizedMatrix) -> None:
+    """格式改變後移除不再使用的 scale 與全精度向量檔。"""
+    for suffix, used in (
+        (SCALES_SUFFIX, matrix.scales is not None),
+        (FULL_SUFFIX, matrix.full is not None),
+    ):
+        if not used and os.path.exists(base_path + suffix):
+            os.remove(base_path + suffix)
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """
+    以連續 NumPy 矩陣儲存向量的 vector store。
+
+    向量以 `.npy` 檔儲存並在載入時以 memory map 開啟，省去 JSON 文字解析，
+    同一份檔案的分頁也能被多個 Streamlit worker 程序共用。
+    節點 ID 與 ref_doc_id 另外存成 JSON 陣列，列的順序與矩陣相同。
+    向量可以壓縮成 float16、int8 或截斷維度儲存，見 QuantizedMatrix。
+    """
+
+    stores_text: bool = False
+    dtype: str = "float32"
+    dims: int = 0
+    # 壓縮儲存時，以全精度向量重新計算 top_k * rescore 個候選的分數，0 表示不重新計算
+    rescore: int = 0
+
+    _vectors: QuantizedMatrix = PrivateAttr()
+    _node_ids: list[str] = PrivateAttr()
+    _ref_doc_ids: list[str] = PrivateAttr()
+    _id_to_row: dict[str, int] = PrivateAttr()
+    _dirty: bool = PrivateAttr()
+
+    def __init__(
+        self,
+        vectors: Optional[QuantizedMatrix] = None,
+        node_ids: Optional[list[str]] = None,
+        ref_doc_ids: Optional[list[str]] = None,
+        dtype: str = "float32",
+        dims: int = 0,
+        rescore: int = 0,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Args:
+            vectors (Optional[QuantizedMatrix]): 向量矩陣 (n, dim)
+            node_ids (Optional[list[str]]): 每一列對應的節點 ID
+            ref_doc_ids (Optional[list[str]]): 每一列對應的來源文件 ID
+            dtype (str): 儲存精度，float32、float16 或 int8
+            dims (int): 截斷後的維度，0 表示不截斷
+            rescore (int): 重新計算分數的候選倍數，0 表示不重新計算
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        super().__init__(dtype=dtype, dims=dims, rescore=rescore, **kwargs)
+        self._node_ids = list(node_ids or [])
+        self._ref_doc_ids = list(ref_doc_ids or ["None"] * len(self._node_ids))
+        self._vectors = (
+            vectors
+            if vectors is not None
+            else QuantizedMatrix.from_vectors(np.empty((0, 0)), dtype, dims)
+        )
+        self._id_to_row = {node_id: i for i, node_id in enumerate(self._node_ids)}
+        self._dirty = False
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def vectors(self) -> QuantizedMatrix:
+        """列的順序與 `node_ids` 相同的向量矩陣。"""
+        return self._vectors
+
+    @property
+    def node_ids(self) -> list[str]:
+        return self._node_ids
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> list[str]:
+        if not nodes:
+            return []
+        rows = QuantizedMatrix.from_vectors(
+            [node.get_embedding() for node in nodes], self.dtype, self.dims
+        )
+        if len(self._node_ids):
+            rows = QuantizedMatrix.concatenate(
+                [self._vectors, rows], self.dtype, self.dims
+            )
+        self._vectors = rows
+        for node in nodes:
+            self._id_to_row[node.node_id] = len(self._node_ids)
+            self._node_ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id or "None")
+        self._dirty = True
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._keep_rows(
+            [doc_id != ref_doc_id for doc_id in self._ref_doc_ids],
+        )
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[list[str]] = None,
+        filters: Optional[Any] = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        if filters is not None:
+            raise ValueError("MmapVectorStore does not support metadata filters.")
+        if node_ids is None:
+            self.clear()
+            return
+        node_id_set = set(node_ids)
+        self._keep_rows([node_id not in node_id_set for node_id in self._node_ids])
+
+    def clear(self) -> None:
+        self._keep_rows([False] * len(self._node_ids))
+
+    def _keep_rows(self, mask: list[bool]) -> None:
+        if all(mask):
+            return
+        keep = np.asarray(mask, dtype=bool)
+        self._vectors = self._vectors.take(keep)
+        self._node_ids = [i for i, k in zip(self._node_ids, mask) if k]
+        self._ref_doc_ids = [i for i, k in zip(self._ref_doc_ids, mask) if k]
+        self._id_to_row = {node_id: i for i, node_id in enumerate(self._node_ids)}
+        self._dirty = True
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Invalid query mode: {query.mode}")
+        if query.filters is not None:
+            raise ValueError("MmapVectorStore does not support metadata filters.")
+        if not self._node_ids:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        rows = None
+        if query.node_ids is not None:
+            rows = np.asarray(
+                [self._id_to_row[i] for i in query.node_ids if i in self._id_to_row],
+                dtype=np.int64,
+            )
+        scores = self._vectors.score([query.query_embedding], rows)[0]
+        top, similarities = self._vectors.top_k(
+            query.query_embedding,
+            scores,
+            query.similarity_top_k,
+            self.rescore,
+            row_ids=rows,
+        )
+        if rows is not None:
+            ids = [self._node_ids[rows[i]] for i in top]
+        else:
+            ids = [self._node_ids[i] for i in top]
+        return VectorStoreQueryResult(similarities=similarities.tolist(), ids=ids)
+
+    def persist(self, persist_path: str, fs: Optional[Any] = None) -> None:
+        """
+        將向量矩陣與節點 ID 寫到 `persist_path` 同名的 `.npy` 與 `_ids.json`，
+        int8 的 scale 與全精度向量另外存成 `_scales.npy` 與 `_full.npy`。
+
+        先寫入暫存檔再替換，正在 memory map 舊檔的程序不受影響。
+        """
+        base_path = _base_path(persist_path)
+        dirpath = os.path.dirname(base_path)
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+        if not self._dirty and os.path.exists(base_path + MATRIX_SUFFIX):
+            return
+
+        paths = self._vectors.save(base_path)
+        with open(base_path + IDS_SUFFIX + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "node_ids": self._node_ids,
+                    "ref_doc_ids": self._ref_doc_ids,
+                    "dtype": self.dtype,
+                    "dims": self.dims,
+                },
+                f,
+            )
+        _replace_tmp(paths + [base_path + IDS_SUFFIX + ".tmp"])
+        _remove_stale(base_path, self._vectors)
+        self._dirty = False
+
+    @classmethod
+    def persist_path(
+        cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE
+    ) -> str:
+        return os.path.join(
+            persist_dir, f"{namespace}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}"
+        )
+
+    @classmethod
+    def exists(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> bool:
+        """`persist_dir` 中是否已有二進位格式的向量檔。"""
+        base_path = _base_path(cls.persist_path(persist_dir, namespace))
+        return os.path.exists(base_path + MATRIX_SUFFIX) and os.path.exists(
+            base_path + IDS_SUFFIX
+        )
+
+    @classmethod
+    def remove(cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE) -> None:
+        """
+        移除 `persist_dir` 中的二進位向量檔。索引改以 JSON 格式重建時必須移除，
+        否則載入時會優先讀取舊的向量。
+        """
+        base_path = _base_path(cls.persist_path(persist_dir, namespace))
+        for suffix in (IDS_SUFFIX, MATRIX_SUFFIX, SCALES_SUFFIX, FULL_SUFFIX):
+            if os.path.exists(base_path + suffix):
+                os.remove(base_path + suffix)
+
+    @classmethod
+    def from_persist_dir(
+        cls,
+        persist_dir: str,
+        namespace: str = DEFAULT_VECTOR_STORE,
+        mmap: bool = True,
+        rescore: int = 0,
+    ) -> "MmapVectorStore":
+        return cls.from_persist_path(
+            cls.persist_path(persist_dir, namespace), mmap, rescore
+        )
+
+    @classmethod
+    def from_persist_path(
+        cls, persist_path: str, mmap: bool = True, rescore: int = 0
+    ) -> "MmapVectorStore":
+        """
+        載入向量檔，預設以唯讀 memory map 開啟，只有實際用到的分頁才會讀入記憶體。
+        """
+        base_path = _base_path(persist_path)
+        with open(base_path + IDS_SUFFIX, "r") as f:
+            ids = json.load(f)
+        dims = ids.get("dims", 0)
+        vectors = QuantizedMatrix.load(base_path, dims, mmap)
+        return cls(
+            vectors=vectors,
+            node_ids=ids["node_ids"],
+            ref_doc_ids=ids["ref_doc_ids"],
+            dtype=ids.get("dtype", vectors.dtype),
+            dims=dims,
+            rescore=rescore,
+        )
+
+    @classmethod
+    def from_simple_vector_store(
+        cls,
+        simple_store: SimpleVectorStore,
+        dtype: str = "float32",
+        dims: int = 0,
+        keep_full: bool = True,
+    ) -> "MmapVectorStore":
+        embedding_dict = simple_store.data.embedding_dict
+        node_ids = list(embedding_dict.keys())
+        store = cls(
+            vectors=QuantizedMatrix.from_vectors(
+                [embedding_dict[i] for i in node_ids], dtype, dims, keep_full
+            ),
+            node_ids=node_ids,
+            ref_doc_ids=[
+                simple_store.data.text_id_to_ref_doc_id.get(i, "None") for i in node_ids
+            ],
+            dtype=dtype,
+            dims=dims,
+        )
+        store._dirty = True
+        return store
+
+
+def convert_json_store(
+    persist_dir: str,
+    dtype: str = "float32",
+    namespace: str = DEFAULT_VECTOR_STORE,
+    dims: int = 0,
+) -> MmapVectorStore:
+    """
+    將既有的 `{namespace}__vector_store.json` 轉換為二進位格式，原本的 JSON 檔保留不動。
+
+    Args:
+        persist_dir (str): 索引目錄，例如 `<公司>/vector`
+        dtype (str): 儲存精度，float32、float16 或 int8
+        namespace (str): vector store 的命名空間
+        dims (int): 截斷後的維度，0 表示不截斷
+    """
+    simple_store = SimpleVectorStore.from_persist_dir(persist_dir, namespace=namespace)
+    store = MmapVectorStore.from_simple_vector_store(
+        simple_store, dtype=dtype, dims=dims
+    )
+    store.persist(MmapVectorStore.persist_path(persist_dir, namespace))
+    logging.info(f"Converted {len(store.node_ids)} embeddings in {persist_dir}")
+    return store
+
+
+class ConsolidatedVectorStore:
+    """
+    把多家公司的向量合併成一個矩陣，並以 company_id 欄位標記每一列屬於哪家公司。
+
+    同一家公司的列連續存放，一批查詢向量只需一次矩陣乘法即可同時對所有
+    (或指定的) 公司評分，再於各公司的區段內以 argpartition 取 top-k。
+    """
+
+    def __init__(
+        self,
+        vectors: QuantizedMatrix,
+        node_ids: list[str],
+        company_ids: np.ndarray,
+        companies: list[str],
+        rescore: int = 0,
+        built_at: Optional[float] = None,
+    ) -> None:
+        """
+        Args:
+            vectors (QuantizedMatrix): 向量矩陣 (n, dim)，同公司的列必須相鄰
+            node_ids (list[str]): 每一列對應的節點 ID
+            company_ids (np.ndarray): 每一列對應的公司編號，即 `companies` 的索引
+            companies (list[str]): 公司列表
+            rescore (int): 以全精度向量重新計算 top_k * rescore 個候選的分數，
+                0 表示不重新計算
+            built_at (Optional[float]): 合併矩陣建立的時間，None 表示現在
+        """
+        self.vectors = vectors
+        self.node_ids = node_ids
+        self.company_ids = np.asarray(company_ids, dtype=np.int32)
+        self.companies = companies
+        self.rescore = rescore
+        self.built_at = time.time() if built_at is None else built_at
+        # 每家公司在矩陣中的 [start, end) 區段
+        bounds = np.searchsorted(self.company_ids, np.arange(len(companies) + 1))
+        self.ranges = {
+            company: (int(bounds[i]), int(bounds[i + 1]))
+            for i, company in enumerate(companies)
+        }
+
+    @classmethod
+    def build(
+        cls,
+        esg_dir_path: str,
+        companies: list[str],
+        dtype: str = "float32",
+        dims: int = 0,
+        rescore: int = 0,
+    ) -> "ConsolidatedVectorStore":
+        """
+        從每家公司的 `vector/` 目錄讀取向量並合併，二進位格式與 JSON 格式皆可。
+        公司的儲存格式與指定的不同時，以全精度向量重新壓縮。
+
+        `rescore` 與合併矩陣一起儲存，載入時沒有指定倍數就使用這個值。
+        """
+        matrices, node_ids, company_ids = [], [], []
+        for i, company in enumerate(companies):
+            persist_dir = os.path.join(esg_dir_path, company, "vector")
+            if MmapVectorStore.exists(persist_dir):
+                store = MmapVectorStore.from_persist_dir(persist_dir)
+            else:
+                store = MmapVectorStore.from_simple_vector_store(
+                    SimpleVectorStore.from_persist_dir(persist_dir), dtype, dims
+                )
+            if not store.node_ids:
+                continue
+            matrices.append(store.vectors)
+            node_ids.extend(store.node_ids)
+            company_ids.append(np.full(len(store.node_ids), i, dtype=np.int32))
+        if not matrices:
+            raise ValueError(f"No embeddings found in {esg_dir_path}")
+        return cls(
+            QuantizedMatrix.concatenate(matrices, dtype, dims),
+            node_ids,
+            np.concatenate(company_ids),
+            list(companies),
+            rescore,
+        )
+
+    @classmethod
+    def from_company_store(
+        cls,
+        company: str,
+        vector_store: BasePydanticVectorStore,
+        dtype: str = "float32",
+        dims: int = 0,
+        rescore: int = 0,
+    ) -> "ConsolidatedVectorStore":
+        """
+        以單一公司的 vector store 建立，沒有合併矩陣的公司也能以一次矩陣乘法
+        評分一批查詢。JSON 格式的向量依 `dtype` 與 `dims` 壓縮，二進位格式沿用
+        建立索引時的格式。
+
+        JSON 格式沒有可以 memory map 的全精度向量檔，只保留壓縮後的矩陣，
+        不重新計算分數；需要重新計算時先以 `convert` 轉換為二進位格式。
+        """
+        if not isinstance(vector_store, MmapVectorStore):
+            vector_store = MmapVectorStore.from_simple_vector_store(
+                vector_store, dtype, dims, keep_full=False
+            )
+        return cls(
+            vector_store.vectors,
+            vector_store.node_ids,
+            np.zeros(len(vector_store.node_ids), dtype=np.int32),
+            [company],
+            rescore,
+        )
+
+    def covers(self, company: str, persist_dir: str) -> bool:
+        """
+        合併矩陣是否包含公司 `persist_dir` 目前的向量。報告書在合併後重新上傳時，
+        索引檔比合併矩陣新，矩陣中的節點已經過時，應改用公司自己的向量。
+        """
+        if company not in self.ranges:
+            return False
+        if not os.path.isdir(persist_dir):
+            return True
+        updated_at = max(
+            (entry.stat().st_mtime for entry in os.scandir(persist_dir)), default=0.0
+        )
+        return updated_at <= self.built_at
+
+    def batch_query(
+        self,
+        query_embeddings: list[list[float]],
+        similarity_top_k: int,
+        companies: Optional[list[str]] = None,
+    ) -> list[dict[str, list[tuple[str, float]]]]:
+        """
+        以一次矩陣乘法對一批查詢向量評分，並回傳每個查詢在各公司內的 top-k。
+
+        Args:
+            query_embeddings (list[list[float]]): 查詢向量 (batch, dim)
+            similarity_top_k (int): 每家公司回傳的節點數
+            companies (Optional[list[str]]): 只在這些公司中搜尋，None 表示全部
+
+        Returns:
+            list[dict[str, list[tuple[str, float]]]]: 每個查詢 -> 公司 -> (節點 ID, 分數)
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        companies = [
+            company
+            for company in dict.fromkeys(
+                companies if companies is not None else self.companies
+            )
+            if company in self.ranges
+            and self.ranges[company][0] < self.ranges[company][1]
+        ]
+        if not companies:
+            return [{} for _ in range(len(queries))]
+
+        # 只取需要的公司區段，合併後做一次矩陣乘法
+        ranges = [self.ranges[company] for company in companies]
+        rows = None
+        if len(companies) != len(self.ranges):
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        scores = self.vectors.score(queries, rows)
+        local_ends = np.cumsum([end - start for start, end in ranges]).tolist()
+        local_ranges = list(zip([0] + local_ends[:-1], local_ends))
+
+        results = []
+        for query, query_scores in zip(queries, scores):
+            per_company = {}
+            for company, (start, end), (local_start, local_end) in zip(
+                companies, ranges, local_ranges
+            ):
+                top, top_scores = self.vectors.top_k(
+                    query,
+                    query_scores[local_start:local_end],
+                    similarity_top_k,
+                    self.rescore,
+                    row_ids=np.arange(start, end),
+                )
+                per_company[company] = [
+                    (self.node_ids[start + i], float(score))
+                    for i, score in zip(top, top_scores)
+                ]
+            results.append(per_company)
+        return results
+
+    def persist(self, persist_dir: str) -> None:
+        os.makedirs(persist_dir, exist_ok=True)
+        base_path = os.path.join(persist_dir, "consolidated")
+        paths = self.vectors.save(base_path)
+        paths.append(base_path + "_company_ids" + MATRIX_SUFFIX + ".tmp")
+        with open(paths[-1], "wb") as f:
+            np.save(f, self.company_ids)
+        paths.append(base_path + IDS_SUFFIX + ".tmp")
+        with open(paths[-1], "w") as f:
+            json.dump(
+                {
+                    "node_ids": self.node_ids,
+                    "companies": self.companies,
+                    "dims": self.vectors.dims,
+                    "rescore": self.rescore,
+                },
+                f,
+            )
+        _replace_tmp(paths)
+        _remove_stale(base_path, self.vectors)
+
+    @classmethod
+    def exists(cls, persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, "consolidated" + IDS_SUFFIX))
+
+    @classmethod
+    def from_persist_dir(
+        cls, persist_dir: str, mmap: bool = True, rescore: Optional[int] = None
+    ) -> "ConsolidatedVectorStore":
+        """`rescore` 為 None 時使用建立合併矩陣時指定的倍數。"""
+        base_path = os.path.join(persist_dir, "consolidated")
+        with open(base_path + IDS_SUFFIX, "r") as f:
+            ids = json.load(f)
+        if rescore is None:
+            rescore = ids.get("rescore", 0)
+        return cls(
+            vectors=QuantizedMatrix.load(base_path, ids.get("dims", 0), mmap),
+            node_ids=ids["node_ids"],
+            company_ids=np.load(base_path + "_company_ids" + MATRIX_SUFFIX),
+            companies=ids["companies"],
+            rescore=rescore,
+            built_at=os.path.getmtime(base_path + IDS_SUFFIX),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage binary vector stores.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser(
+        "convert", help="convert JSON vector stores to the memory-mapped format"
+    )
+    convert_parser.add_argument("persist_dirs", nargs="+", help="index directories")
+    convert_parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float32")
+    convert_parser.add_argument(
+        "--dims", type=int, default=0, help="truncate vectors to this many dimensions"
+    )
+    consolidate_parser = subparsers.add_parser(
+        "consolidate", help="merge every company's vectors into one matrix"
+    )
+    consolidate_parser.add_argument("esg_dir", help="directory holding company reports")
+    consolidate_parser.add_argument(
+        "--output", help="output directory, defaults to <esg_dir>/consolidated"
+    )
+    consolidate_parser.add_argument(
+        "--dtype", choices=SUPPORTED_DTYPES, default="float32"
+    )
+    consolidate_parser.add_argument(
+        "--dims", type=int, default=0, help="truncate vectors to this many dimensions"
+    )
+    consolidate_parser.add_argument(
+        "--rescore",
+        type=int,
+        default=0,
+        help="default rescoring factor saved with the matrix, 0 disables rescoring",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "convert":
+        for persist_dir in args.persist_dirs:
+            convert_json_store(persist_dir, dtype=args.dtype, dims=args.dims)
+    else:
+        store = ConsolidatedVectorStore.build(
+            args.esg_dir,
+            sorted(list_companies(args.esg_dir)),
+            args.dtype,
+            args.dims,
+            args.rescore,
+        )
+        if args.rescore > 1 and store.vectors.full is None:
+            logging.warning("Full-precision vectors are not stored, rescoring is off")
+        store.persist(args.output or os.path.join(args.esg_dir, "consolidated"))
+        logging.info(f"Consolidated {len(store.node_ids)} embeddings")
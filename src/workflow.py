@@ -2,8 +2,12 @@ import asyncio
 import json
 import logging
 import os
+import time
+from collections.abc import AsyncIterator
 from pathlib import Path
+from typing import Optional
 
+import httpx
 from llama_index.agent.openai import OpenAIAgent
 from llama_index.core.callbacks import CallbackManager, LlamaDebugHandler
 from llama_index.core.settings import Settings
@@ -11,21 +15,128 @@ from llama_index.core.workflow import (Context, StartEvent, StopEvent,
                                        Workflow, step)
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
+from pydantic import ValidationError
 
+from agents import AgentBuilder, CompanyAgentRegistry, CompanyQueryEngine
+from answer_cache import SemanticAnswerCache
 from data_processing import DocumentLoader
+from embedding_cache import CachedEmbedding, EmbeddingCache
 from events import *
 from indexing import IndexBuilder
-from prompts import GENERATION_PROMPT, REFLECTION_PROMPT
+from llm_cache import CachedOpenAI, CompletionCache
+from ingestion import IngestionError, StreamingIngestionPipeline
+from instrumentation import MetricsCallbackHandler, metrics, timed_step
+from prompts import PLANNER_PROMPT, PLANNER_RETRY_PROMPT
+from rate_limit import (AsyncRateLimitedTransport, RateLimitedTransport,
+                        RateLimiter, background_priority)
+from retrievers import aget_query_embedding_batch
+from routing import IndustryIndex, QueryResolution
+from vector_store import ConsolidatedVectorStore, list_companies
 
 
 class SettingsManager:
+    completion_cache: Optional[CompletionCache] = None
+    # 共用的 HTTP 連線池，只在單一 event loop 的服務中使用
+    http_client: Optional[httpx.Client] = None
+    async_http_client: Optional[httpx.AsyncClient] = None
+    # 所有 LLM 與 embedding 呼叫共用的速率限制
+    llm_rate_limiter: Optional[RateLimiter] = None
+    embedding_rate_limiter: Optional[RateLimiter] = None
+
+    @classmethod
+    def create_llm(cls, temperature: float, model: str = "gpt-4o-mini") -> OpenAI:
+        """建立 LLM，啟用快取時所有 LLM 共用同一個 CompletionCache。"""
+        if Config.LLM_CACHE and cls.completion_cache is None:
+            cls.completion_cache = CompletionCache(
+                os.path.join(Config.CACHE_DIR, "completions.sqlite"),
+                ttl=Config.LLM_CACHE_TTL,
+                max_entries=Config.LLM_CACHE_MAX_ENTRIES,
+            )
+        return CachedOpenAI(
+            cache=cls.completion_cache,
+            temperature=temperature,
+            model=model,
+            http_client=cls.http_client,
+            async_http_client=cls.async_http_client,
+        )
+
+    @classmethod
+    def create_http_clients(cls) -> None:
+        """
+        建立所有 LLM 與 embedding 共用的連線池，重複使用與模型供應商的連線，
+        每個請求送出前都經過速率限制。
+        """
+        limits = httpx.Limits(
+            max_connections=Config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.HTTP_MAX_CONNECTIONS,
+        )
+        timeout = httpx.Timeout(Config.HTTP_TIMEOUT)
+        cls.llm_rate_limiter = RateLimiter(
+            "llm",
+            Config.LLM_RPM,
+            Config.LLM_TPM,
+            background_reserve=Config.RATE_LIMIT_BACKGROUND_RESERVE,
+        )
+        cls.embedding_rate_limiter = RateLimiter(
+            "embedding",
+            Config.EMBEDDING_RPM,
+            Config.EMBEDDING_TPM,
+            background_reserve=Config.RATE_LIMIT_BACKGROUND_RESERVE,
+        )
+        cls.http_client = httpx.Client(
+            transport=RateLimitedTransport(
+                httpx.HTTPTransport(limits=limits),
+                cls.llm_rate_limiter,
+                cls.embedding_rate_limiter,
+            ),
+            timeout=timeout,
+        )
+        cls.async_http_client = httpx.AsyncClient(
+            transport=AsyncRateLimitedTransport(
+                lambda: httpx.AsyncHTTPTransport(limits=limits),
+                cls.llm_rate_limiter,
+                cls.embedding_rate_limiter,
+            ),
+            timeout=timeout,
+        )
+
+    @classmethod
+    async def close_http_clients(cls) -> None:
+        if cls.http_client is not None:
+            cls.http_client.close()
+        if cls.async_http_client is not None:
+            await cls.async_http_client.aclose()
+        cls.http_client = cls.async_http_client = None
+
     @staticmethod
-    def initialize():
-        model = "gpt-4o-mini"
-        Settings.llm = OpenAI(temperature=0, model=model)
-        Settings.embed_model = OpenAIEmbedding(model="text-embedding-3-large")
+    def initialize(shared_http_clients: bool = False):
+        """
+        Args:
+            shared_http_clients (bool): 是否使用共用連線池；啟用速率限制時一律使用，
+                非同步連線依 event loop 分開建立，每次查詢以 asyncio.run 執行的
+                Streamlit 也能共用額度
+        """
+        if shared_http_clients or Config.RATE_LIMIT:
+            SettingsManager.create_http_clients()
+        Settings.llm = SettingsManager.create_llm(temperature=0)
+        embed_model = OpenAIEmbedding(
+            model="text-embedding-3-large",
+            http_client=SettingsManager.http_client,
+            async_http_client=SettingsManager.async_http_client,
+        )
+        if Config.EMBEDDING_CACHE:
+            embed_model = CachedEmbedding(
+                embed_model,
+                EmbeddingCache(os.path.join(Config.CACHE_DIR, "embeddings.sqlite")),
+            )
+        Settings.embed_model = embed_model
         llama_debug = LlamaDebugHandler(print_trace_on_end=True)
-        Settings.callback_manager = CallbackManager([llama_debug])
+        Settings.callback_manager = CallbackManager(
+            [llama_debug, MetricsCallbackHandler(metrics)]
+        )
+        metrics.configure(Config.METRICS_LOG_PATH or None)
+        if Config.METRICS_PORT:
+            metrics.serve(Config.METRICS_PORT)
 
 
 class Config:
@@ -35,16 +146,83 @@ class Config:
     INDUSTRY_FILE_PATH = os.path.join(ESG_DIR_PATH, os.getenv("INDUSTRY_FILE_PATH"))
     VERBOSE = os.getenv("VERBOSE", "True").lower() == "true"
     LOG_FILE_PATH = os.path.join(project_root, "chat_logs.txt")
+    CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(ESG_DIR_PATH, ".cache"))
+    # 以模型名稱與文字雜湊快取向量，重建索引時不重複計算
+    EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "True").lower() == "true"
+    # 以模型、溫度與 prompt 雜湊快取 LLM 回應
+    LLM_CACHE = os.getenv("LLM_CACHE", "True").lower() == "true"
+    LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+    # 新建索引的向量儲存格式："json" 或 "mmap"(memory-mapped NumPy 矩陣)
+    VECTOR_STORE_FORMAT = os.getenv("VECTOR_STORE_FORMAT", "json")
+    # 向量的儲存精度：float32、float16 或 int8(每個向量一個 scale)
+    VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+    # 向量截斷為前幾維(Matryoshka)儲存與評分，0 表示不截斷
+    VECTOR_DIMS = int(os.getenv("VECTOR_DIMS", "0"))
+    # 壓縮儲存時以全精度向量重新計算 top_k * VECTOR_RESCORE 個候選的分數，0 表示不重新計算；
+    # 全精度向量只存在於二進位格式("mmap" 或 convert 轉換後)的索引與合併矩陣
+    VECTOR_RESCORE = int(os.getenv("VECTOR_RESCORE", "4"))
+    # 重新上傳報告書時只更新有變動的 chunk
+    INCREMENTAL_INDEX = os.getenv("INCREMENTAL_INDEX", "True").lower() == "true"
+    # 文件處理各階段(解析、切分、向量化、寫入)的並行數量與階段間佇列長度
+    INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "4"))
+    INGEST_SPLIT_WORKERS = int(os.getenv("INGEST_SPLIT_WORKERS", "2"))
+    INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "2"))
+    INGEST_PERSIST_WORKERS = int(os.getenv("INGEST_PERSIST_WORKERS", "2"))
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "2"))
+    # 所有公司合併的向量矩陣，存在時用於跨公司的向量檢索
+    CONSOLIDATED_DIR = os.path.join(ESG_DIR_PATH, "consolidated")
+    # 檢索方式："hybrid"(向量 + BM25，以 RRF 合併) 或 "vector"
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+    # 是否在檢索後以 LLM 重新排序，每次檢索會多呼叫 LLM
+    LLM_RERANK = os.getenv("LLM_RERANK", "False").lower() == "true"
+    # 整頁展開後送入合成的 token 上限，0 表示不限制
+    PAGE_TOKEN_BUDGET = int(os.getenv("PAGE_TOKEN_BUDGET", "0"))
+    # 同時常駐記憶體的公司 agent 上限，0 表示不限制
+    MAX_LOADED_AGENTS = int(os.getenv("MAX_LOADED_AGENTS", "20"))
+    MAX_AGENTS_MEMORY_MB = float(os.getenv("MAX_AGENTS_MEMORY_MB", "0"))
+    # 啟動時是否預先並行載入公司 agent
+    PRELOAD_AGENTS = os.getenv("PRELOAD_AGENTS", "False").lower() == "true"
+    WARMUP_WORKERS = int(os.getenv("WARMUP_WORKERS", "8"))
+    # 相似問題直接回傳先前的答案，門檻為問題向量的 cosine 相似度
+    ANSWER_CACHE = os.getenv("ANSWER_CACHE", "True").lower() == "true"
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    # 各步驟與 LLM/embedding/檢索耗時的 JSON lines 紀錄檔，預設為空字串(不寫檔)
+    METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH", "")
+    # Prometheus 指標的 HTTP 埠(GET /metrics)，0 表示不啟動
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    # 查詢服務的網址，設定後 Streamlit 只作為該服務的前端
+    QUERY_SERVICE_URL = os.getenv("QUERY_SERVICE_URL", "")
+    # 查詢服務同時執行的問題數，以及額外可以排隊等待的數量
+    MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", "8"))
+    MAX_QUEUED_QUERIES = int(os.getenv("MAX_QUEUED_QUERIES", "32"))
+    # 與模型供應商的連線池大小與逾時秒數
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+    HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+    # 規劃子問題時 LLM 輸出無法解析的重試次數
+    PLANNER_MAX_RETRIES = int(os.getenv("PLANNER_MAX_RETRIES", "2"))
+    # 公司查詢方式："direct"(直接呼叫 query engine) 或 "agent"(經過 OpenAIAgent 工具呼叫)
+    COMPANY_QUERY_MODE = os.getenv("COMPANY_QUERY_MODE", "direct")
+    # 同時查詢的公司數，以及每個子問題(選擇公司、載入索引與查詢)的期限秒數，
+    # 逾時的公司在彙整時標示為未取得資料，0 表示不限制
+    RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+    SUBQUERY_TIMEOUT = float(os.getenv("SUBQUERY_TIMEOUT", "120"))
+    # 所有 LLM 與 embedding 呼叫經過同一組速率限制，RPM/TPM 為 0 表示不限制，
+    # 收到 429 時仍會依 Retry-After 暫停並減速
+    RATE_LIMIT = os.getenv("RATE_LIMIT", "True").lower() == "true"
+    LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+    LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+    EMBEDDING_RPM = float(os.getenv("EMBEDDING_RPM", "0"))
+    EMBEDDING_TPM = float(os.getenv("EMBEDDING_TPM", "0"))
+    # 保留給互動查詢的額度比例，文件處理等背景工作不能用掉
+    RATE_LIMIT_BACKGROUND_RESERVE = float(
+        os.getenv("RATE_LIMIT_BACKGROUND_RESERVE", "0.2")
+    )
 
     @classmethod
     def list_companies(cls) -> list[str]:
-        return [
-            dirname
-            for dirname in os.listdir(cls.ESG_DIR_PATH)
-            if os.path.isdir(os.path.join(cls.ESG_DIR_PATH, dirname))
-            and os.path.exists(os.path.join(cls.ESG_DIR_PATH, dirname, "vector"))
-            and dirname != "industry_map"
-        ]
+        return list_companies(cls.ESG_DIR_PATH)
 
 
 class ESGReportWorkflow(Workflow):
@@ -52,15 +230,59 @@ class ESGReportWorkflow(Workflow):
         self,
         esg_agents_map: dict[str, OpenAIAgent],
         industry_map: list[IndustryMap],
+        industry_index: Optional[IndustryIndex] = None,
+        answer_cache: Optional[SemanticAnswerCache] = None,
         *args,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
-        self.ai_model = OpenAI(temperature=0.5, model="gpt-4o-mini")
+        self.ai_model = SettingsManager.create_llm(temperature=0.5)
+        self.planner_llm = SettingsManager.create_llm(temperature=0)
         self.esg_agents_map = esg_agents_map
         self.industry_map = industry_map
+        self.industry_index = industry_index or IndustryIndex(
+            esg_agents_map.keys(), industry_map
+        )
+        self.answer_cache = answer_cache
+        # astream 執行期間的事件佇列，None 表示不串流
+        self._stream_queue: Optional[asyncio.Queue] = None
+
+    def _emit(self, event: ProgressEvent | TokenEvent) -> None:
+        if self._stream_queue is not None:
+            self._stream_queue.put_nowait(event)
+
+    async def astream(
+        self, question: str
+    ) -> AsyncIterator[ProgressEvent | TokenEvent]:
+        """
+        執行流程，並依序產生步驟進度(ProgressEvent)與答案片段(TokenEvent)。
+        同一個 workflow 一次只能執行一個 astream。
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self._stream_queue = queue
+        start = time.perf_counter()
+        task = asyncio.ensure_future(self.run(question=question))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        streamed = False
+        try:
+            while (event := await queue.get()) is not None:
+                if isinstance(event, TokenEvent) and not streamed:
+                    streamed = True
+                    logging.info(
+                        f"Time to first token: {time.perf_counter() - start:.2f}s"
+                    )
+                yield event
+            result = await task
+        finally:
+            self._stream_queue = None
+            if not task.done():
+                task.cancel()
+        # 快取命中或提前結束時沒有經過串流合成，直接回傳整個結果
+        if not streamed:
+            yield TokenEvent(delta=str(result))
 
     @step(pass_context=True)
+    @timed_step
     async def receive_query(
         self, ctx: Context, ev: StartEvent
     ) -> QueryReceivedEvent | StopEvent:
@@ -68,109 +290,233 @@ class ESGReportWorkflow(Workflow):
         if not main_query:
             return StopEvent(result="Please provide a main query")
         ctx.data["main_query"] = main_query
+        self._emit(ProgressEvent(message="收到問題"))
+        if self.answer_cache is not None:
+            # 問題提及的公司必須相同，避免「A 公司的碳排」命中「B 公司的碳排」
+            companies = self.industry_index.resolve(main_query).companies
+            embedding = await self.answer_cache.aembed(main_query)
+            answer = self.answer_cache.lookup(embedding, companies)
+            if answer is not None:
+                logging.info(f"Answer cache hit: {main_query}")
+                return StopEvent(result=answer)
+            ctx.data["query_companies"] = companies
+            ctx.data["query_embedding"] = embedding
         return QueryReceivedEvent(query=main_query)
 
     @step()
-    async def determine_query_type(
+    @timed_step
+    async def plan_query(
         self, ev: QueryReceivedEvent
-    ) -> ProcessedQueryEvent | StopEvent:
-        main_query = ev.query
-        industry_prompt = [
-            f"{'、'.join(item.alias)}公司是{'、'.join(item.industry)}的公司，這是他們的資料{item.company}"
-            for item in self.industry_map
-        ]
-        prompt = f"""
-        請判斷以下主問題提及的產業或公司是否存在於產業查詢表中：{main_query} 
-        以下是產業的查詢表：
-
-        {"。 \n\n".join(industry_prompt)} 
-
-        如果不是產業相關查詢，請直接返回主問題，不要有任何其他的說明。 
-        如果是產業相關查詢，請將產業的部分換成相關的公司名稱，並返回新的主問題。 
-        有部分公司可能有別名(alias)，例如合庫金也叫合庫金控，請仔細確認。
-        如果該公司或是產業不存在於產業查詢表中，請返回「不存在」，不要有任何其他的說明。 
-
-        例如
-        主問題：請分析食品業的薪水？ 
-        根據產業查詢表，產業是食品業，將產業的部分換成相關的公司名稱，其中包括愛之味和台榮公司，並返回新的主問題。 
-        新的主問題：請分析愛之味和台榮公司的薪水？ 
+    ) -> SubqueriesGeneratedEvent | StopEvent:
+        """
+        一次完成產業解析與子問題拆解。問題只提及一家可以確定的公司、且沒有疑似提及
+        其他公司時不需要 LLM，其餘以 JSON mode 呼叫一次 LLM，輸出無法解析時最多重試
+        PLANNER_MAX_RETRIES 次。
         """
-        response = await self.ai_model.acomplete(prompt)
-        if "不存在" in str(response):
+        self._emit(ProgressEvent(message="規劃子問題"))
+        # 先在本地把產業換成公司名稱，只把相關公司的查詢表交給 LLM
+        resolution = self.industry_index.resolve(ev.query)
+        if (
+            len(resolution.companies) == 1
+            and not resolution.ambiguous
+            and not resolution.unresolved
+        ):
+            company = resolution.companies[0]
+            return SubqueriesGeneratedEvent(
+                subqueries=[Subquery(company=company, query=resolution.query)]
+            )
+        plan = await self._plan_with_llm(resolution)
+        if plan is None:
+            if not resolution.companies:
+                return StopEvent(result="無法解析問題，請換個方式描述")
+            # 重試用盡時退回本地比對到的公司，每家公司查詢完整問題
+            plan = QueryPlan(
+                exists=True,
+                subqueries=[
+                    Subquery(company=company, query=resolution.query)
+                    for company in resolution.companies
+                ],
+            )
+        if not plan.exists:
             return StopEvent(result="該公司或是產業不存在於產業查詢表中")
-        return ProcessedQueryEvent(query=str(response))
+        subqueries = plan.subqueries or [Subquery(company="", query=resolution.query)]
+        return SubqueriesGeneratedEvent(subqueries=subqueries)
 
-    @step()
-    async def split_query(
-        self, ev: ProcessedQueryEvent | QuerySplitErrorEvent
-    ) -> QuerySplitOutputEvent:
-
-        if isinstance(ev, ProcessedQueryEvent):
-            main_query = ev.query
-            reflection_prompt = ""
-        elif isinstance(ev, QuerySplitErrorEvent):
-            main_query = ev.main_query
-            reflection_prompt = REFLECTION_PROMPT.format(
-                error=ev.error, main_query=main_query
-            )
-        prompt = GENERATION_PROMPT.format(
-            main_question=main_query, schema=Subquery.model_json_schema()
+    async def _plan_with_llm(self, resolution: QueryResolution) -> Optional[QueryPlan]:
+        table = self.industry_index.table_prompt(resolution.companies or None)
+        prompt = PLANNER_PROMPT.format(
+            main_question=resolution.query,
+            table=table,
+            schema=QueryPlan.model_json_schema(),
         )
-        if reflection_prompt:
-            prompt += reflection_prompt
-        response = await self.ai_model.acomplete(prompt)
-        return QuerySplitOutputEvent(output=str(response), original_query=main_query)
-
-    @step()
-    async def validate_split(
-        self, ev: QuerySplitOutputEvent
-    ) -> SubqueriesGeneratedEvent | QuerySplitErrorEvent:
-        try:
-            output = json.loads(ev.output)
-            if isinstance(output, list):
-                return SubqueriesGeneratedEvent(
-                    subqueries=[Subquery(**item) for item in output]
-                )
-            return SubqueriesGeneratedEvent(subqueries=[Subquery(**output)])
-        except Exception as e:
-            print("Output:", ev.output)
-            return QuerySplitErrorEvent(
-                error=str(e), invalid_output=ev.output, main_query=ev.original_query
+        retry_prompt = ""
+        for attempt in range(Config.PLANNER_MAX_RETRIES + 1):
+            if attempt:
+                metrics.increment("step", "plan_query", "retries")
+            response = await self.planner_llm.acomplete(
+                prompt + retry_prompt, response_format={"type": "json_object"}
             )
+            try:
+                return QueryPlan.model_validate_json(str(response))
+            except ValidationError as e:
+                logging.warning(f"Invalid query plan: {response}")
+                retry_prompt = PLANNER_RETRY_PROMPT.format(error=e)
+        return None
 
     @step(pass_context=True)
+    @timed_step
     async def prepare_subqueries(
         self, ctx: Context, ev: SubqueriesGeneratedEvent
     ) -> ChooseAgentEvent | None:
         subqueries = ev.subqueries
-        ctx.data["subqueries_count"] = len(subqueries)
-        for subquery in subqueries:
-            self.send_event(ChooseAgentEvent(query=subquery.query))
+        groups = self._group_subqueries(subqueries)
+        ctx.data["subqueries_count"] = len(groups)
+        self._emit(ProgressEvent(message=f"共 {len(subqueries)} 個子問題"))
+        deadline = 0
+        if Config.SUBQUERY_TIMEOUT:
+            deadline = time.monotonic() + Config.SUBQUERY_TIMEOUT
+        embeddings = []
+        if Config.COMPANY_QUERY_MODE == "direct" and len(subqueries) > 1:
+            # 所有子問題以一次 embedding 請求向量化，公司的 query engine 不再各自計算
+            embeddings = await aget_query_embedding_batch(
+                Settings.embed_model,
+                [query for _, queries in groups for query in queries],
+            )
+        offset = 0
+        for company, queries in groups:
+            self.send_event(
+                ChooseAgentEvent(
+                    query="；".join(queries),
+                    company=company,
+                    queries=queries,
+                    embeddings=embeddings[offset : offset + len(queries)],
+                    deadline=deadline,
+                )
+            )
+            offset += len(queries)
         return None
 
-    @step(num_workers=3)
-    async def choose_esg_agent(self, ev: ChooseAgentEvent) -> RetrieverEvent:
+    def _group_subqueries(
+        self, subqueries: list[Subquery]
+    ) -> list[tuple[str, list[str]]]:
+        """
+        把可以確定是同一家公司的子問題合併，每家公司只檢索與合成一次。
+        無法確定公司的子問題各自查詢。
+        """
+        groups: dict[str, tuple[str, list[str]]] = {}
+        for i, subquery in enumerate(subqueries):
+            companies = self.industry_index.route(subquery.company)
+            key = companies[0] if len(companies) == 1 else f"\0{i}"
+            groups.setdefault(key, (subquery.company, []))[1].append(subquery.query)
+        return list(groups.values())
+
+    @staticmethod
+    def _remaining(deadline: float) -> Optional[float]:
+        """距離期限的秒數，作為 asyncio.wait_for 的 timeout。"""
+        if not deadline:
+            return None
+        return max(deadline - time.monotonic(), 0)
+
+    def _timed_out(self, query: str, agent_name: str) -> RetrieverResponseEvent:
+        logging.warning(f"Subquery timed out: {agent_name or query}")
+        self._emit(ProgressEvent(message=f"查詢逾時：{agent_name or query}"))
+        return RetrieverResponseEvent(
+            response=f"「{query}」查詢逾時，未取得資料。",
+            agent_name=agent_name,
+            timed_out=True,
+        )
+
+    @step(num_workers=Config.RETRIEVAL_WORKERS)
+    @timed_step
+    async def choose_esg_agent(
+        self, ev: ChooseAgentEvent
+    ) -> RetrieverEvent | RetrieverResponseEvent:
+        try:
+            return await asyncio.wait_for(
+                self._choose_agent(ev), self._remaining(ev.deadline)
+            )
+        except asyncio.TimeoutError:
+            return self._timed_out(ev.query, ev.company)
+
+    async def _choose_agent(
+        self, ev: ChooseAgentEvent
+    ) -> RetrieverEvent | RetrieverResponseEvent:
         query = ev.query
+        # 先以公司名稱與別名在本地比對，只有比對不到唯一公司時才詢問 LLM
+        candidates = self.industry_index.route(
+            ev.company
+        ) or self.industry_index.route(query)
+        if len(candidates) == 1:
+            agent_name = candidates[0]
+        else:
+            agent_name = await self._choose_agent_with_llm(
+                query, candidates or list(self.esg_agents_map.keys())
+            )
+        if agent_name is None:
+            logging.warning(f"No ESG report matches subquery: {query}")
+            return RetrieverResponseEvent(
+                response=f"找不到與「{query}」相關的公司永續報告書。"
+            )
+        # 第一次查詢到的公司需要從磁碟載入索引，放到執行緒中避免阻塞 event loop
+        agent = await asyncio.to_thread(self.esg_agents_map.__getitem__, agent_name)
+        return RetrieverEvent(
+            agent=agent,
+            query=query,
+            queries=ev.queries,
+            embeddings=ev.embeddings,
+            agent_name=agent_name,
+            deadline=ev.deadline,
+        )
+
+    async def _choose_agent_with_llm(
+        self, query: str, candidates: list[str]
+    ) -> Optional[str]:
         prompt = f"""
         Please choose an ESG company representative to answer the following question: {query},
-        The chosen company representative must be one from the following list: {list(self.esg_agents_map.keys())},
+        The chosen company representative must be one from the following list: {candidates},
         Please directly respond with the name of the chosen company representative,
         Do not use phrases like 'The chosen company representative is' etc.
         """
-        print(prompt)
-        response = await self.ai_model.acomplete(prompt)
-        agent = self.esg_agents_map[str(response)]
-        return RetrieverEvent(agent=agent, query=query, agent_name=str(response))
+        logging.debug(prompt)
+        response = str(await self.ai_model.acomplete(prompt)).strip()
+        if response in self.esg_agents_map:
+            return response
+        # LLM 的回答不完全等於公司名稱時，再以別名比對一次
+        matched = self.industry_index.route(response)
+        return matched[0] if len(matched) == 1 else None
 
-    @step()
+    @step(num_workers=Config.RETRIEVAL_WORKERS)
+    @timed_step
     async def retrieve(self, ev: RetrieverEvent) -> RetrieverResponseEvent:
         agent: OpenAIAgent = ev.agent
         query = ev.query
         logging.info(f"File: {ev.agent_name}")
-        response = await agent.aquery(query)
-        return RetrieverResponseEvent(response=str(response))
+        self._emit(ProgressEvent(message=f"查詢{ev.agent_name}：{query}"))
+        try:
+            response = await asyncio.wait_for(
+                self._aquery(agent, ev.queries or [query], ev.embeddings),
+                self._remaining(ev.deadline),
+            )
+        except asyncio.TimeoutError:
+            return self._timed_out(query, ev.agent_name)
+        return RetrieverResponseEvent(response=response, agent_name=ev.agent_name)
+
+    @staticmethod
+    async def _aquery(
+        agent: OpenAIAgent | CompanyQueryEngine,
+        queries: list[str],
+        embeddings: Optional[list[list[float]]] = None,
+    ) -> str:
+        if isinstance(agent, CompanyQueryEngine):
+            return str(await agent.aquery_many(queries, embeddings))
+        if len(queries) == 1:
+            return str(await agent.aquery(queries[0]))
+        # agent 沒有合併查詢的介面，同時送出各個子問題
+        responses = await asyncio.gather(*(agent.aquery(query) for query in queries))
+        return "\n\n".join(str(response) for response in responses)
 
     @step(pass_context=True)
+    @timed_step
     async def collect_ai_responses(
         self, ctx: Context, ev: RetrieverResponseEvent
     ) -> StopEvent | None:
@@ -181,6 +527,16 @@ class ESGReportWorkflow(Workflow):
             return None
         main_query = ctx.data["main_query"]
         answer = str(result)
+        # 逾時的公司仍然彙整其餘的回應，並要求在答案中標示缺少的資料
+        timed_out = [
+            event.agent_name or event.response for event in result if event.timed_out
+        ]
+        timeout_note = ""
+        if timed_out:
+            timeout_note = f"""
+        The following companies timed out and returned no data: {"、".join(timed_out)}
+        Clearly state in the answer that data for these companies is unavailable.
+        """
         prompt = f"""
         You are a professional ESG analyst. Based on the following main query and collected responses, provide a comprehensive and insightful answer:
 
@@ -195,31 +551,104 @@ class ESGReportWorkflow(Workflow):
         Your's response have to follow the Collected Responses I gave you.
 
         If you do not give me the right answer, I will be fire.
+        {timeout_note}
         """
-        response = await self.ai_model.acomplete(prompt)
-        return StopEvent(result=str(response))
-
-
-async def process_documents(pdf_docs):
-    file_paths = []
-    for pdf_doc in pdf_docs:
-        company_name = os.path.splitext(pdf_doc.name)[0]
-        company_dir = os.path.join(Config.ESG_DIR_PATH, company_name)
-        os.makedirs(company_dir, exist_ok=True)
-        pdf_path = os.path.join(company_dir, pdf_doc.name)
-        with open(pdf_path, "wb") as f:
-            f.write(pdf_doc.getbuffer())
-        file_paths.append(pdf_path)
-
-    documents = await DocumentLoader(Config.LLAMAPARSE_API_KEY).get_all_files_doc(
-        file_paths
-    )
-    tasks = [
-        IndexBuilder().build_vector_index(
-            f"{Config.ESG_DIR_PATH}/{os.path.splitext(os.path.basename(document[0].metadata['file_name']))[0]}/vector",
-            data=document,
+        self._emit(ProgressEvent(message="彙整答案"))
+        if self._stream_queue is None:
+            response = str(await self.ai_model.acomplete(prompt))
+        else:
+            deltas = []
+            async for chunk in await self.ai_model.astream_complete(prompt):
+                if chunk.delta:
+                    deltas.append(chunk.delta)
+                    self._emit(TokenEvent(delta=chunk.delta))
+            response = "".join(deltas)
+        # 缺少部分公司資料的答案不放入快取
+        if self.answer_cache is not None and not timed_out:
+            self.answer_cache.add(
+                ctx.data["query_embedding"],
+                response,
+                ctx.data["query_companies"],
+                sources=[event.agent_name for event in result if event.agent_name],
+            )
+        return StopEvent(result=response)
+
+
+def load_industry_map() -> list[IndustryMap]:
+    with open(Config.INDUSTRY_FILE_PATH, "r") as f:
+        industry_data = json.load(f)
+    return [
+        IndustryMap(
+            company=item["company"],
+            industry=item["industry"],
+            alias=item["alias"],
         )
-        for document in documents
+        for item in industry_data
     ]
 
-    await asyncio.gather(*tasks)
+
+def create_agent_registry() -> CompanyAgentRegistry:
+    consolidated_store = None
+    if ConsolidatedVectorStore.exists(Config.CONSOLIDATED_DIR):
+        consolidated_store = ConsolidatedVectorStore.from_persist_dir(
+            Config.CONSOLIDATED_DIR, rescore=Config.VECTOR_RESCORE
+        )
+    agent_builder = AgentBuilder(
+        Config.ESG_DIR_PATH,
+        consolidated_store,
+        Config.PAGE_TOKEN_BUDGET,
+        hybrid=Config.RETRIEVAL_MODE == "hybrid",
+        llm_rerank=Config.LLM_RERANK,
+        direct=Config.COMPANY_QUERY_MODE == "direct",
+        vector_dtype=Config.VECTOR_DTYPE,
+        vector_dims=Config.VECTOR_DIMS,
+        rescore=Config.VECTOR_RESCORE,
+    )
+    registry = CompanyAgentRegistry(
+        agent_builder,
+        Config.list_companies(),
+        max_agents=Config.MAX_LOADED_AGENTS,
+        max_memory_mb=Config.MAX_AGENTS_MEMORY_MB,
+    )
+    if Config.PRELOAD_AGENTS:
+        registry.warm_up(max_workers=Config.WARMUP_WORKERS)
+    return registry
+
+
+def save_document(file_name: str, data: bytes) -> str:
+    """將上傳的 PDF 存到公司目錄，公司名稱為檔名(不含副檔名)。"""
+    company_name = os.path.splitext(file_name)[0]
+    company_dir = os.path.join(Config.ESG_DIR_PATH, company_name)
+    os.makedirs(company_dir, exist_ok=True)
+    pdf_path = os.path.join(company_dir, file_name)
+    with open(pdf_path, "wb") as f:
+        f.write(data)
+    return pdf_path
+
+
+async def ingest_documents(file_paths: list[str]) -> list[str]:
+    pipeline = StreamingIngestionPipeline(
+        DocumentLoader(
+            Config.LLAMAPARSE_API_KEY, os.path.join(Config.CACHE_DIR, "parsed")
+        ),
+        IndexBuilder(
+            Config.VECTOR_STORE_FORMAT, Config.VECTOR_DTYPE, Config.VECTOR_DIMS
+        ),
+        Config.ESG_DIR_PATH,
+        parse_workers=Config.INGEST_PARSE_WORKERS,
+        split_workers=Config.INGEST_SPLIT_WORKERS,
+        embed_workers=Config.INGEST_EMBED_WORKERS,
+        persist_workers=Config.INGEST_PERSIST_WORKERS,
+        queue_size=Config.INGEST_QUEUE_SIZE,
+        incremental=Config.INCREMENTAL_INDEX,
+    )
+    # 文件處理的 embedding 呼叫以背景優先權排程，不拖慢同時進行的查詢
+    with background_priority():
+        return await pipeline.run(file_paths)
+
+
+async def process_documents(pdf_docs) -> list[str]:
+    file_paths = [
+        save_document(pdf_doc.name, pdf_doc.getbuffer()) for pdf_doc in pdf_docs
+    ]
+    return await ingest_documents(file_paths)
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# src/ 內的模組彼此以頂層名稱匯入(例如 `from vector_store import ...`)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+# workflow.Config 在 import 時讀取環境變數，測試不使用真實的資料目錄與 API
+os.environ.setdefault("ESG_DIR_PATH", tempfile.mkdtemp(prefix="esg-test-"))
+os.environ.setdefault("INDUSTRY_FILE_PATH", "industry.json")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("LLM_CACHE", "False")
@@ -0,0 +1,114 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from agents import CompanyAgentRegistry
+
+
+class FakeAgentBuilder:
+    """記錄建立次數的 AgentBuilder，agent 以字串代替。"""
+
+    def __init__(self, esg_dir_path: str, delay: float = 0.0) -> None:
+        self.esg_dir_path = esg_dir_path
+        self.delay = delay
+        self.built: list[str] = []
+        self.load_times: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def build_esg_agent(self, esg_title: str) -> str:
+        time.sleep(self.delay)
+        with self._lock:
+            self.built.append(esg_title)
+        self.load_times[esg_title] = self.delay
+        return f"agent:{esg_title}:{self.built.count(esg_title)}"
+
+
+@pytest.fixture
+def esg_dir(tmp_path):
+    for company, size in (("A", 1000), ("B", 2000), ("C", 3000)):
+        (tmp_path / company / "vector").mkdir(parents=True)
+        (tmp_path / company / "vector" / "docstore.json").write_bytes(b"x" * size)
+    return tmp_path
+
+
+def test_loads_lazily_and_caches(esg_dir):
+    builder = FakeAgentBuilder(str(esg_dir))
+    registry = CompanyAgentRegistry(builder, ["A", "B", "C"])
+    assert builder.built == []
+    assert registry["A"] == "agent:A:1"
+    assert registry["A"] == "agent:A:1"
+    assert builder.built == ["A"]
+    assert registry.loaded == ["A"]
+    with pytest.raises(KeyError):
+        registry["D"]
+
+
+def test_evicts_least_recently_used(esg_dir):
+    builder = FakeAgentBuilder(str(esg_dir))
+    registry = CompanyAgentRegistry(builder, ["A", "B", "C"], max_agents=2)
+    registry["A"]
+    registry["B"]
+    registry["A"]
+    registry["C"]
+    assert registry.loaded == ["A", "C"]
+
+
+def test_evicts_by_index_size(esg_dir):
+    builder = FakeAgentBuilder(str(esg_dir))
+    registry = CompanyAgentRegistry(
+        builder, ["A", "B", "C"], max_memory_mb=4000 / 1024 / 1024
+    )
+    registry["A"]
+    registry["B"]
+    assert registry.loaded == ["A", "B"]
+    registry["C"]
+    assert registry.loaded == ["C"]
+
+
+def test_concurrent_queries_build_once(esg_dir):
+    builder = FakeAgentBuilder(str(esg_dir), delay=0.05)
+    registry = CompanyAgentRegistry(builder, ["A", "B", "C"])
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        agents = list(executor.map(registry.__getitem__, ["A", "B"] * 3))
+    assert sorted(builder.built) == ["A", "B"]
+    assert set(agents) == {"agent:A:1", "agent:B:1"}
+
+
+def test_refresh_and_invalidate(esg_dir):
+    builder = FakeAgentBuilder(str(esg_dir))
+    registry = CompanyAgentRegistry(builder, ["A", "B"])
+    registry["A"]
+    registry["B"]
+    registry.invalidate("A")
+    assert registry.loaded == ["B"]
+    assert registry["A"] == "agent:A:2"
+
+    registry.refresh(["A", "C"])
+    assert list(registry) == ["A", "C"]
+    assert registry.loaded == ["A"]
+    assert "B" not in registry
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_warm_up(esg_dir, max_workers):
+    builder = FakeAgentBuilder(str(esg_dir))
+    registry = CompanyAgentRegistry(builder, ["A", "B", "C"], max_agents=2)
+    registry["C"]
+    load_times = registry.warm_up(max_workers=max_workers)
+    assert list(load_times) == ["A"]
+    assert sorted(registry.loaded) == ["A", "C"]
+
+
+def test_warm_up_shares_build_locks_with_queries(esg_dir):
+    builder = FakeAgentBuilder(str(esg_dir), delay=0.1)
+    registry = CompanyAgentRegistry(builder, ["A", "B", "C"])
+    warm_up = threading.Thread(target=registry.warm_up, kwargs={"max_workers": 3})
+    warm_up.start()
+    time.sleep(0.02)
+    # 載入期間查詢到的公司等待同一次建立
+    agent = registry["B"]
+    warm_up.join()
+    assert sorted(builder.built) == ["A", "B", "C"]
+    assert agent == registry["B"] == "agent:B:1"
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from answer_cache import SemanticAnswerCache
+from mock_models import HashEmbedding
+
+
+def unit(*values: float) -> list[float]:
+    vector = np.asarray(values, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+@pytest.fixture
+def cache() -> SemanticAnswerCache:
+    return SemanticAnswerCache(HashEmbedding(model_name="hash"), threshold=0.95)
+
+
+def test_threshold(cache):
+    cache.add(unit(1, 0, 0), "answer", ["A"])
+    assert cache.lookup(unit(1, 0.1, 0), ["A"]) == "answer"
+    # cosine 約 0.89，低於門檻
+    assert cache.lookup(unit(1, 0.5, 0), ["A"]) is None
+
+
+def test_company_set_must_match(cache):
+    cache.add(unit(1, 0, 0), "A and B", ["A", "B"])
+    cache.add(unit(1, 0, 0), "only A", ["A"])
+    assert cache.lookup(unit(1, 0, 0), ["B", "A"]) == "A and B"
+    assert cache.lookup(unit(1, 0, 0), ["A"]) == "only A"
+    assert cache.lookup(unit(1, 0, 0), ["B"]) is None
+
+
+def test_returns_most_similar_answer(cache):
+    cache.add(unit(1, 0.2, 0), "farther", ["A"])
+    cache.add(unit(1, 0.05, 0), "closer", ["A"])
+    assert cache.lookup(unit(1, 0, 0), ["A"]) == "closer"
+
+
+def test_invalidate_by_sources(cache):
+    cache.add(unit(1, 0, 0), "industry answer", [], sources=["A", "B"])
+    cache.add(unit(0, 1, 0), "answer about C", ["C"])
+    cache.invalidate(["B"])
+    assert len(cache) == 1
+    assert cache.lookup(unit(1, 0, 0), []) is None
+    # 問題中提及的公司也算在來源內
+    cache.invalidate(["C"])
+    assert len(cache) == 0
+
+
+def test_max_entries(cache):
+    cache.max_entries = 2
+    for i, vector in enumerate([unit(1, 0, 0), unit(0, 1, 0), unit(0, 0, 1)]):
+        cache.add(vector, str(i), ["A"])
+    assert len(cache) == 2
+    assert cache.lookup(unit(1, 0, 0), ["A"]) is None
+    assert cache.lookup(unit(0, 0, 1), ["A"]) == "2"
+
+
+@pytest.mark.asyncio
+async def test_normalized_questions_share_embedding(cache):
+    assert cache.normalize_question("  國泰金控的碳排放？ ") == "國泰金控的碳排放"
+    first = await cache.aembed("國泰金控的碳排放？")
+    second = await cache.aembed("國泰金控的碳排放")
+    assert first == second
+    cache.add(first, "answer", ["2882"])
+    assert cache.lookup(second, ["2882"]) == "answer"
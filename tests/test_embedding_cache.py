@@ -0,0 +1,66 @@
+import pytest
+
+from embedding_cache import CachedEmbedding, EmbeddingCache
+from mock_models import HashEmbedding
+
+
+class CountingEmbedding(HashEmbedding):
+    calls: list[list[str]] = []
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        self.calls.append(list(texts))
+        return super()._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        self.calls.append(list(texts))
+        return await super()._aget_text_embeddings(texts)
+
+
+def test_round_trip(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    cache.put_many("model", ["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+    assert cache.get_many("model", ["b", "c", "a"]) == [[3.0, 4.0], None, [1.0, 2.0]]
+    # 不同模型的向量不能混用
+    assert cache.get_many("other", ["a"]) == [None]
+    # 重新開啟後仍然存在
+    reopened = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    assert reopened.get_many("model", ["a"]) == [[1.0, 2.0]]
+
+
+def test_many_keys(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    texts = [str(i) for i in range(1200)]
+    cache.put_many("model", texts, [[float(i)] for i in range(1200)])
+    assert cache.get_many("model", texts)[1100] == [1100.0]
+
+
+def test_only_computes_misses(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    inner = CountingEmbedding(model_name="hash", calls=[])
+    embed_model = CachedEmbedding(inner, cache)
+    first = embed_model.get_text_embedding_batch(["甲", "乙", "甲"])
+    second = embed_model.get_text_embedding_batch(["乙", "丙"])
+    assert inner.calls == [["甲", "乙"], ["丙"]]
+    assert first[0] == first[2]
+    assert second[0] == first[1]
+
+
+@pytest.mark.asyncio
+async def test_async_shares_cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    inner = CountingEmbedding(model_name="hash", calls=[])
+    embed_model = CachedEmbedding(inner, cache)
+    embed_model.get_text_embedding_batch(["甲"])
+    assert await embed_model.aget_text_embedding_batch(["甲", "乙"]) == [
+        inner._embed("甲"),
+        inner._embed("乙"),
+    ]
+    assert inner.calls == [["甲"], ["乙"]]
+
+
+def test_dimensions_in_key(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    small = CachedEmbedding(HashEmbedding(model_name="hash", dimensions=8), cache)
+    large = CachedEmbedding(HashEmbedding(model_name="hash", dimensions=16), cache)
+    assert len(small.get_text_embedding("甲")) == 8
+    assert len(large.get_text_embedding("甲")) == 16
@@ -0,0 +1,133 @@
+import os
+
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.settings import Settings
+
+from indexing import IndexBuilder
+from mock_models import HashEmbedding
+from vector_store import MmapVectorStore
+
+
+class CountingEmbedding(HashEmbedding):
+    texts: list[str] = []
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        self.texts.extend(texts)
+        return super()._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        self.texts.extend(texts)
+        return await super()._aget_text_embeddings(texts)
+
+
+@pytest.fixture
+def embed_model(monkeypatch) -> CountingEmbedding:
+    embed_model = CountingEmbedding(model_name="hash", texts=[])
+    monkeypatch.setattr(Settings, "_embed_model", embed_model)
+    return embed_model
+
+
+def make_nodes(texts: list[str]) -> list[TextNode]:
+    return [TextNode(text=text, metadata={"page": i}) for i, text in enumerate(texts)]
+
+
+def contents(index) -> list[str]:
+    return sorted(node.get_content() for node in index.docstore.docs.values())
+
+
+def node_count(index) -> int:
+    vector_store = index.vector_store
+    if isinstance(vector_store, MmapVectorStore):
+        return len(vector_store.node_ids)
+    return len(vector_store.data.embedding_dict)
+
+
+def test_mmap_format_round_trip(tmp_path, embed_model):
+    persist_path = str(tmp_path / "vector")
+    IndexBuilder("mmap", "float32").build_node_index(persist_path, make_nodes(["甲"]))
+    assert MmapVectorStore.exists(persist_path)
+
+    # 載入時不論設定為何，都優先讀取二進位向量檔
+    index = IndexBuilder("json").build_node_index(persist_path)
+    assert isinstance(index.vector_store, MmapVectorStore)
+    assert contents(index) == ["甲"]
+
+
+def test_json_rebuild_removes_stale_binary_vectors(tmp_path, embed_model):
+    persist_path = str(tmp_path / "vector")
+    IndexBuilder("mmap").build_node_index(persist_path, make_nodes(["甲"]))
+    IndexBuilder("json").build_node_index(persist_path, make_nodes(["乙"]))
+    assert not MmapVectorStore.exists(persist_path)
+    assert contents(IndexBuilder().build_node_index(persist_path)) == ["乙"]
+
+
+@pytest.mark.parametrize("vector_store_format", ["json", "mmap"])
+def test_upsert_only_embeds_changed_nodes(tmp_path, embed_model, vector_store_format):
+    builder = IndexBuilder(vector_store_format)
+    persist_path = str(tmp_path / "vector")
+    builder.build_node_index(persist_path, make_nodes(["甲", "乙", "丙"]))
+    assert len(embed_model.texts) == 3
+
+    embed_model.texts.clear()
+    nodes = make_nodes(["甲", "乙改", "丙"])
+    index = builder.build_node_index(persist_path, nodes, incremental=True)
+    assert embed_model.texts == [nodes[1].get_content(metadata_mode="embed")]
+    assert contents(index) == ["丙", "乙改", "甲"]
+
+    reloaded = builder.build_node_index(persist_path)
+    assert contents(reloaded) == ["丙", "乙改", "甲"]
+    assert node_count(reloaded) == 3
+
+
+def test_upsert_removes_missing_and_keeps_duplicates(tmp_path, embed_model):
+    builder = IndexBuilder()
+    persist_path = str(tmp_path / "vector")
+    builder.build_node_index(persist_path, make_nodes(["甲", "乙", "丙"]))
+
+    nodes = make_nodes(["甲", "乙"])
+    index = builder.build_node_index(persist_path, nodes, incremental=True)
+    assert contents(index) == ["乙", "甲"]
+
+    # 內容與 metadata 都相同的 chunk 各自保留一份
+    builder.build_node_index(persist_path, nodes + make_nodes(["甲"]), incremental=True)
+    assert node_count(builder.build_node_index(persist_path)) == 3
+
+
+def test_upsert_without_changes_does_not_rewrite(tmp_path, embed_model):
+    builder = IndexBuilder()
+    persist_path = str(tmp_path / "vector")
+    builder.build_node_index(persist_path, make_nodes(["甲", "乙"]))
+    docstore_path = os.path.join(persist_path, "docstore.json")
+    os.utime(docstore_path, (0, 0))
+
+    embed_model.texts.clear()
+    builder.build_node_index(persist_path, make_nodes(["甲", "乙"]), incremental=True)
+    assert embed_model.texts == []
+    assert os.path.getmtime(docstore_path) == 0
+
+
+def test_full_rebuild_without_incremental(tmp_path, embed_model):
+    builder = IndexBuilder()
+    persist_path = str(tmp_path / "vector")
+    builder.build_node_index(persist_path, make_nodes(["甲", "乙"]))
+    embed_model.texts.clear()
+    builder.build_node_index(persist_path, make_nodes(["甲", "乙"]))
+    assert len(embed_model.texts) == 2
+
+
+def test_changed_nodes(tmp_path, embed_model):
+    builder = IndexBuilder()
+    persist_path = str(tmp_path / "vector")
+    assert len(builder.changed_nodes(persist_path, make_nodes(["甲"]))) == 1
+    builder.build_node_index(persist_path, make_nodes(["甲", "乙", "丙"]))
+
+    nodes = make_nodes(["甲", "乙改", "丙"])
+    changed = builder.changed_nodes(persist_path, nodes)
+    assert [node.get_content() for node in changed] == ["乙改"]
+    # 與 upsert_index 相同，重複的 chunk 只有多出來的那份需要向量化
+    duplicate = make_nodes(["甲"])
+    assert builder.changed_nodes(persist_path, nodes + duplicate) == [
+        nodes[1],
+        duplicate[0],
+    ]
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+
+import pytest
+from llama_index.core.schema import Document
+from llama_index.core.settings import Settings
+
+from indexing import IndexBuilder
+from ingestion import IngestionError, StreamingIngestionPipeline
+from mock_models import HashEmbedding
+
+
+class FakeDocumentLoader:
+    """以檔名產生報告書內容，檔名含 bad 的檔案解析失敗。"""
+
+    def __init__(self, pages: int = 3) -> None:
+        self.pages = pages
+        self.parsed: list[str] = []
+        # 頁碼 -> 改寫後的內容
+        self.revised: dict[int, str] = {}
+
+    async def get_json_doc(self, file_path: str) -> list[Document]:
+        await asyncio.sleep(0)
+        company = os.path.splitext(os.path.basename(file_path))[0]
+        if "bad" in company:
+            raise ValueError(f"cannot parse {file_path}")
+        self.parsed.append(company)
+        return [
+            Document(
+                text=self.revised.get(page, f"{company} 第 {page} 頁"),
+                metadata={"page": page},
+            )
+            for page in range(self.pages)
+        ]
+
+
+class SlowIndexBuilder(IndexBuilder):
+    """寫入索引很慢，記錄同時有幾個已解析但尚未寫入的檔案。"""
+
+    def __init__(self, loader: FakeDocumentLoader, delay: float) -> None:
+        super().__init__()
+        self.loader = loader
+        self.delay = delay
+        self.persisted: list[str] = []
+        self.max_in_flight = 0
+
+    def build_node_index(self, persist_path, nodes=None, incremental=False):
+        in_flight = len(self.loader.parsed) - len(self.persisted)
+        self.max_in_flight = max(self.max_in_flight, in_flight)
+        time.sleep(self.delay)
+        self.persisted.append(os.path.basename(os.path.dirname(persist_path)))
+
+
+class CountingEmbedding(HashEmbedding):
+    texts: list[str] = []
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        self.texts.extend(texts)
+        return await super()._aget_text_embeddings(texts)
+
+
+@pytest.fixture
+def embed_model(monkeypatch) -> CountingEmbedding:
+    embed_model = CountingEmbedding(model_name="hash", texts=[])
+    monkeypatch.setattr(Settings, "_embed_model", embed_model)
+    return embed_model
+
+
+def make_pipeline(tmp_path, index_builder=None, loader=None, **kwargs):
+    return StreamingIngestionPipeline(
+        loader or FakeDocumentLoader(),
+        index_builder or IndexBuilder(),
+        str(tmp_path),
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_builds_every_company(tmp_path, embed_model):
+    pipeline = make_pipeline(tmp_path)
+    companies = await pipeline.run([f"/reports/{name}.pdf" for name in "ABC"])
+    assert sorted(companies) == ["A", "B", "C"]
+    for company in "ABC":
+        assert os.path.exists(tmp_path / company / "vector" / "docstore.json")
+    # 每個 chunk 只在向量化階段計算一次
+    assert len(embed_model.texts) == 9
+
+
+@pytest.mark.asyncio
+async def test_partial_failure_raises_ingestion_error(tmp_path, embed_model):
+    pipeline = make_pipeline(tmp_path, parse_workers=2, queue_size=1)
+    file_paths = ["/reports/A.pdf", "/reports/bad.pdf", "/reports/B.pdf"]
+    with pytest.raises(IngestionError) as exc_info:
+        await asyncio.wait_for(pipeline.run(file_paths), 10)
+    assert sorted(exc_info.value.completed) == ["A", "B"]
+    assert list(exc_info.value.failures) == ["bad"]
+    assert isinstance(exc_info.value.failures["bad"], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_failure_in_later_stage_still_shuts_down(tmp_path, embed_model):
+    class FailingIndexBuilder(IndexBuilder):
+        def build_node_index(self, persist_path, nodes=None, incremental=False):
+            if "B" in persist_path:
+                raise OSError("disk full")
+            return super().build_node_index(persist_path, nodes, incremental)
+
+    pipeline = make_pipeline(tmp_path, FailingIndexBuilder(), persist_workers=1)
+    with pytest.raises(IngestionError) as exc_info:
+        await asyncio.wait_for(pipeline.run(["/r/A.pdf", "/r/B.pdf", "/r/C.pdf"]), 10)
+    assert sorted(exc_info.value.completed) == ["A", "C"]
+    assert list(exc_info.value.failures) == ["B"]
+
+
+@pytest.mark.asyncio
+async def test_bounded_queues_apply_backpressure(tmp_path, embed_model):
+    loader = FakeDocumentLoader(pages=1)
+    index_builder = SlowIndexBuilder(loader, delay=0.02)
+    pipeline = make_pipeline(
+        tmp_path,
+        index_builder,
+        loader,
+        parse_workers=1,
+        split_workers=1,
+        embed_workers=1,
+        persist_workers=1,
+        queue_size=1,
+    )
+    file_paths = [f"/reports/{i:02d}.pdf" for i in range(20)]
+    companies = await asyncio.wait_for(pipeline.run(file_paths), 10)
+    assert len(companies) == 20
+    # 每個 worker 手上一份、每個佇列一份，解析不會遠遠超前寫入
+    assert index_builder.max_in_flight <= 7
+
+
+@pytest.mark.asyncio
+async def test_incremental_embeds_only_changed_chunks(tmp_path, embed_model):
+    loader = FakeDocumentLoader()
+    pipeline = make_pipeline(tmp_path, loader=loader, incremental=True)
+    await pipeline.run(["/reports/A.pdf"])
+    assert len(embed_model.texts) == 3
+
+    embed_model.texts.clear()
+    loader.revised[1] = "A 第 1 頁(修訂)"
+    await pipeline.run(["/reports/A.pdf"])
+    assert len(embed_model.texts) == 1
+    assert "修訂" in embed_model.texts[0]
@@ -0,0 +1,112 @@
+import json
+import time
+
+import httpx
+import pytest
+
+from llm_cache import CachedOpenAI, CompletionCache
+
+
+def test_hit_and_miss(tmp_path):
+    cache = CompletionCache(str(tmp_path / "llm.db"))
+    key = CompletionCache.make_key("gpt-4o", 0.0, [{"role": "user", "content": "hi"}])
+    assert cache.get(key) is None
+    cache.put(key, "hello")
+    assert cache.get(key) == "hello"
+    assert CompletionCache.make_key("gpt-4o", 0.5, "hi") != key
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_ttl(tmp_path, monkeypatch):
+    cache = CompletionCache(str(tmp_path / "llm.db"), ttl=60)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    cache.put("a", "1")
+    monkeypatch.setattr(time, "time", lambda: now + 30)
+    assert cache.get("a") == "1"
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("a") is None
+    # 過期的項目直接刪除
+    assert cache.stats()["size"] == 0
+
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    cache = CompletionCache(str(tmp_path / "llm.db"), ttl=0, max_entries=2)
+    clock = iter(range(100))
+    monkeypatch.setattr(time, "time", lambda: float(next(clock)))
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()["size"] == 2
+
+
+class FakeOpenAIServer:
+    """回傳固定內容的 chat completions API，記錄請求次數。"""
+
+    def __init__(self, tool_calls: bool = False) -> None:
+        self.requests = 0
+        self.tool_calls = tool_calls
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        message = {"role": "assistant", "content": f"answer {self.requests}"}
+        if self.tool_calls:
+            message["tool_calls"] = [
+                {
+                    "id": "call_1",
+                    "type": "function",
+                    "function": {"name": "tool", "arguments": "{}"},
+                }
+            ]
+        body = {
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": json.loads(request.content)["model"],
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        }
+        return httpx.Response(200, json=body)
+
+
+def make_llm(tmp_path, server: FakeOpenAIServer, **kwargs) -> CachedOpenAI:
+    return CachedOpenAI(
+        cache=CompletionCache(str(tmp_path / "llm.db")),
+        api_key="test",
+        max_retries=0,
+        http_client=httpx.Client(transport=httpx.MockTransport(server)),
+        async_http_client=httpx.AsyncClient(transport=httpx.MockTransport(server)),
+        **kwargs,
+    )
+
+
+def test_cached_openai_complete(tmp_path):
+    server = FakeOpenAIServer()
+    llm = make_llm(tmp_path, server, temperature=0)
+    assert str(llm.complete("問題")) == "answer 1"
+    assert str(llm.complete("問題")) == "answer 1"
+    assert str(llm.complete("另一個問題")) == "answer 2"
+    assert server.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_openai_shares_cache_between_sync_and_async(tmp_path):
+    server = FakeOpenAIServer()
+    llm = make_llm(tmp_path, server)
+    assert str(llm.complete("問題")) == "answer 1"
+    assert str(await llm.acomplete("問題")) == "answer 1"
+    # 溫度不同的 LLM 不共用回應
+    other = make_llm(tmp_path, server, temperature=0.9)
+    assert str(await other.acomplete("問題")) == "answer 2"
+    assert server.requests == 2
+
+
+def test_tool_calls_are_not_cached(tmp_path):
+    server = FakeOpenAIServer(tool_calls=True)
+    llm = make_llm(tmp_path, server)
+    llm.complete("問題")
+    llm.complete("問題")
+    assert server.requests == 2
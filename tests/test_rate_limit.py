@@ -0,0 +1,109 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from instrumentation import MetricsRecorder
+from rate_limit import (BACKGROUND, INTERACTIVE, RateLimitedTransport,
+                        RateLimiter, background_priority, estimate_tokens)
+
+
+def make_limiter(**kwargs) -> RateLimiter:
+    return RateLimiter("test", recorder=MetricsRecorder(), **kwargs)
+
+
+def test_estimate_tokens():
+    body = json.dumps({"input": ["abcdef", "一二"]}).encode()
+    assert estimate_tokens(body) == (2 + 1) + (2 + 1)
+    body = json.dumps(
+        {"messages": [{"role": "user", "content": "abcdef"}], "max_tokens": 10}
+    ).encode()
+    assert estimate_tokens(body) == 2 + 4 + len("[]") // 3 + 10
+    assert estimate_tokens(b"not json") == 2
+
+
+def test_requests_per_minute():
+    # 每秒 20 個請求，容量 1 個
+    limiter = make_limiter(requests_per_minute=1200, burst_seconds=0.05)
+    start = time.perf_counter()
+    for _ in range(4):
+        limiter.acquire_sync()
+    assert time.perf_counter() - start == pytest.approx(0.15, abs=0.1)
+
+
+def test_tokens_per_minute():
+    limiter = make_limiter(tokens_per_minute=6000, burst_seconds=1)
+    assert limiter._reserve(100, INTERACTIVE) == 0
+    # 容量 100 已用完，補充 50 個 token 需要 0.5 秒
+    assert limiter._reserve(50, INTERACTIVE) == pytest.approx(0.5, abs=0.05)
+
+
+def test_background_reserve():
+    limiter = make_limiter(requests_per_minute=600, background_reserve=0.5)
+    # 容量 100 個請求，背景請求不能用掉最後 50 個
+    limiter.requests.level = 50
+    assert limiter._reserve(0, BACKGROUND) > 0
+    assert limiter._reserve(0, INTERACTIVE) == 0
+
+
+def test_background_yields_to_waiting_interactive():
+    limiter = make_limiter(requests_per_minute=600)
+    limiter._set_waiting(INTERACTIVE, 1)
+    assert limiter._reserve(0, BACKGROUND) > 0
+    limiter._set_waiting(INTERACTIVE, -1)
+    assert limiter._reserve(0, BACKGROUND) == 0
+
+
+@pytest.mark.asyncio
+async def test_background_priority_context():
+    limiter = make_limiter(requests_per_minute=600)
+    limiter._set_waiting(INTERACTIVE, 1)
+    with background_priority():
+        task = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.1)
+    assert not task.done()
+    limiter._set_waiting(INTERACTIVE, -1)
+    await asyncio.wait_for(task, 1)
+
+
+def test_throttled_response_pauses_and_slows_down():
+    limiter = make_limiter(requests_per_minute=600)
+    limiter.update(httpx.Response(429, headers={"retry-after-ms": "200"}))
+    assert limiter._scale == 0.5
+    assert limiter._reserve(0, INTERACTIVE) == pytest.approx(0.2, abs=0.05)
+    assert limiter.recorder.snapshot()["counters"] == {"rate_limit:test:throttled": 1}
+
+    limiter.update(httpx.Response(200))
+    assert limiter._scale == pytest.approx(0.55)
+    assert limiter._failures == 0
+
+
+def test_remaining_header_caps_bucket():
+    limiter = make_limiter(requests_per_minute=600, tokens_per_minute=60000)
+    limiter.update(
+        httpx.Response(
+            200,
+            headers={
+                "x-ratelimit-remaining-requests": "3",
+                "x-ratelimit-remaining-tokens": "1000",
+            },
+        )
+    )
+    assert limiter.requests.level == 3
+    assert limiter.tokens.level == 1000
+
+
+def test_transport_routes_by_path():
+    llm_limiter = make_limiter(requests_per_minute=600)
+    embedding_limiter = make_limiter(requests_per_minute=600)
+    transport = RateLimitedTransport(
+        httpx.MockTransport(lambda request: httpx.Response(429)),
+        llm_limiter,
+        embedding_limiter,
+    )
+    with httpx.Client(transport=transport) as client:
+        client.post("https://api.openai.com/v1/embeddings", json={"input": "a"})
+    assert embedding_limiter._scale == 0.5
+    assert llm_limiter._scale == 1.0
@@ -0,0 +1,84 @@
+import numpy as np
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
+from lexical import BM25Index, tokenize
+from retrievers import HybridRetriever, union_nodes
+
+NODES = [
+    TextNode(id_="a", text="本公司二０二三年溫室氣體排放量為 1.5 萬噸"),
+    TextNode(id_="b", text="董事會由七名董事組成，其中三名為獨立董事"),
+    TextNode(id_="c", text="再生能源使用比例提升，溫室氣體排放持續下降"),
+    TextNode(id_="d", text="員工福利與職業安全衛生"),
+]
+
+
+def test_tokenize():
+    tokens = tokenize("ＥＳＧ報告 2023年 1.5萬噸")
+    assert tokens == ["esg", "報告", "2023", "年", "1.5", "萬噸"]
+
+
+def test_bm25_query():
+    index = BM25Index.from_nodes(NODES)
+    hits = index.query("溫室氣體排放量", top_k=3)
+    assert [node_id for node_id, _ in hits] == ["a", "c"]
+    assert hits[0][1] > hits[1][1] > 0
+    assert index.query("獨立董事", top_k=3)[0][0] == "b"
+    assert index.query("不存在的詞彙", top_k=3) == []
+
+
+def test_bm25_persist_round_trip(tmp_path):
+    index = BM25Index.from_nodes(NODES)
+    index.persist(str(tmp_path))
+    assert BM25Index.exists(str(tmp_path))
+    loaded = BM25Index.from_persist_dir(str(tmp_path))
+    assert loaded.query("溫室氣體", 4) == index.query("溫室氣體", 4)
+
+
+def test_bm25_query_without_tokens():
+    # 全部 chunk 都斷不出詞時平均長度為 0，不能產生 NaN 分數
+    index = BM25Index.from_nodes([TextNode(id_="x", text="--"), TextNode(id_="y")])
+    assert index.avg_doc_len == 1.0
+    assert index.query("溫室氣體", top_k=2) == []
+    index = BM25Index(["x"], [0], {"溫室": (np.asarray([0]), np.asarray([1.0]))})
+    hits = index.query("溫室", top_k=1)
+    assert hits[0][0] == "x" and np.isfinite(hits[0][1])
+
+
+def make_hybrid(**kwargs) -> HybridRetriever:
+    docstore = SimpleDocumentStore()
+    docstore.add_documents(NODES)
+    return HybridRetriever(
+        vector_retriever=None,
+        lexical_index=BM25Index.from_nodes(NODES),
+        docstore=docstore,
+        **kwargs,
+    )
+
+
+def test_rrf_fuse():
+    retriever = make_hybrid(rrf_k=60)
+    vector_nodes = [
+        NodeWithScore(node=NODES[3], score=0.9),
+        NodeWithScore(node=NODES[0], score=0.8),
+    ]
+    fused = retriever._fuse(vector_nodes, [("a", 5.0), ("c", 3.0), ("missing", 1.0)])
+    # a 在兩邊都有名次，排在只出現在一邊的節點前面；docstore 沒有的節點略過
+    assert [node.node.node_id for node in fused] == ["a", "d", "c"]
+    assert fused[0].score == 1 / 62 + 1 / 61
+    assert fused[1].score == 1 / 61
+    assert fused[2].score == 1 / 62
+
+
+def test_rrf_fuse_top_k():
+    retriever = make_hybrid(similarity_top_k=1)
+    fused = retriever._fuse([], [("c", 3.0), ("a", 1.0)])
+    assert [node.node.node_id for node in fused] == ["c"]
+
+
+def test_union_nodes():
+    first = [NodeWithScore(node=NODES[0], score=0.9), NodeWithScore(node=NODES[1])]
+    second = [NodeWithScore(node=NODES[1], score=0.5), NodeWithScore(node=NODES[0])]
+    union = union_nodes([first, second])
+    assert [node.node.node_id for node in union] == ["a", "b"]
+    assert [node.score for node in union] == [0.9, 0.5]
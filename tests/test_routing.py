@@ -0,0 +1,91 @@
+import pytest
+
+from events import IndustryMap
+from routing import AhoCorasick, CompanyRouter, IndustryIndex
+
+
+@pytest.fixture
+def industry_map() -> list[IndustryMap]:
+    return [
+        IndustryMap(company="2882", industry=["金融業"], alias=["國泰金控", "國泰"]),
+        IndustryMap(company="2881", industry=["金融業"], alias=["富邦金控", "富邦"]),
+        IndustryMap(company="1216", industry=["食品業"], alias=["統一企業", "統一"]),
+        IndustryMap(company="2887", industry=["金融業"], alias=["台新金控", "台新"]),
+        IndustryMap(company="5880", industry=["金融業"], alias=["合庫金控", "台新"]),
+        IndustryMap(company="2884", industry=["金融業"], alias=["玉山金控", "玉山"]),
+    ]
+
+
+def test_aho_corasick_find_all_overlapping():
+    matcher = AhoCorasick({"he": 1, "she": 2, "his": 3, "hers": 4})
+    assert sorted(matcher.find_all("ushers")) == [(1, 4, 2), (2, 4, 1), (2, 6, 4)]
+
+
+def test_aho_corasick_find_longest_is_case_insensitive():
+    matcher = AhoCorasick({"國泰": "short", "國泰金控": "long", "ESG": "esg"})
+    assert matcher.find_longest("國泰金控的esg報告與國泰") == [
+        (0, 4, "long"),
+        (5, 8, "esg"),
+        (11, 13, "short"),
+    ]
+    assert matcher.find_longest("沒有關鍵字") == []
+
+
+def test_company_router(industry_map):
+    router = CompanyRouter(["2882", "2881", "2887", "5880"], industry_map)
+    assert router.route("富邦與國泰金控的碳排放") == ["2881", "2882"]
+    assert router.route("2882 的董事會") == ["2882"]
+    # 不在查詢範圍的公司不會被比對
+    assert router.route("統一企業的用水量") == []
+    # 同一個別名對應多家公司時全部列出
+    assert router.route("台新的董事會") == ["2887", "5880"]
+
+
+def test_industry_index_rewrites_industries(industry_map):
+    index = IndustryIndex(["2882", "2881", "1216"], industry_map)
+    resolution = index.resolve("金融業的溫室氣體排放")
+    assert resolution.companies == ["2882", "2881"]
+    assert resolution.query == "國泰金控、富邦金控的溫室氣體排放"
+    assert resolution.ambiguous == {}
+
+    # 公司別名優先於產業比對，「國泰金控」不會被當成產業
+    resolution = index.resolve("國泰金控與食品業的再生能源")
+    assert resolution.companies == ["2882", "1216"]
+    assert resolution.query == "國泰金控與統一企業的再生能源"
+
+
+def test_industry_index_reports_ambiguous_aliases(industry_map):
+    index = IndustryIndex(["2887", "5880", "1216"], industry_map)
+    resolution = index.resolve("台新的董事會")
+    assert resolution.companies == ["2887", "5880"]
+    assert resolution.ambiguous == {"台新": ["2887", "5880"]}
+
+
+def test_industry_table_prompt(industry_map):
+    index = IndustryIndex(["2882", "1216"], industry_map)
+    table = index.table_prompt()
+    assert "國泰金控、國泰公司是金融業的公司，這是他們的資料2882" in table
+    assert "富邦" not in table
+    assert "2882" not in index.table_prompt(["1216"])
+
+
+def test_industry_index_reports_unresolved_companies(industry_map):
+    index = IndustryIndex(["2882", "2884"], industry_map)
+    resolution = index.resolve("國泰金控與中華電信公司的用電量")
+    assert resolution.companies == ["2882"]
+    assert resolution.unresolved == ["與中華電信公司"]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "玉山金控的董事長和總經理是誰？",
+        "玉山的溫室氣體排放量與用電量",
+        "國泰金控參與哪些倡議",
+    ],
+)
+def test_industry_index_ignores_connectors(industry_map, query):
+    # 連接詞旁沒有疑似公司名稱時，仍是只提及一家公司的問題
+    resolution = IndustryIndex(["2882", "2884"], industry_map).resolve(query)
+    assert len(resolution.companies) == 1
+    assert resolution.unresolved == []
@@ -0,0 +1,147 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from starlette.requests import ClientDisconnect
+
+import server
+from events import ProgressEvent, TokenEvent
+from workflow import Config
+
+
+class FakeWorkflow:
+    def __init__(self, wait: asyncio.Event = None) -> None:
+        self.wait = wait
+
+    async def run(self, question: str) -> str:
+        return f"answer: {question}"
+
+    async def astream(self, question: str):
+        yield ProgressEvent(message="收到問題")
+        if self.wait is not None:
+            await self.wait.wait()
+        yield TokenEvent(delta="answer")
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    industry_file = tmp_path / "industry.json"
+    industry_file.write_text("[]")
+    monkeypatch.setattr(Config, "ESG_DIR_PATH", str(tmp_path))
+    monkeypatch.setattr(Config, "INDUSTRY_FILE_PATH", str(industry_file))
+    monkeypatch.setattr(Config, "ANSWER_CACHE", False)
+    service = server.QueryService(max_concurrent=1, max_queued=0)
+    service.create_workflow = FakeWorkflow
+    server.app.state.service = service
+    return service
+
+
+def client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=server.app), base_url="http://test"
+    )
+
+
+@pytest.mark.asyncio
+async def test_query(service):
+    async with client() as http:
+        response = await http.post("/query", json={"question": "碳排放"})
+        assert response.json() == {"answer": "answer: 碳排放"}
+        response = await http.post("/query", json={"question": " "})
+        assert response.status_code == 400
+    assert service.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_busy(service):
+    assert service.reserve()
+    async with client() as http:
+        for path in ("/query", "/query/stream"):
+            response = await http.post(path, json={"question": "碳排放"})
+            assert response.status_code == 503
+    service.release()
+    assert service.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_query_stream(service):
+    async with client() as http:
+        response = await http.post("/query/stream", json={"question": "碳排放"})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [
+        {"type": "progress", "message": "收到問題"},
+        {"type": "token", "delta": "answer"},
+        {"type": "done"},
+    ]
+    assert service.pending == 0
+
+
+async def call_stream(receive, send, spec_version: str = "2.0") -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": spec_version},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/query/stream",
+        "raw_path": b"/query/stream",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    await server.app(scope, receive, send)
+
+
+def request_body() -> list[dict]:
+    body = json.dumps({"question": "碳排放"}).encode()
+    return [{"type": "http.request", "body": body, "more_body": False}]
+
+
+@pytest.mark.asyncio
+async def test_stream_disconnect_before_start_releases_reservation(service):
+    messages = request_body()
+
+    async def receive() -> dict:
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        # 用戶端在回應開始前就斷線，產生器完全不會執行
+        raise OSError("connection reset")
+
+    with pytest.raises(ClientDisconnect):
+        await call_stream(receive, send, spec_version="2.4")
+    assert service.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_disconnect_mid_stream_releases_reservation(service):
+    wait = asyncio.Event()
+    service.create_workflow = lambda: FakeWorkflow(wait)
+    messages = request_body()
+    disconnected = asyncio.Event()
+    sent = []
+
+    async def receive() -> dict:
+        if messages:
+            return messages.pop(0)
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+        if message.get("body"):
+            disconnected.set()
+
+    await asyncio.wait_for(call_stream(receive, send), 1)
+    assert json.loads(sent[1]["body"]) == {"type": "progress", "message": "收到問題"}
+    assert service.pending == 0
+    # 執行名額也已釋放，下一個問題可以立即執行
+    async with client() as http:
+        response = await asyncio.wait_for(
+            http.post("/query", json={"question": "碳排放"}), 1
+        )
+    assert response.status_code == 200
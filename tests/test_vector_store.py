@@ -0,0 +1,232 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.simple import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from vector_store import (ConsolidatedVectorStore, MmapVectorStore,
+                          QuantizedMatrix, convert_json_store, list_companies,
+                          normalize)
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+
+
+@pytest.fixture
+def vectors() -> np.ndarray:
+    return np.random.default_rng(0).normal(size=(200, 32)).astype(np.float32)
+
+
+def make_nodes(vectors: np.ndarray) -> list[TextNode]:
+    return [
+        TextNode(id_=f"n{i}", text=str(i), embedding=vector.tolist())
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def persist(store: MmapVectorStore, persist_dir) -> None:
+    store.persist(MmapVectorStore.persist_path(str(persist_dir)))
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_score_matches_cosine(vectors, dtype):
+    matrix = QuantizedMatrix.from_vectors(vectors, dtype)
+    queries = vectors[:3] + 0.1
+    expected = normalize(queries) @ normalize(vectors).T
+    atol = 1e-5 if dtype == "float32" else 2e-2
+    assert np.allclose(matrix.score(queries), expected, atol=atol)
+    rows = np.array([150, 3, 42])
+    assert np.allclose(matrix.score(queries, rows), expected[:, rows], atol=atol)
+
+
+def test_score_chunks(vectors, monkeypatch):
+    matrix = QuantizedMatrix.from_vectors(vectors, "int8")
+    expected = matrix.score(vectors[:2])
+    # 每個區塊只有 3 列
+    monkeypatch.setattr("vector_store.SCORE_CHUNK_BYTES", 32 * 4 * 3)
+    assert np.allclose(matrix.score(vectors[:2]), expected)
+
+
+def test_truncated_dims(vectors):
+    matrix = QuantizedMatrix.from_vectors(vectors, "float32", dims=8)
+    assert matrix.data.shape == (200, 8)
+    assert matrix.full is not None
+    assert QuantizedMatrix.from_vectors(vectors, "int8", keep_full=False).full is None
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_persist_round_trip(tmp_path, vectors, dtype):
+    store = MmapVectorStore(dtype=dtype)
+    store.add(make_nodes(vectors))
+    persist(store, tmp_path)
+    assert MmapVectorStore.exists(str(tmp_path))
+
+    loaded = MmapVectorStore.from_persist_dir(str(tmp_path))
+    assert loaded.dtype == dtype
+    assert loaded.node_ids == store.node_ids
+    query = VectorStoreQuery(query_embedding=vectors[7].tolist(), similarity_top_k=3)
+    result = loaded.query(query)
+    assert result.ids[0] == "n7"
+    atol = 1e-5 if dtype == "float32" else 2e-2
+    assert result.similarities[0] == pytest.approx(1.0, abs=atol)
+    assert result.ids == store.query(query).ids
+
+
+def test_query_node_ids(vectors):
+    store = MmapVectorStore()
+    store.add(make_nodes(vectors))
+    query = VectorStoreQuery(
+        query_embedding=vectors[7].tolist(),
+        similarity_top_k=2,
+        node_ids=["n3", "n7", "missing"],
+    )
+    assert store.query(query).ids == ["n7", "n3"]
+
+
+def test_delete_nodes(tmp_path, vectors):
+    store = MmapVectorStore()
+    store.add(make_nodes(vectors))
+    store.delete_nodes(["n7", "n8"])
+    assert "n7" not in store.node_ids
+    assert len(store.vectors) == 198
+
+    persist(store, tmp_path)
+    loaded = MmapVectorStore.from_persist_dir(str(tmp_path))
+    query = VectorStoreQuery(query_embedding=vectors[7].tolist(), similarity_top_k=5)
+    assert "n7" not in loaded.query(query).ids
+    query = VectorStoreQuery(query_embedding=vectors[9].tolist(), similarity_top_k=1)
+    assert loaded.query(query).ids == ["n9"]
+
+
+def test_remove(tmp_path, vectors):
+    store = MmapVectorStore()
+    store.add(make_nodes(vectors))
+    persist(store, tmp_path)
+    MmapVectorStore.remove(str(tmp_path))
+    assert not MmapVectorStore.exists(str(tmp_path))
+    assert not list(tmp_path.iterdir())
+
+
+def test_rescore_uses_full_vectors(tmp_path, vectors):
+    store = MmapVectorStore(dtype="int8", dims=4)
+    store.add(make_nodes(vectors))
+    persist(store, tmp_path)
+    # 前 4 維與 n11 相同，其餘維度是雜訊
+    query_embedding = vectors[11].copy()
+    query_embedding[4:] = np.random.default_rng(1).normal(size=28)
+    exact = normalize(vectors) @ normalize(query_embedding)
+    query = VectorStoreQuery(
+        query_embedding=query_embedding.tolist(), similarity_top_k=1
+    )
+
+    truncated = MmapVectorStore.from_persist_dir(str(tmp_path)).query(query)
+    assert truncated.ids == ["n11"]
+    assert truncated.similarities[0] == pytest.approx(1.0, abs=1e-2)
+
+    loaded = MmapVectorStore.from_persist_dir(str(tmp_path), rescore=len(vectors))
+    assert loaded.vectors.full is not None
+    result = loaded.query(query)
+    assert result.ids == [f"n{exact.argmax()}"]
+    assert result.similarities[0] == pytest.approx(exact.max(), abs=1e-5)
+
+
+def test_convert_json_store(tmp_path, vectors):
+    simple_store = SimpleVectorStore()
+    simple_store.add(make_nodes(vectors))
+    simple_store.persist(str(tmp_path / "default__vector_store.json"))
+
+    store = convert_json_store(str(tmp_path))
+    assert MmapVectorStore.exists(str(tmp_path))
+    assert (tmp_path / "default__vector_store.json").exists()
+    loaded = MmapVectorStore.from_persist_dir(str(tmp_path))
+    assert loaded.node_ids == store.node_ids == [f"n{i}" for i in range(200)]
+    query = VectorStoreQuery(query_embedding=vectors[42].tolist(), similarity_top_k=1)
+    assert loaded.query(query).ids == simple_store.query(query).ids == ["n42"]
+
+
+@pytest.fixture
+def esg_dir(tmp_path, vectors):
+    """三家公司：A、B 為二進位格式，C 為 JSON 格式，另有不是公司的目錄。"""
+    for company, part in zip("AB", (vectors[:80], vectors[80:150])):
+        store = MmapVectorStore()
+        store.add(make_nodes(part))
+        persist(store, tmp_path / company / "vector")
+    simple_store = SimpleVectorStore()
+    simple_store.add(make_nodes(vectors[150:]))
+    simple_store.persist(str(tmp_path / "C" / "vector" / "default__vector_store.json"))
+    (tmp_path / "industry_map" / "vector").mkdir(parents=True)
+    (tmp_path / "consolidated").mkdir()
+    return tmp_path
+
+
+def test_list_companies(esg_dir):
+    assert sorted(list_companies(str(esg_dir))) == ["A", "B", "C"]
+
+
+def test_consolidated_batch_query(esg_dir, vectors):
+    store = ConsolidatedVectorStore.build(str(esg_dir), ["A", "B", "C"])
+    assert store.ranges == {"A": (0, 80), "B": (80, 150), "C": (150, 200)}
+
+    results = store.batch_query([vectors[3], vectors[160]], 2)
+    assert results[0]["A"][0] == ("n3", pytest.approx(1.0, abs=1e-5))
+    assert results[1]["C"][0][0] == "n10"
+    assert all(len(hits) == 2 for hits in results[0].values())
+
+    # 只搜尋指定的公司，不存在的公司略過
+    results = store.batch_query([vectors[3]], 1, ["B", "missing"])
+    assert list(results[0]) == ["B"]
+
+
+def test_consolidated_persist_round_trip(esg_dir, vectors):
+    store = ConsolidatedVectorStore.build(
+        str(esg_dir), ["A", "B", "C"], "int8", rescore=4
+    )
+    assert store.vectors.full is not None
+    store.persist(str(esg_dir / "consolidated"))
+
+    loaded = ConsolidatedVectorStore.from_persist_dir(str(esg_dir / "consolidated"))
+    assert loaded.rescore == 4
+    assert loaded.node_ids == store.node_ids
+    hits = loaded.batch_query([vectors[100]], 1)[0]["B"]
+    assert hits == [("n20", pytest.approx(1.0, abs=1e-5))]
+    overridden = ConsolidatedVectorStore.from_persist_dir(
+        str(esg_dir / "consolidated"), rescore=0
+    )
+    assert overridden.rescore == 0
+
+
+def test_consolidated_covers(esg_dir):
+    store = ConsolidatedVectorStore.build(str(esg_dir), ["A", "B"])
+    store.persist(str(esg_dir / "consolidated"))
+    loaded = ConsolidatedVectorStore.from_persist_dir(str(esg_dir / "consolidated"))
+    assert loaded.covers("A", str(esg_dir / "A" / "vector"))
+    assert not loaded.covers("C", str(esg_dir / "C" / "vector"))
+
+    # 合併後重新建立索引的公司改用自己的向量
+    os.utime(esg_dir / "A" / "vector" / "default__vector_store_ids.json")
+    os.utime(esg_dir / "consolidated" / "consolidated_ids.json", (0, 0))
+    loaded = ConsolidatedVectorStore.from_persist_dir(str(esg_dir / "consolidated"))
+    assert not loaded.covers("A", str(esg_dir / "A" / "vector"))
+
+
+def test_consolidate_cli(esg_dir):
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SRC_DIR, "vector_store.py"),
+            "consolidate",
+            str(esg_dir),
+            "--dtype",
+            "float16",
+            "--rescore",
+            "3",
+        ],
+        check=True,
+    )
+    store = ConsolidatedVectorStore.from_persist_dir(str(esg_dir / "consolidated"))
+    assert store.companies == ["A", "B", "C"]
+    assert store.vectors.dtype == "float16"
+    assert store.rescore == 3
@@ -0,0 +1,269 @@
+import asyncio
+import time
+from typing import Callable
+
+import pytest
+from llama_index.core.base.llms.types import CompletionResponse
+from llama_index.core.workflow import StartEvent, StopEvent
+
+from answer_cache import SemanticAnswerCache
+from events import (ChooseAgentEvent, IndustryMap, QueryPlan,
+                    QueryReceivedEvent, RetrieverEvent,
+                    RetrieverResponseEvent, SubqueriesGeneratedEvent,
+                    Subquery)
+from mock_models import HashEmbedding
+from workflow import Config, ESGReportWorkflow
+
+INDUSTRY_MAP = [
+    IndustryMap(company="2882", industry=["金融業"], alias=["國泰金控", "國泰"]),
+    IndustryMap(company="2881", industry=["金融業"], alias=["富邦金控", "富邦"]),
+    IndustryMap(company="1216", industry=["食品業"], alias=["統一企業", "統一"]),
+    IndustryMap(company="2887", industry=["金融業"], alias=["台新金控", "台新"]),
+    IndustryMap(company="5880", industry=["金融業"], alias=["合庫金控", "台新"]),
+]
+
+
+class ScriptedLLM:
+    """依序回傳 `responses`，用完後回傳 `default`，並記錄收到的 prompt。"""
+
+    def __init__(self, responses: list[str] = (), default: str = "") -> None:
+        self.responses = list(responses)
+        self.default = default
+        self.prompts: list[str] = []
+
+    async def acomplete(self, prompt: str, **kwargs) -> CompletionResponse:
+        self.prompts.append(prompt)
+        text = self.responses.pop(0) if self.responses else self.default
+        return CompletionResponse(text=text)
+
+
+class FakeContext:
+    """workflow Context 的替身，只提供步驟用到的 data 與 collect_events。"""
+
+    def __init__(self, **data) -> None:
+        self.data = data
+        self.collected = []
+
+    def collect_events(self, ev, expected):
+        self.collected.append(ev)
+        return list(self.collected) if len(self.collected) == len(expected) else None
+
+
+class FakeAgent:
+    def __init__(self, name: str, delay: float = 0.0) -> None:
+        self.name = name
+        self.delay = delay
+        self.queries: list[str] = []
+
+    async def aquery(self, query: str) -> str:
+        self.queries.append(query)
+        await asyncio.sleep(self.delay)
+        return f"[{self.name}] {query}"
+
+
+def make_workflow(
+    agents: dict[str, FakeAgent], **llms: ScriptedLLM
+) -> ESGReportWorkflow:
+    workflow = ESGReportWorkflow(
+        esg_agents_map=agents, industry_map=INDUSTRY_MAP, timeout=10
+    )
+    workflow.ai_model = llms.get("ai_model", ScriptedLLM())
+    workflow.planner_llm = llms.get("planner_llm", ScriptedLLM())
+    return workflow
+
+
+@pytest.mark.asyncio
+async def test_choose_agent_routes_locally():
+    agents = {"2882": FakeAgent("2882"), "2881": FakeAgent("2881")}
+    workflow = make_workflow(agents)
+    event = await workflow.choose_esg_agent(
+        ChooseAgentEvent(query="溫室氣體排放量", company="國泰金控")
+    )
+    assert isinstance(event, RetrieverEvent)
+    assert event.agent_name == "2882"
+    assert event.agent is agents["2882"]
+    assert workflow.ai_model.prompts == []
+
+
+@pytest.mark.asyncio
+async def test_choose_agent_falls_back_to_llm(capsys):
+    agents = {"2887": FakeAgent("2887"), "5880": FakeAgent("5880")}
+    workflow = make_workflow(agents, ai_model=ScriptedLLM(["合庫金控"]))
+    event = await workflow.choose_esg_agent(
+        ChooseAgentEvent(query="董事會", company="台新")
+    )
+    assert event.agent_name == "5880"
+    # 只把比對到的候選公司交給 LLM，prompt 不輸出到 stdout
+    assert "['2887', '5880']" in workflow.ai_model.prompts[0]
+    assert capsys.readouterr().out == ""
+
+
+@pytest.mark.asyncio
+async def test_choose_agent_without_match():
+    agents = {"2882": FakeAgent("2882")}
+    workflow = make_workflow(agents, ai_model=ScriptedLLM(["不存在的公司"]))
+    event = await workflow.choose_esg_agent(ChooseAgentEvent(query="台積電的用水量"))
+    assert not isinstance(event, RetrieverEvent)
+    assert "找不到" in event.response
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_keyed_by_companies():
+    answer_cache = SemanticAnswerCache(HashEmbedding(model_name="hash"))
+    agents = {"2882": FakeAgent("2882"), "2881": FakeAgent("2881")}
+    workflow = make_workflow(agents)
+    workflow.answer_cache = answer_cache
+    embedding = await answer_cache.aembed("國泰金控的碳排放")
+    answer_cache.add(embedding, "cached", ["2882"])
+
+    event = await workflow.receive_query(
+        FakeContext(), StartEvent(question="國泰金控的碳排放？")
+    )
+    assert isinstance(event, StopEvent)
+    assert event.result == "cached"
+
+    # 問題相近但提及不同公司時不使用快取
+    ctx = FakeContext()
+    event = await workflow.receive_query(ctx, StartEvent(question="富邦金控的碳排放"))
+    assert isinstance(event, QueryReceivedEvent)
+    assert ctx.data["query_companies"] == ["2881"]
+
+
+def all_agents() -> dict[str, FakeAgent]:
+    return {item.company: FakeAgent(item.company) for item in INDUSTRY_MAP}
+
+
+def plan(*subqueries: tuple[str, str], exists: bool = True) -> str:
+    return QueryPlan(
+        exists=exists,
+        subqueries=[Subquery(company=c, query=q) for c, q in subqueries],
+    ).model_dump_json()
+
+
+@pytest.mark.asyncio
+async def test_plan_query_single_company_skips_llm():
+    planner = ScriptedLLM()
+    workflow = make_workflow(all_agents(), planner_llm=planner)
+    event = await workflow.plan_query(
+        QueryReceivedEvent(query="國泰金控的董事長和總經理")
+    )
+    assert isinstance(event, SubqueriesGeneratedEvent)
+    assert event.subqueries == [
+        Subquery(company="2882", query="國泰金控的董事長和總經理")
+    ]
+    assert planner.prompts == []
+
+
+@pytest.mark.asyncio
+async def test_plan_query_retries_invalid_json():
+    planner = ScriptedLLM(
+        [
+            "not json",
+            plan(("國泰金控", "國泰金控的碳排"), ("富邦金控", "富邦金控的碳排")),
+        ]
+    )
+    workflow = make_workflow(all_agents(), planner_llm=planner)
+    event = await workflow.plan_query(QueryReceivedEvent(query="比較國泰與富邦的碳排"))
+    assert [subquery.company for subquery in event.subqueries] == [
+        "國泰金控",
+        "富邦金控",
+    ]
+    assert len(planner.prompts) == 2
+    # 重試時附上驗證錯誤
+    assert planner.prompts[1].startswith(planner.prompts[0])
+    assert len(planner.prompts[1]) > len(planner.prompts[0])
+
+
+@pytest.mark.asyncio
+async def test_plan_query_falls_back_after_retries(monkeypatch):
+    monkeypatch.setattr(Config, "PLANNER_MAX_RETRIES", 1)
+    planner = ScriptedLLM(default="not json")
+    workflow = make_workflow(all_agents(), planner_llm=planner)
+    event = await workflow.plan_query(QueryReceivedEvent(query="比較國泰與富邦的碳排"))
+    assert len(planner.prompts) == 2
+    # 退回本地比對到的公司，每家公司查詢完整問題
+    assert [subquery.company for subquery in event.subqueries] == ["2882", "2881"]
+    assert {subquery.query for subquery in event.subqueries} == {"比較國泰與富邦的碳排"}
+
+    event = await workflow.plan_query(QueryReceivedEvent(query="中華電信公司的碳排"))
+    assert isinstance(event, StopEvent)
+    assert event.result == "無法解析問題，請換個方式描述"
+
+
+@pytest.mark.asyncio
+async def test_plan_query_company_not_in_table():
+    planner = ScriptedLLM([plan(exists=False)])
+    workflow = make_workflow(all_agents(), planner_llm=planner)
+    event = await workflow.plan_query(
+        QueryReceivedEvent(query="國泰金控與中華電信公司")
+    )
+    assert isinstance(event, StopEvent)
+    assert event.result == "該公司或是產業不存在於產業查詢表中"
+
+
+@pytest.mark.asyncio
+async def test_retrieve_times_out_at_deadline():
+    workflow = make_workflow({})
+    event = RetrieverEvent(
+        agent=FakeAgent("2882", delay=1),
+        agent_name="2882",
+        query="碳排放",
+        deadline=time.monotonic() + 0.05,
+    )
+    start = time.perf_counter()
+    response = await workflow.retrieve(event)
+    assert time.perf_counter() - start < 0.5
+    assert response.timed_out
+    assert response.agent_name == "2882"
+    assert response.response == "「碳排放」查詢逾時，未取得資料。"
+
+
+async def collect(workflow: ESGReportWorkflow, events: list[RetrieverResponseEvent]):
+    answer_cache = SemanticAnswerCache(HashEmbedding(model_name="hash"))
+    workflow.answer_cache = answer_cache
+    ctx = FakeContext(
+        subqueries_count=len(events),
+        main_query="國泰與富邦的碳排放",
+        query_embedding=await answer_cache.aembed("國泰與富邦的碳排放"),
+        query_companies=["2882", "2881"],
+    )
+    results = [await workflow.collect_ai_responses(ctx, event) for event in events]
+    assert results[:-1] == [None] * (len(events) - 1)
+    return results[-1], answer_cache
+
+
+@pytest.mark.asyncio
+async def test_collect_reports_timed_out_companies():
+    ai_model = ScriptedLLM(default="answer")
+    workflow = make_workflow({}, ai_model=ai_model)
+    result, answer_cache = await collect(
+        workflow,
+        [
+            RetrieverResponseEvent(response="國泰的資料", agent_name="2882"),
+            RetrieverResponseEvent(
+                response="「富邦」查詢逾時，未取得資料。",
+                agent_name="2881",
+                timed_out=True,
+            ),
+        ],
+    )
+    assert result.result == "answer"
+    assert "timed out and returned no data: 2881" in ai_model.prompts[-1]
+    # 缺少部分公司資料的答案不放入快取
+    assert len(answer_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_collect_caches_complete_answers():
+    ai_model = ScriptedLLM(default="answer")
+    workflow = make_workflow({}, ai_model=ai_model)
+    result, answer_cache = await collect(
+        workflow,
+        [
+            RetrieverResponseEvent(response="國泰的資料", agent_name="2882"),
+            RetrieverResponseEvent(response="富邦的資料", agent_name="2881"),
+        ],
+    )
+    assert result.result == "answer"
+    assert "timed out" not in ai_model.prompts[-1]
+    assert len(answer_cache) == 1